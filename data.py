@@ -4,6 +4,8 @@ import numpy as np
 import pickle
 import os
 import dask.dataframe as ddf
+import utils.storage as storage
+from utils.cache import LRUCache
 
 # original files
 TRAIN_ORIGINAL_PATH = 'dataset/original/train.csv'
@@ -22,184 +24,142 @@ DICT_COL_PATH = ['dataset/matrices/full/dict_col.npy', 'dataset/matrices/local/d
 ITEMS_PATH = 'dataset/preprocessed/item_metadata.csv'
 ACCOMODATIONS_1HOT_PATH = 'dataset/preprocessed/accomodations_1hot.csv'
 
+# vocabularies of the global integer encodings (see preprocess_utils/create_encodings.py)
+ENCODINGS_PATH = 'dataset/preprocessed/encodings/'
+# column -> name of the vocabulary used to encode it
+ENCODED_COLUMNS = {
+    'user_id': 'user_id',
+    'session_id': 'session_id',
+    'city': 'city',
+    'platform': 'platform',
+    'item_id': 'item_id',
+    'reference': 'item_id',
+}
+
 # config file
 CONFIG_FILE_PATH = 'dataset/config.pkl'
 TRAIN_LEN_KEY = 'max_train_idx'
 
-_df_train_original = None
-_df_test_original = None
-_df_original_items = None
-
-_df_full = None
+# memory budget of the cache of the accessors below, in bytes (None for no limit)
+CACHE_BUDGET = 32 * 2 ** 30
 
-_df_train = {}
-_df_test = {}
-_target_indices = {}
+# all the dataframes, matrices and arrays loaded by the accessors, keyed by (accessor name, path, ...)
+_cache = LRUCache(CACHE_BUDGET)
 
-_df_classification_train = {}
-_df_classification_test = {}
-
-_df_catboost_train = {}
-_df_catboost_test = {}
+# constants
+SPLIT_USED = 'no_cluster'
 
-_dataset_xgboost_train = {}
-_dataset_xgboost_test = {}
 
+def cached(key, load):
+    """ Return the object cached with key, calling load() to load it if it is not cached """
+    return _cache.get(key, load)
 
-_dataset_xgboost_classifier_train = {}
-_dataset_xgboost_classifier_test = {}
 
-_df_accomodations_one_hot = None
+def invalidate(match=None):
+    """
+    Drop from the cache the entries of an accessor (eg: invalidate('train_df')), or the ones whose key
+    satisfies match if it is a function, or all of them if None
+    """
+    return _cache.invalidate(match)
 
-_user_prop = {}
 
-_df_items = None
-_df_items_ids = None
-# URM structures
-_urm = {}
-_dict_row = {}
-_dict_col = {}
-_icm = None
+def set_cache_budget(budget):
+    """ Set the memory budget of the cache in bytes, evicting the least recently used entries if needed """
+    _cache.set_budget(budget)
 
-_full_train_indices = None
-_full_test_indices = None
 
-# constants
-SPLIT_USED = 'no_cluster'
+def cache_stats():
+    """ Return the hits, misses, evictions and the size in bytes of the entries of the cache """
+    return _cache.stats()
 
 
 def full_df():
-    global _df_full
-    if _df_full is None:
+    def load():
         print('caching df_full...', flush=True)
-        _df_full = pd.read_csv(FULL_PATH, index_col=0)
+        df = storage.load_df(FULL_PATH)
         print('Done!')
-    return _df_full
+        return df
+    return cached(('full_df', FULL_PATH), load)
 
 def refresh_full_df():
-    global _df_full
     print('refreshing df_full...', flush=True)
-    _df_full = pd.read_csv(FULL_PATH, index_col=0)
-    print('Done!')
+    invalidate('full_df')
+    full_df()
 
 def original_train_df():
-    global _df_train_original
-    if _df_train_original is None:
-        _df_train_original = pd.read_csv(TRAIN_ORIGINAL_PATH)
-    return _df_train_original
+    return cached(('original_train_df', TRAIN_ORIGINAL_PATH), lambda: pd.read_csv(TRAIN_ORIGINAL_PATH))
 
 
 def original_test_df():
-    global _df_test_original
-    if _df_test_original is None:
-        _df_test_original = pd.read_csv(TEST_ORIGINAL_PATH)
-    return _df_test_original
+    return cached(('original_test_df', TEST_ORIGINAL_PATH), lambda: pd.read_csv(TEST_ORIGINAL_PATH))
 
 
-def train_df(mode, cluster='no_cluster'):
-    global _df_train
+def train_df(mode, cluster='no_cluster', columns=None):
+    """ Return the train split. Pass columns to load only a subset of the columns """
     path = 'dataset/preprocessed/{}/{}/train.csv'.format(cluster, mode)
-    if path not in _df_train:
-        if mode == "full" and cluster == 'no_cluster':
-            print("Loading {} train_df, it will take a while..".format(mode), flush=True)
-        _df_train[path] = pd.read_csv(path, index_col=0)
-
-    return _df_train[path]
+    key = ('train_df', path, None if columns is None else tuple(columns))
+    if key not in _cache and mode == "full" and cluster == 'no_cluster':
+        print("Loading {} train_df, it will take a while..".format(mode), flush=True)
+    return cached(key, lambda: storage.load_df(path, columns=columns))
 
 
-def test_df(mode, cluster='no_cluster'):
-    global _df_test
+def test_df(mode, cluster='no_cluster', columns=None):
+    """ Return the test split. Pass columns to load only a subset of the columns """
     path = 'dataset/preprocessed/{}/{}/test.csv'.format(cluster, mode)
-    if path not in _df_test:
-        _df_test[path] = pd.read_csv(path, index_col=0)
-    return _df_test[path]
+    key = ('test_df', path, None if columns is None else tuple(columns))
+    return cached(key, lambda: storage.load_df(path, columns=columns))
 
 
 def target_indices(mode, cluster='no_cluster'):
-    global _target_indices
     path = 'dataset/preprocessed/{}/{}/target_indices.npy'.format(
         cluster, mode)
-    if path not in _target_indices:
-        _target_indices[path] = np.load(path)
-    return _target_indices[path]
+    return cached(('target_indices', path), lambda: np.load(path))
 
 
 def dataset_xgboost_train(mode, cluster='no_cluster', kind='kind1', class_weights=False):
-    global _dataset_xgboost_train
     bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
-    if not 'a' in _dataset_xgboost_train:
-        _dataset_xgboost_train[bp+'a'] = sps.load_npz(
-            os.path.join(bp, 'X_train.npz'))
-        _dataset_xgboost_train[bp+'b'] = pd.read_csv(
-            os.path.join(bp, 'y_train.csv'))['label'].to_dense()
-        _dataset_xgboost_train[bp+'c'] = np.load(
-            os.path.join(bp, 'group_train.npy'))
-        _dataset_xgboost_train[bp+'e'] = np.load(
-            os.path.join(bp, 'train_indices.npy'))
-        _dataset_xgboost_train[bp+'f'] = pd.read_csv(
-            os.path.join(bp, 'user_session_item_train.csv'))
-        if class_weights:
-            _dataset_xgboost_train[bp+'d'] = np.load(
-            os.path.join(bp, 'class_weights.npy'))
+
+    def load():
+        return sps.load_npz(os.path.join(bp, 'X_train.npz')), \
+            pd.read_csv(os.path.join(bp, 'y_train.csv'))['label'], \
+            np.load(os.path.join(bp, 'group_train.npy')), \
+            np.load(os.path.join(bp, 'train_indices.npy')), \
+            storage.load_df(os.path.join(bp, 'user_session_item_train.csv'), index_col=None)
+
+    res = cached(('dataset_xgboost_train', bp), load)
     if class_weights:
-        return _dataset_xgboost_train[bp+'a'], \
-            _dataset_xgboost_train[bp+'b'], \
-            _dataset_xgboost_train[bp+'c'], \
-            _dataset_xgboost_train[bp+'e'], \
-            _dataset_xgboost_train[bp+'f'], \
-            _dataset_xgboost_train[bp + 'd']
-    else:
-        return _dataset_xgboost_train[bp + 'a'], \
-               _dataset_xgboost_train[bp + 'b'], \
-               _dataset_xgboost_train[bp + 'c'], \
-               _dataset_xgboost_train[bp + 'e'], \
-               _dataset_xgboost_train[bp + 'f']
+        path = os.path.join(bp, 'class_weights.npy')
+        res = res + (cached(('dataset_xgboost_train', path), lambda: np.load(path)),)
+    return res
 
 def dataset_xgboost_test(mode, cluster='no_cluster', kind='kind1'):
-    global _dataset_xgboost_test
     bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
-    if not 'a' in _dataset_xgboost_test:
+
+    def load():
         #if mode == 'full':
-        _dataset_xgboost_test[bp+'a'] = sps.load_npz(
-            os.path.join(bp, 'X_test.npz'))
+        X_test = sps.load_npz(os.path.join(bp, 'X_test.npz'))
         #else:
-        #    _dataset_xgboost_test[bp+'a'] = pd.read_csv(
-        #        os.path.join(bp, 'X_test.csv'), index_col=0)
-        _dataset_xgboost_test[bp+'b'] = pd.read_csv(
-            os.path.join(bp, 'y_test.csv'))['label'].to_dense()
-        _dataset_xgboost_test[bp+'c'] = np.load(
-            os.path.join(bp, 'group_test.npy'))
-        _dataset_xgboost_test[bp+'d'] = pd.read_csv(
-            os.path.join(bp, 'user_session_item_test.csv'))
-    return _dataset_xgboost_test[bp+'a'], \
-           _dataset_xgboost_test[bp+'b'], \
-           _dataset_xgboost_test[bp+'c'], \
-           _dataset_xgboost_test[bp+'d'],
+        #    X_test = pd.read_csv(os.path.join(bp, 'X_test.csv'), index_col=0)
+        return X_test, \
+            pd.read_csv(os.path.join(bp, 'y_test.csv'))['label'], \
+            np.load(os.path.join(bp, 'group_test.npy')), \
+            storage.load_df(os.path.join(bp, 'user_session_item_test.csv'), index_col=None)
+
+    return cached(('dataset_xgboost_test', bp), load)
 
 def dataset_xgboost_classifier_train(mode, cluster='no_cluster'):
-    global _dataset_xgboost_classifier_train
     path = 'dataset/preprocessed/{}/{}/xgboost_classifier/train.csv'.format(cluster, mode)
-    if path not in _dataset_xgboost_classifier_train:
-        _dataset_xgboost_classifier_train = pd.read_csv(path)
-    return _dataset_xgboost_classifier_train
+    return cached(('dataset_xgboost_classifier_train', path), lambda: storage.load_df(path, index_col=None))
 
 def dataset_xgboost_classifier_test(mode, cluster='no_cluster'):
-    global _dataset_xgboost_classifier_test
     path = 'dataset/preprocessed/{}/{}/xgboost_classifier/test.csv'.format(cluster, mode)
-    if path not in _dataset_xgboost_classifier_test:
-        _dataset_xgboost_classifier_test = pd.read_csv(path)
-    return _dataset_xgboost_classifier_test
+    return cached(('dataset_xgboost_classifier_test', path), lambda: storage.load_df(path, index_col=None))
 
 def classification_train_df(mode, sparse=True, cluster='no_cluster', algo='xgboost'):
-    global _df_classification_train
     path = 'dataset/preprocessed/{}/{}/{}/classification_train.csv'.format(
         cluster, mode, algo)
-    if sparse:
-        tot_path = path + 'dense'
-    else:
-        tot_path = path + 'sparse'
 
-    if tot_path not in _df_classification_train:
+    def load():
         if sparse:
             data = ddf.read_csv(path, dtype={'1 Star filter active when clickout': 'float64',
                                              '2 Nights filter active when clickout': 'float64',
@@ -208,22 +168,17 @@ def classification_train_df(mode, sparse=True, cluster='no_cluster', algo='xgboo
             data = data.map_partitions(lambda part: part.to_sparse(fill_value=0))
             data = data.compute().reset_index(drop=True)
             data = data.drop(['Unnamed: 0'], axis=1)
-            _df_classification_train[tot_path] = data
+            return data
         else:
-            _df_classification_train[tot_path] = pd.read_csv(path, index_col=0)
+            return storage.load_df(path)
 
-    return _df_classification_train[tot_path]
+    return cached(('classification_train_df', path, sparse), load)
 
 
 def classification_test_df(mode, sparse=True, cluster='no_cluster', algo='xgboost'):
-    global _df_classification_test
     path = 'dataset/preprocessed/{}/{}/{}/classification_test.csv'.format(cluster, mode, algo)
-    if sparse:
-        tot_path = path + 'dense'
-    else:
-        tot_path = path + 'sparse'
 
-    if tot_path not in _df_classification_test:
+    def load():
         if sparse:
             data = ddf.read_csv(path, dtype={'1 Night filter active when clickout': 'float64',
                                              '1 Star filter active when clickout': 'float64',
@@ -242,114 +197,109 @@ def classification_test_df(mode, sparse=True, cluster='no_cluster', algo='xgboos
                 lambda part: part.to_sparse(fill_value=0))
             data = data.compute().reset_index(drop=True)
             data = data.drop(['Unnamed: 0'], axis=1)
-            _df_classification_test[tot_path] = data
+            return data
         else:
-            _df_classification_test[tot_path] = pd.read_csv(path, index_col=0)
+            return storage.load_df(path)
 
-    return _df_classification_test[tot_path]
+    return cached(('classification_test_df', path, sparse), load)
 
 
 
 def dataset_catboost_train(mode, cluster='no_cluster'):
-    global _df_catboost_train
     path = 'dataset/preprocessed/{}/{}/{}/train.csv'.format(cluster, mode, 'catboost')
-
-    if path not in _df_catboost_train:
-        _df_catboost_train[path] = pd.read_csv(path)
-
-    return _df_catboost_train[path]
+    return cached(('dataset_catboost_train', path), lambda: storage.load_df(path, index_col=None))
 
 def dataset_catboost_test(mode, cluster='no_cluster'):
-    global _df_catboost_test
     path = 'dataset/preprocessed/{}/{}/{}/test.csv'.format(cluster, mode, 'catboost')
-
-    if path not in _df_catboost_test:
-        _df_catboost_test[path] = pd.read_csv(path)
-
-    return _df_catboost_test[path]
+    return cached(('dataset_catboost_test', path), lambda: storage.load_df(path, index_col=None))
 
 def train_indices(mode):
-    global _full_train_indices
     path = 'dataset/preprocessed/{}/{}/train_indices.npy'.format(SPLIT_USED, mode)
-    if _full_train_indices is None:
-        _full_train_indices = pd.Index(np.load(path))
-    return _full_train_indices
+    return cached(('train_indices', path), lambda: pd.Index(np.load(path)))
 
 
 def test_indices(mode):
-    global _full_test_indices
     path = 'dataset/preprocessed/{}/{}/test_indices.npy'.format(SPLIT_USED, mode)
-    if _full_test_indices is None:
-        _full_test_indices = pd.Index(np.load(path))
-    return _full_test_indices
+    return cached(('test_indices', path), lambda: pd.Index(np.load(path)))
 
 
 def accomodations_df():
-    global _df_items
-    if _df_items is None:
-        _df_items = pd.read_csv(ITEMS_PATH)
-    return _df_items
+    return cached(('accomodations_df', ITEMS_PATH), lambda: pd.read_csv(ITEMS_PATH))
 
 
 def accomodations_ids():
-    global _df_items_ids
-    if _df_items_ids is None:
-        _df_items_ids = list(map(int, accomodations_df()['item_id'].values))
-    return _df_items_ids
+    return cached(('accomodations_ids', ITEMS_PATH),
+                  lambda: list(map(int, accomodations_df()['item_id'].values)))
 
 
 def accomodations_original_df():
-    global _df_original_items
-    if _df_original_items is None:
-        _df_original_items = pd.read_csv(ITEMS_ORIGINAL_PATH)
-    return _df_original_items
+    return cached(('accomodations_original_df', ITEMS_ORIGINAL_PATH), lambda: pd.read_csv(ITEMS_ORIGINAL_PATH))
 
 
 def accomodations_one_hot():
-    global _df_accomodations_one_hot
     if not os.path.isfile(ACCOMODATIONS_1HOT_PATH):
         print('Accomodations one-hot not found! Creating it...', flush=True)
         import preprocess_utils.session2vec as sess2vec
         sess2vec.save_accomodations_one_hot(accomodations_df(), ACCOMODATIONS_1HOT_PATH)
-    if _df_accomodations_one_hot is None:
+
+    def load():
         print('Loading accomodations one-hot...', flush=True)
-        _df_accomodations_one_hot = pd.read_csv(ACCOMODATIONS_1HOT_PATH, index_col=0).astype('int8')
-    return _df_accomodations_one_hot
+        return pd.read_csv(ACCOMODATIONS_1HOT_PATH, index_col=0).astype('int8')
+    return cached(('accomodations_one_hot', ACCOMODATIONS_1HOT_PATH), load)
 
 
 # URM structures
 def urm(mode, cluster, type, urm_name='urm_clickout'):
-    global _urm
     path = f'dataset/preprocessed/{cluster}/{mode}/matrices/{type}/{urm_name}.npz'
-    if path not in _urm:
-        _urm[path] = sps.load_npz(path)
-    return _urm[path]
+    return cached(('urm', path), lambda: sps.load_npz(path))
 
 
 def icm():
-    global _icm
     # note is used the urm path since it is dataset/matrices/full/
     icm_path = '{}{}.npz'.format(URM_PATH[0], 'icm')
-    if _icm is None:
-        _icm = sps.load_npz(icm_path)
-    return _icm
+    return cached(('icm', icm_path), lambda: sps.load_npz(icm_path))
 
 
 def dictionary_row(mode, urm_name, type, cluster='no_cluster'):
-    global _dict_row
     path = f'dataset/preprocessed/{cluster}/{mode}/matrices/{type}/{urm_name}_dict_row.npy'
-    if path not in _dict_row:
-        _dict_row[path] = np.load(path).item()
-    return _dict_row[path]
+    return cached(('dictionary_row', path), lambda: np.load(path).item())
 
 
 def dictionary_col(mode, urm_name, type, cluster='no_cluster'):
-    # global _dict_col
-    global _dict_col
     path = f'dataset/preprocessed/{cluster}/{mode}/matrices/{type}/{urm_name}_dict_col.npy'
-    if path not in _dict_col:
-        _dict_col[path] = np.load(path).item()
-    return _dict_col[path]
+    return cached(('dictionary_col', path), lambda: np.load(path).item())
+
+
+def vocabulary(name):
+    """ Return the vocabulary of an encoding as a pd.Index: the code of a value is its position """
+    path = os.path.join(ENCODINGS_PATH, '{}.npy'.format(name))
+    return cached(('vocabulary', path), lambda: pd.Index(np.load(path, allow_pickle=True)))
+
+def encode(values, name):
+    """ Return the int32 codes of the values in the specified vocabulary, -1 for the unknown values """
+    voc = vocabulary(name)
+    values = np.asarray(values)
+    if voc.dtype.kind in 'iu' and values.dtype.kind not in 'iuf':
+        # eg: the references are strings, and not all of them are items
+        values = pd.to_numeric(values, errors='coerce')
+    return voc.get_indexer(values).astype(np.int32)
+
+
+def decode(codes, name):
+    """ Return the values of the codes in the specified vocabulary, NaN for the code -1 """
+    return pd.api.extensions.take(vocabulary(name).values, np.asarray(codes), allow_fill=True)
+
+
+def encode_df(df, columns=None):
+    """ Return a copy of the df with the encoded columns (all the ones in ENCODED_COLUMNS if None) """
+    columns = [c for c in (columns or ENCODED_COLUMNS) if c in df.columns]
+    return df.assign(**{c: encode(df[c].values, ENCODED_COLUMNS[c]) for c in columns})
+
+
+def decode_df(df, columns=None):
+    """ Inverse of encode_df """
+    columns = [c for c in (columns or ENCODED_COLUMNS) if c in df.columns]
+    return df.assign(**{c: decode(df[c].values, ENCODED_COLUMNS[c]) for c in columns})
 
 
 # those 2 functions let you save arbitrary fields in this file and recover those back
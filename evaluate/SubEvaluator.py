@@ -1,7 +1,10 @@
 import utils.functions as f
+import utils.evaluation as evaluation
 import os
+import json
 
 import data
+import numpy as np
 import pandas as pd
 
 from tqdm import tqdm
@@ -20,6 +23,20 @@ cool_string = """
 """
 
 
+# segments of the ground truth: name -> predicate on the ground truth rows, with the session attributes
+# added by SubEvaluator.segment_columns (device, session_length, has_num_reference)
+DEFAULT_SEGMENTS = {
+    'gt_only_mobile': lambda df: df['mobile'],
+    'gt_only_desktop': lambda df: df['desktop'],
+    'gt_only_one_interaction_sessions': lambda df: df['session_length'] == 1,
+    'gt_only_two_interaction_sessions': lambda df: df['session_length'] == 2,
+    'gt_less_than_5_interaction_sessions': lambda df: df['session_length'] < 5,
+    'gt_5_to_10_interaction_sessions': lambda df: (df['session_length'] > 4) & (df['session_length'] < 11),
+    'gt_more_than_10_interaction_sessions': lambda df: df['session_length'] > 10,
+    'gt_no_num_reference_sessions': lambda df: (df['session_length'] > 1) & ~df['has_num_reference'],
+}
+
+
 class SubEvaluator():
     """
     Evaluator of a local submission.
@@ -34,10 +51,72 @@ class SubEvaluator():
     - the ground truth file (test with the missing clickouts)
     """
 
-    def __init__(self, sub):
+    def __init__(self, sub, segments=None):
+        """
+        segments (dict): name -> predicate returning the boolean mask of the ground truth rows in the segment,
+            DEFAULT_SEGMENTS if None (see segment_columns for the available columns)
+        """
         self.current_directory = Path(__file__).absolute().parent
         self.data_directory = self.current_directory.joinpath('..', 'submissions/evaluator')
         self.sub = sub
+        self.segments = DEFAULT_SEGMENTS if segments is None else segments
+
+    def _print_score(self, mrr, total_score=-1):
+        if total_score != -1:
+            if mrr > total_score:
+                print('\033[1;40m Score: '+ f'\033[1;32;40m {mrr}'+ '\033[1;40m    :)' + '\033[0;37;40m')
+            elif mrr < total_score-0.02 and mrr > total_score-0.04:
+                print('\033[1;40m Score: '+ f'\033[1;31;40m {mrr}'+ '\033[1;40m    :(' + '\033[0;37;40m')
+            elif mrr < total_score - 0.04:
+                print('\033[1;40m Score: '+ f'\033[1;31;40m {mrr}'+ '\033[1;40m    ¯\_(⊙︿⊙)_/¯     <--------- PROBLEM HERE!' + '\033[0;37;40m')
+            else:
+                print('\033[1;40m Score: '+ f'\033[1;33;40m {mrr}'+ '\033[1;40m     :|' + '\033[0;37;40m')
+        else:
+            print('\033[1;40m Score: '+ f'\033[1;32;40m {mrr}'+ '\033[0;37;40m')
+
+    def segment_columns(self, df_test):
+        """
+        Return the attributes of the test sessions used to define the segments, indexed by session_id:
+        mobile, desktop, tablet (the session has an interaction from that device), session_length
+        and has_num_reference (the session has a numeric reference)
+        """
+        sessions = df_test['session_id']
+        res = pd.DataFrame({'session_length': sessions.groupby(sessions).size()})
+        for device in ['mobile', 'desktop', 'tablet']:
+            res[device] = (df_test['device'] == device).groupby(sessions).any()
+        numeric = df_test['reference'].astype(str).str.isnumeric() & df_test['reference'].notnull()
+        res['has_num_reference'] = numeric.groupby(sessions).any()
+        return res
+
+    def evaluate(self):
+        """
+        Load the ground truth and the submission once and score all the segments.
+        Return a dataframe with the MRR and the dimension (% of the ground truth) of the overall
+        ground truth and of each segment.
+        """
+        df_gt = f.read_into_df(self.data_directory.joinpath('ground_truth.csv'))
+        df_subm = f.read_into_df(self.data_directory.joinpath(self.sub))
+
+        # attach the segment columns to the ground truth rows
+        attributes = self.segment_columns(data.test_df('local'))
+        session_ids = df_gt.index.get_level_values('session_id')
+        df_gt = df_gt.assign(**{c: attributes[c].reindex(session_ids).values for c in attributes.columns})
+        for c in ['mobile', 'desktop', 'tablet', 'has_num_reference']:
+            df_gt[c] = df_gt[c].fillna(False).astype(bool)
+
+        # score all the rows of the ground truth found in the submission at once
+        joined = df_gt.join(df_subm[['item_recommendations']], how='inner')
+        joined.reference = joined.reference.astype(int)
+        rr = evaluation.submission_reciprocal_ranks(joined)
+
+        masks = {name: np.asarray(predicate(joined), dtype=bool) for name, predicate in self.segments.items()}
+        report = evaluation.mrr(rr, masks)
+        # dimension of the segments as % of the ground truth
+        report['dimension'] = [int(np.asarray(predicate(df_gt), dtype=bool).sum() * 100 / len(df_gt))
+                               for predicate in self.segments.values()]
+        total = pd.DataFrame({'mrr': [evaluation.mrr(rr)], 'size': [len(rr)], 'dimension': [100]},
+                             index=pd.Index(['ground_truth'], name='segment'))
+        return pd.concat([total, report])
 
     def score_sub(self, sub_path, gt_csv, total_score=-1):
         cluster_name = os.path.basename(self.data_directory.joinpath(gt_csv))
@@ -59,33 +138,19 @@ class SubEvaluator():
         return mrr
 
     def run(self, save_path=None):
-        self.generate_clusters()
         print(f'\033[33;40m {cool_string}'+'\033[0;37;40m')
-        gt_list = [
-        'gt_only_mobile.csv',
-        'gt_only_desktop.csv',
-        'gt_only_one_interaction_sessions.csv',
-        'gt_only_two_interaction_sessions.csv',
-        'gt_less_than_5_interaction_sessions.csv',
-        'gt_5_to_10_interaction_sessions.csv',
-        'gt_more_than_10_interaction_sessions.csv',
-        #TODO ADD OTHER CLUSTERS
-        'gt_no_num_reference_sessions.csv'
-        ]
-
-        total_score = self.score_sub(self.sub, self.data_directory.joinpath('ground_truth.csv'))
+        report = self.evaluate()
+        total_score = report.loc['ground_truth', 'mrr']
+        print("Computing score for"+f"\033[1;35;40m {self.sub}"+ '\033[0;37;40m')
+        self._print_score(total_score)
+
         dict_scores = {} # per tener traccia degli scores
         dict_cluster_dim = {} # per tener traccia della dimensione del cluster
-        df_gt = pd.read_csv(self.data_directory.joinpath('ground_truth.csv'))
-        gt_dim = df_gt.shape[0]
-        for gt in gt_list:
-            sub_name = os.path.basename(self.data_directory.joinpath(gt))  # questo serve per estrarre solo in nome, perché per il full se no aggiugne il nome della dir
-            sub_name = os.path.splitext(sub_name)[0]
-            mrr = self.score_sub(self.sub, self.data_directory.joinpath('gt_clusters', gt), total_score)
-            dict_scores[sub_name] = mrr
-            tmp = pd.read_csv(self.data_directory.joinpath('gt_clusters', gt))
-            cluster_dim = tmp.shape[0]
-            dict_cluster_dim[sub_name] = int((cluster_dim*100)/(gt_dim))
+        for sub_name in self.segments:
+            print("Score for cluster" + f"\033[1;35;40m {sub_name}"+ '\033[0;37;40m')
+            self._print_score(report.loc[sub_name, 'mrr'], total_score)
+            dict_scores[sub_name] = report.loc[sub_name, 'mrr']
+            dict_cluster_dim[sub_name] = report.loc[sub_name, 'dimension']
 
         print('\n===========================================')
         print('\033[1;40m RECAP:'+'\033[0;37;40m')
@@ -107,8 +172,14 @@ class SubEvaluator():
         if save_path is not None:
             with open(f"{save_path}", "w+") as text_file:
                 array_strings = [f'\033[33;40m {cool_string}'+'\033[0;37;40m\n', '\n===========================================\n',
-                                 '\033[1;40m RECAP:' + '\033[0;37;40m', f'\033[1;40m OVERALL SCORE: {total_score}'+'\033[0;37;40m', x]
+                                 '\033[1;40m RECAP:' + '\033[0;37;40m', f'\033[1;40m OVERALL SCORE: {total_score}'+'\033[0;37;40m', str(x)]
                 text_file.writelines(array_strings)
+            # machine-readable report next to the pretty table
+            report_path = os.path.splitext(save_path)[0] + '.json'
+            with open(report_path, 'w') as report_file:
+                json.dump({'submission': str(self.sub), 'segments': report.reset_index().to_dict(orient='records')},
+                          report_file, indent=2, default=float)
+        return report
 
 
 
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 class AdjustedLocationReferencePercentageOfClickouts(FeatureBase):
@@ -26,7 +26,7 @@ class AdjustedLocationReferencePercentageOfClickouts(FeatureBase):
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
         # get last clickout rows
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         clickout_rows = df.loc[last_clickout_indices,
             ['user_id','session_id','city','reference','impressions']][df.action_type == 'clickout item']
         # get reference rows WITH last clickout
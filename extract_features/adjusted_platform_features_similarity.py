@@ -27,7 +27,8 @@ class AdjustedPlatformFeaturesSimilarity(FeatureBase):
     def __init__(self, mode, metric='cosine', cluster='no_cluster'):
         name = 'adjusted_platform_features_similarity'
         super(AdjustedPlatformFeaturesSimilarity, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode=mode)])
         self.metric = metric
 
     def extract_feature(self):
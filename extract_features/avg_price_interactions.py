@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 tqdm.pandas()
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 from extract_features.rnn.impressions_average_price import ImpressionsAveragePrice
 import numpy as np
@@ -26,7 +26,7 @@ class AvgPriceInteractions(FeatureBase):
         train = data.train_df(self.mode, cluster=self.cluster)
         test = data.test_df(self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        idxs_click = sorted(find_last_clickout_indices(df))
+        idxs_click = sorted(find_split(self.mode, self.cluster))
 
         # for every last clickout index, retrieve the list 
         # of all the clickouts for that session
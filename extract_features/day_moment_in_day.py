@@ -2,7 +2,7 @@ import pandas as pd
 from tqdm.auto import tqdm
 tqdm.pandas()
 from extract_features.feature_base import FeatureBase
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 import data
 import numpy as np
 import pytz
@@ -101,7 +101,7 @@ class DayOfWeekAndMomentInDay(FeatureBase):
 
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
-        df_indices = find(pd.concat([train, test]))
+        df_indices = find_split(self.mode, self.cluster)
         df = pd.concat([train, test]).loc[df_indices]
 
         df['day'] = func(df)
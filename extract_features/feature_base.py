@@ -1,9 +1,12 @@
 from abc import abstractmethod
 from abc import ABC
+import inspect
+import hashlib
+import json
 
 from category_encoders import BinaryEncoder
 
-from utils.check_folder import check_folder
+import utils.storage as storage
 import pandas as pd
 from utils.menu import yesno_choice
 import os
@@ -20,7 +23,8 @@ make available a new feature
 class FeatureBase(ABC):
     """ Base class to create a new feature from the original files and save it to a new csv """
 
-    def __init__(self, mode, cluster='no_cluster', name='featurebase', columns_to_onehot=[], save_index=False):
+    def __init__(self, mode, cluster='no_cluster', name='featurebase', columns_to_onehot=[], save_index=False,
+                 dependencies=None):
         """
         columns_to_onehot: [(columns_header, onehot_mode), ...]
             onehot_mode: 'single' or 'multiple'
@@ -33,12 +37,16 @@ class FeatureBase(ABC):
         meaning that the header of the column to onehot is 'action' and the onehot modality is 'single'
         
         save_index (bool): whether to save or not the index in the csv
+
+        dependencies: [feature, ...] instances of the other features read by extract_feature. When one of them
+        is recreated, this feature becomes stale (see is_stale)
         """
         self.mode = mode
         self.cluster = cluster
         self.name = name
         self.columns_to_onehot = columns_to_onehot
         self.save_index = save_index
+        self.dependencies = dependencies if dependencies is not None else []
 
     @abstractmethod
     def extract_feature(self):
@@ -60,7 +68,7 @@ class FeatureBase(ABC):
         """
         path = 'dataset/preprocessed/{}/{}/feature/{}/features.csv'.format(
             self.cluster, self.mode, self.name)
-        if os.path.exists(path):
+        if storage.exists(path):
             if overwrite_if_exists == None:
                 choice = yesno_choice('The feature \'{}\' already exists. Want to recreate?'.format(self.name))
                 if choice == 'n':
@@ -68,8 +76,51 @@ class FeatureBase(ABC):
             elif not overwrite_if_exists:
                 return
         df = self.extract_feature()
-        check_folder(path)
-        df.to_csv(path, index=self.save_index)
+        storage.save_df(df, path, index=self.save_index)
+
+        # save the info needed to know when the feature becomes stale
+        with open(self.metadata_path(), 'w') as f:
+            json.dump(self.current_metadata(), f, indent=2)
+
+    def metadata_path(self):
+        return 'dataset/preprocessed/{}/{}/feature/{}/metadata.json'.format(self.cluster, self.mode, self.name)
+
+    def code_version(self):
+        """ Hash of the source file of the feature """
+        with open(inspect.getsourcefile(type(self)), 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def saved_metadata(self):
+        """ Return the metadata saved together with the feature, or None if missing """
+        if not os.path.isfile(self.metadata_path()):
+            return None
+        with open(self.metadata_path(), 'r') as f:
+            return json.load(f)
+
+    def current_metadata(self):
+        """
+        Return the metadata that the feature would have if created now: the hash of the source split,
+        the code version and the versions of the dependencies
+        """
+        meta = {
+            'split_hash': storage.split_hash(self.mode, self.cluster),
+            'code_version': self.code_version(),
+            'inputs': {},
+        }
+        for dep in self.dependencies:
+            dep_meta = dep.saved_metadata()
+            meta['inputs']['{}/{}/{}'.format(dep.cluster, dep.mode, dep.name)] = \
+                dep_meta['version'] if dep_meta is not None else None
+        meta['version'] = hashlib.md5(json.dumps(meta, sort_keys=True).encode()).hexdigest()
+        return meta
+
+    def is_stale(self):
+        """ Return True if the feature is missing or was created from a different split, code or dependencies """
+        path = 'dataset/preprocessed/{}/{}/feature/{}/features.csv'.format(self.cluster, self.mode, self.name)
+        saved = self.saved_metadata()
+        if not storage.exists(path) or saved is None:
+            return True
+        return saved['version'] != self.current_metadata()['version']
 
 
     def post_loading(self, df):
@@ -90,7 +141,7 @@ class FeatureBase(ABC):
         """
         path = 'dataset/preprocessed/{}/{}/feature/{}/features.csv'.format(
             self.cluster, self.mode, self.name)
-        if not os.path.exists(path):
+        if not storage.exists(path):
 
             if create_not_existing_features:
                 choice = 'y'
@@ -103,7 +154,7 @@ class FeatureBase(ABC):
                 return
 
         index_col = 0 if self.save_index else None
-        df = pd.read_csv(path, index_col=index_col)
+        df = storage.load_df(path, index_col=index_col)
         #df = df.drop('Unnamed: 0', axis=1)
 
         print('{} feature read'.format(self.name))
@@ -0,0 +1,210 @@
+import os
+import json
+import importlib
+import pandas as pd
+import data
+import utils.storage as storage
+from extract_features.feature_base import FeatureBase
+import preprocess_utils.impression_table as impression_table
+from preprocess_utils.last_clickout_indices import find_split
+from utils.check_folder import check_folder
+
+"""
+Feature store: keeps the features of a split up to date and serves them from a single columnar store
+keyed by (user_id, session_id, item_id).
+
+The rows of the store are the impressions of the last clickouts of the split (the same rows used by
+merge_features). Each feature is saved as a block of columns aligned to those rows, together with the
+version of the feature it was built from, so only the blocks of the recreated features are rebuilt.
+"""
+
+KEY_COLUMNS = ['user_id', 'session_id', 'item_id']
+STORE_PATH = 'dataset/preprocessed/{}/{}/feature_store/'
+
+
+def _instantiate(features, mode, cluster):
+    """
+    Return a list of (feature_instance, one_hot) from a features array in the same format used
+    by merge_features: [FeatureClass, (FeatureClass, one_hot), ...]
+    """
+    res = []
+    for f in features:
+        if type(f) == tuple:
+            res.append((f[0](mode=mode, cluster=cluster), f[1]))
+        else:
+            res.append((f(mode=mode, cluster=cluster), None))
+    return res
+
+
+def save_features_array(features_array, path, onehot=True):
+    """
+    Save the features array of a dataset (merge_features format) as a json list of module, class and one_hot,
+    so the features used to train a ranker can be read again at serving time
+    onehot (bool): one hot of the features not specified as tuple, as in merge_features
+    """
+    features_array = [f if type(f) == tuple else (f, onehot) for f in features_array]
+    with open(path, 'w') as f:
+        json.dump([{'module': cls.__module__, 'class': cls.__name__, 'one_hot': bool(one_hot)}
+                   for cls, one_hot in features_array], f, indent=2)
+
+
+def load_features_array(path):
+    """ Return the features array saved by save_features_array: [(FeatureClass, one_hot), ...] """
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    return [(getattr(importlib.import_module(e['module']), e['class']), e['one_hot']) for e in entries]
+
+
+def _block_name(feature, one_hot):
+    return feature.name if not one_hot else '{}_onehot'.format(feature.name)
+
+
+def feature_id(feature):
+    return '{}/{}/{}'.format(feature.cluster, feature.mode, feature.name)
+
+
+def dependency_order(features):
+    """ Return the features and all their dependencies in topological order (dependencies first) """
+    ordered = []
+    visited = {}
+
+    def visit(f):
+        fid = feature_id(f)
+        if visited.get(fid) == 'done':
+            return
+        if visited.get(fid) == 'visiting':
+            raise ValueError('Circular dependency found on feature {}'.format(fid))
+        visited[fid] = 'visiting'
+        for dep in f.dependencies:
+            visit(dep)
+        visited[fid] = 'done'
+        ordered.append(f)
+
+    for f in features:
+        visit(f)
+    return ordered
+
+
+def materialize(features, mode, cluster='no_cluster'):
+    """
+    Recreate the stale features (and the stale dependencies) in topological order.
+    features: list of FeatureBase instances, or features array in the merge_features format
+    Return the list of the recreated features names.
+    """
+    if len(features) > 0 and not isinstance(features[0], FeatureBase):
+        features = [f for f, _ in _instantiate(features, mode, cluster)]
+
+    recreated = []
+    for f in dependency_order(features):
+        if f.is_stale():
+            print('{} is stale, recreating...'.format(feature_id(f)), flush=True)
+            f.save_feature(overwrite_if_exists=True)
+            recreated.append(f.name)
+    print('{} features recreated: {}'.format(len(recreated), recreated))
+    return recreated
+
+
+class FeatureStore(object):
+    """ Store of the features of a split, aligned to the impressions of the last clickouts """
+
+    def __init__(self, mode, cluster='no_cluster'):
+        self.mode = mode
+        self.cluster = cluster
+        self.path = STORE_PATH.format(cluster, mode)
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        self._keys = None
+
+    def _load_manifest(self):
+        if not os.path.isfile(self.manifest_path):
+            return {}
+        with open(self.manifest_path, 'r') as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest):
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    def _block_path(self, block_name):
+        return os.path.join(self.path, '{}.csv'.format(block_name))
+
+    def keys(self):
+        """ Return the rows of the store: user_id, session_id, item_id and index of the clickout """
+        if self._keys is None:
+            keys_path = os.path.join(self.path, 'keys.csv')
+            split_hash = storage.split_hash(self.mode, self.cluster)
+            manifest = self._load_manifest()
+            if manifest.get('split_hash') != split_hash or not storage.exists(keys_path):
+                print('creating feature store keys of {} {}...'.format(self.cluster, self.mode), flush=True)
+                cols = ['user_id', 'session_id']
+                df = pd.concat([data.train_df(self.mode, self.cluster, columns=cols),
+                                data.test_df(self.mode, self.cluster, columns=cols)])
+                idxs = sorted(find_split(self.mode, self.cluster))
+                keys = impression_table.load(self.mode, self.cluster).expand_df(df.loc[idxs])
+                check_folder(self.path, point_allowed_path=True)
+                storage.save_df(keys, keys_path, index=False, write_csv=False)
+                # a new split invalidates all the blocks
+                self._save_manifest({'split_hash': split_hash, 'blocks': {}, 'columns': {}, 'on': {}})
+            self._keys = storage.load_df(keys_path, index_col=None)
+        return self._keys
+
+    def update(self, features):
+        """
+        Recreate the stale features and rebuild their blocks in the store.
+        features: features array in the merge_features format
+        """
+        instances = _instantiate(features, self.mode, self.cluster)
+        materialize([f for f, _ in instances], self.mode, self.cluster)
+
+        keys = self.keys()
+        manifest = self._load_manifest()
+        manifest.setdefault('on', {})
+        for f, one_hot in instances:
+            block_name = _block_name(f, one_hot)
+            version = f.saved_metadata()['version']
+            if manifest['blocks'].get(block_name) == version and block_name in manifest['on'] \
+                    and storage.exists(self._block_path(block_name)):
+                continue
+
+            print('storing {}...'.format(block_name), flush=True)
+            feature = f.read_feature(one_hot=bool(one_hot))
+            on = [c for c in KEY_COLUMNS if c in feature.columns]
+            block = keys[on].merge(feature, how='left', on=on)
+            if len(block) != len(keys):
+                raise ValueError('Feature {} has duplicated keys {}'.format(f.name, on))
+            block = block.drop(on, axis=1)
+            storage.save_df(block, self._block_path(block_name), index=False, write_csv=False)
+
+            manifest['blocks'][block_name] = version
+            manifest['columns'][block_name] = list(map(str, block.columns))
+            manifest['on'][block_name] = on
+            self._save_manifest(manifest)
+
+    def read(self, features, columns=None):
+        """
+        Return the keys joined with the specified features, in the order of the store rows.
+        features: features array in the merge_features format
+        columns: optional list of the feature columns to load
+        """
+        self.update(features)
+        manifest = self._load_manifest()
+        blocks = [self.keys()]
+        for f, one_hot in _instantiate(features, self.mode, self.cluster):
+            block_name = _block_name(f, one_hot)
+            block_columns = None
+            if columns is not None:
+                block_columns = [c for c in manifest['columns'][block_name] if c in columns]
+            blocks.append(storage.load_df(self._block_path(block_name), columns=block_columns, index_col=None))
+        return pd.concat(blocks, axis=1)
+
+    def key_columns(self, features):
+        """
+        Return a dict column -> key columns the feature of the column is defined on (eg: ['item_id'] for the
+        features of the items), for the columns of the specified features (call read or update first)
+        """
+        manifest = self._load_manifest()
+        res = {}
+        for f, one_hot in _instantiate(features, self.mode, self.cluster):
+            block_name = _block_name(f, one_hot)
+            for c in manifest['columns'][block_name]:
+                res[c] = manifest['on'][block_name]
+        return res
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 import numpy as np
 from tqdm.auto import tqdm
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
+from preprocess_utils.last_clickout_indices import find_split
 tqdm.pandas()
 import os
 
@@ -23,7 +23,7 @@ class FractionPosPrice(FeatureBase):
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
 
-        idxs_click = find_last_clickout_indices(df)
+        idxs_click = find_split(self.mode, self.cluster)
         df = df.loc[idxs_click][['user_id', 'session_id', 'impressions', 'prices']]
 
         impression_price_position_list = []
@@ -1,4 +1,5 @@
 from extract_features.feature_base import FeatureBase
+from extract_features.impression_features import ImpressionFeature
 import data
 import pandas as pd
 from tqdm.auto import tqdm
@@ -19,7 +20,8 @@ class ImpressionFeatureCleaned(FeatureBase):
     def __init__(self, mode, cluster='no_cluster'):
         name = 'impression_features_cleaned'
         super(ImpressionFeatureCleaned, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode)])
 
     def extract_feature(self):
         from extract_features.impression_features import ImpressionFeature
@@ -2,7 +2,7 @@ from extract_features.feature_base import FeatureBase
 import data
 import pandas as pd
 from tqdm.auto import tqdm
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 
@@ -26,7 +26,7 @@ class ImpressionPositionInPercentage(FeatureBase):
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
         # get clickout rows
-        clickout_rows = df.loc[find(df), ['user_id','session_id','impressions']][df.action_type == 'clickout item']
+        clickout_rows = df.loc[find_split(self.mode, self.cluster), ['user_id','session_id','impressions']][df.action_type == 'clickout item']
         clk_expanded = expand_impressions(clickout_rows).drop(['index'],1)
         # get position
         new_col = []
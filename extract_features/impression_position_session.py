@@ -2,8 +2,8 @@ from extract_features.feature_base import FeatureBase
 import data
 import pandas as pd
 from tqdm.auto import tqdm
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
-from preprocess_utils.last_clickout_indices import expand_impressions
+from preprocess_utils.last_clickout_indices import find_split
+import preprocess_utils.impression_table as impression_table
 tqdm.pandas()
 
 
@@ -24,22 +24,13 @@ class ImpressionPositionSession(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        idxs_click = find_last_clickout_indices(df)
-        df = df.loc[idxs_click][['user_id', 'session_id', 'impressions']]
-        df = expand_impressions(df)
-        # initialize the session id
-        session_id = ''
-        count = 1
-        impression_position = []
-        for i in tqdm(df.index):
-            c_session = df.at[i, 'session_id']
-            if c_session != session_id:
-                session_id = c_session
-                count = 1
-            impression_position.append(count)
-            count += 1
-        df['impression_position'] = impression_position
-        df['impression_position']=pd.to_numeric(df['impression_position'])
+        idxs_click = find_split(self.mode, self.cluster)
+        df = df.loc[idxs_click][['user_id', 'session_id']]
+        impressions = impression_table.load(self.mode, self.cluster)
+        df = impressions.expand_df(df)
+        # positions are already stored in the impression table
+        _, impression_position, _, _ = impressions.expand(idxs_click)
+        df['impression_position'] = impression_position.astype('int')
         df.drop('index', axis=1, inplace=True)
 
         return df
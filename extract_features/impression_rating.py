@@ -18,7 +18,8 @@ class ImpressionRating(FeatureBase):
         name = 'impression_rating'
         columns_to_onehot = [('rating', 'single')]
         super(ImpressionRating, self).__init__(
-            name=name, mode=mode, cluster=cluster, columns_to_onehot=columns_to_onehot)
+            name=name, mode=mode, cluster=cluster, columns_to_onehot=columns_to_onehot,
+            dependencies=[ImpressionFeature(mode=mode)])
 
     def extract_feature(self):
         from extract_features.impression_features import ImpressionFeature
@@ -22,7 +22,8 @@ class ImpressionRatingNumeric(FeatureBase):
     def __init__(self, mode, cluster='no_cluster'):
         name = 'impression_rating_numeric'
         super(ImpressionRatingNumeric, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode=mode)])
 
     def extract_feature(self):
         from extract_features.impression_features import ImpressionFeature
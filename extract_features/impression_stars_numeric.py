@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 from extract_features.impression_features import ImpressionFeature
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 import numpy as np
 
@@ -26,7 +26,7 @@ class ImpressionStarsNumeric(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         clickout_rows = df.loc[last_clickout_indices, ['user_id','session_id','impressions']]
         clk_expanded = expand_impressions(clickout_rows)
 
@@ -3,7 +3,7 @@ import os
 sys.path.append(os.getcwd())
 
 from extract_features.feature_base import FeatureBase
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 import data
 import numpy as np
 import pandas as pd
@@ -39,7 +39,7 @@ class LastClickoutFiltersSatisfaction(FeatureBase):
                                     'focus on rating', 'focus on distance', 'best value'])
 
         # find the clickout rows
-        last_clk = find(df)
+        last_clk = find_split(self.mode, self.cluster)
         clickouts = df.loc[last_clk]
         clickouts = clickouts[['user_id','session_id','current_filters','impressions']]
         # split the filters and the impressions
@@ -33,7 +33,8 @@ class LocationFeaturesSimilarity(FeatureBase):
     def __init__(self, mode, metric='cosine', cluster='no_cluster'):
         name = 'location_features_similarity'
         super(LocationFeaturesSimilarity, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode='small')])
         self.metric = metric
 
     def extract_feature(self):
@@ -1,5 +1,5 @@
 from extract_features.feature_base import FeatureBase
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 import data
 import pandas as pd
@@ -22,7 +22,7 @@ class MeanPriceClickout(FeatureBase):
         tr = data.train_df(mode=self.mode, cluster=self.cluster)
         te = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([tr, te])
-        idxs = sorted(find(df))
+        idxs = sorted(find_split(self.mode, self.cluster))
         mean_prices = []
         for i in tqdm(idxs):
             prices = list(map(int, df.at[i, 'prices'].split('|')))
@@ -35,7 +35,8 @@ class NormalizedPlatformFeaturesSimilarity(FeatureBase):
     def __init__(self, mode, metric='cosine', cluster='no_cluster'):
         name = 'normalized_platform_features_similarity'
         super(NormalizedPlatformFeaturesSimilarity, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode=mode)])
         self.metric = metric
 
     def extract_feature(self):
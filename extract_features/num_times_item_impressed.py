@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 from collections import Counter
@@ -26,7 +26,7 @@ class NumTimesItemImpressed(FeatureBase):
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
 
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         last_clk_removed_df = df.drop(last_clickout_indices)
         reference_rows = last_clk_removed_df[(last_clk_removed_df.reference.str.isnumeric() == True) & (last_clk_removed_df.action_type =='clickout item')][['user_id','session_id','reference','impressions']]
 
@@ -1,4 +1,5 @@
 from extract_features.feature_base import FeatureBase
+from extract_features.label import ImpressionLabel
 import data
 import pandas as pd
 from tqdm.auto import tqdm
@@ -79,7 +80,8 @@ class PastFutureSessionFeatures(FeatureBase):
                              ('future_closest_action_involving_impression', 'single')]
 
         super(PastFutureSessionFeatures, self).__init__(
-            name=name, mode=mode, cluster=cluster, columns_to_onehot=columns_to_onehot)
+            name=name, mode=mode, cluster=cluster, columns_to_onehot=columns_to_onehot,
+            dependencies=[ImpressionLabel(mode=mode, cluster=cluster)])
 
         # Feature initialization
         self.features = {'past_times_interacted_impr': [], 'past_session_num': [],
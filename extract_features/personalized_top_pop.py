@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 class PersonalizedTopPop(FeatureBase):
@@ -46,7 +46,7 @@ class PersonalizedTopPop(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         clickout_rows = df.loc[last_clickout_indices, ['user_id','session_id','reference','action_type','impressions']]
         reference_rows = df[(df.reference.str.isnumeric() == True) & (df.action_type == 'clickout item')]
 
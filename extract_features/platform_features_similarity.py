@@ -33,7 +33,8 @@ class PlatformFeaturesSimilarity(FeatureBase):
     def __init__(self, mode, metric='cosine', cluster='no_cluster'):
         name = 'platform_features_similarity'
         super(PlatformFeaturesSimilarity, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode=mode)])
         self.metric = metric
 
     def extract_feature(self):
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 from preprocess_utils.remove_last_part_of_clk_sessions import remove_last_part_of_clk_sessions
 
@@ -31,7 +31,7 @@ class PlatformReferencePercentageOfInteractions(FeatureBase):
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
 
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         clickout_rows = df.loc[last_clickout_indices, ['user_id','session_id','platform','action_type','impressions']]
 
         last_clk_removed_df = df.drop(last_clickout_indices)
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 from extract_features.impression_features import ImpressionFeature
 
@@ -23,7 +23,8 @@ class PriceQuality(FeatureBase):
     def __init__(self, mode, metric='cosine', cluster='no_cluster'):
         name = 'price_quality'
         super(PriceQuality, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode=mode)])
 
     def extract_feature(self):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
@@ -31,7 +32,7 @@ class PriceQuality(FeatureBase):
         df = pd.concat([train, test])
 
         # get clk rows
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         clickout_rows = df.loc[last_clickout_indices, ['user_id','session_id','impressions','prices']]
         clk_expanded = expand_impressions(clickout_rows).drop('index',1)
 
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 class RefPopAfterFirstPosition(FeatureBase):
@@ -34,7 +34,7 @@ class RefPopAfterFirstPosition(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         all_clk_rows = df[df.reference.str.isnumeric()==True][df.action_type == 'clickout item']
         all_clk_rows = all_clk_rows [['user_id','session_id','reference','impressions']]
 
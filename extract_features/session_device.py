@@ -1,7 +1,7 @@
 from extract_features.feature_base import FeatureBase
 import data
 import pandas as pd
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
+from preprocess_utils.last_clickout_indices import find_split
 from tqdm.auto import tqdm
 tqdm.pandas()
 
@@ -24,7 +24,7 @@ class SessionDevice(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        idxs_click = find_last_clickout_indices(df)
+        idxs_click = find_split(self.mode, self.cluster)
         tuple_list = []
         for i in idxs_click:
             user = df.at[i, 'user_id']
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
+from preprocess_utils.last_clickout_indices import find_split
 tqdm.pandas()
 
 
@@ -23,7 +23,7 @@ class StatisticsTimeFromLastAction(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        idxs_click = find_last_clickout_indices(df)
+        idxs_click = find_split(self.mode, self.cluster)
         temp = df[['user_id', 'session_id', 'step', 'timestamp']]
         session_id_l = []
         length_step_l = []
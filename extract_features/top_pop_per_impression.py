@@ -5,7 +5,7 @@ from tqdm.auto import tqdm
 import numpy as np
 tqdm.pandas()
 from extract_features.impression_features import ImpressionFeature
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 
 
 class TopPopPerImpression(FeatureBase):
@@ -18,7 +18,8 @@ class TopPopPerImpression(FeatureBase):
     def __init__(self, mode, cluster='no_cluster'):
         name = 'top_pop_per_impression'
         super(TopPopPerImpression, self).__init__(
-            name=name, mode=mode, cluster=cluster)
+            name=name, mode=mode, cluster=cluster,
+            dependencies=[ImpressionFeature(mode)])
 
     def RepresentsInt(self, s):
         try:
@@ -37,7 +38,7 @@ class TopPopPerImpression(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        last_clickout_indices = find(df)
+        last_clickout_indices = find_split(self.mode, self.cluster)
         df_dropped_last_clickouts = df.drop(last_clickout_indices)
         df_no_last_clickouts = df_dropped_last_clickouts[~(df_dropped_last_clickouts.reference.isnull())]
         references = df_no_last_clickouts.reference.values
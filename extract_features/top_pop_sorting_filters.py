@@ -5,7 +5,7 @@ from extract_features.feature_base import FeatureBase
 import data
 import numpy as np
 import time
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 
 
 
@@ -47,7 +47,7 @@ class TopPopSortingFilters(FeatureBase):
         train = data.train_df(mode=self.mode, cluster=self.cluster)
         test = data.test_df(mode=self.mode, cluster=self.cluster)
         df = pd.concat([train, test])
-        indices_last_clks = find(df)
+        indices_last_clks = find_split(self.mode, self.cluster)
         d = df[df.action_type == 'clickout item'].drop(indices_last_clks)
         d_splitted = d.current_filters.progress_apply(lambda x: str(x).split('|'))
         md = d_splitted.progress_apply(mask_sorting)
@@ -3,7 +3,7 @@ import data
 import pandas as pd
 from tqdm.auto import tqdm
 import numpy as np
-from preprocess_utils.last_clickout_indices import find
+from preprocess_utils.last_clickout_indices import find_split
 from preprocess_utils.last_clickout_indices import expand_impressions
 
 class UserFeature(FeatureBase):
@@ -21,7 +21,7 @@ class UserFeature(FeatureBase):
 
 
         ######## SOME PREPROCESS + SECONDARY DATA STRUCTURE TO SPEED UP PERFOMANCES
-        clickout_indices = find(df)
+        clickout_indices = find_split(self.mode, self.cluster)
         clickout_df = df.loc[clickout_indices]
         clickout_sessions = list(clickout_df.session_id)
         session_to_impressions = dict()
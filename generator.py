@@ -5,6 +5,8 @@ import pandas as pd
 import keras
 import utils.sparsedf as sparsedf
 import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 
 class DataGenerator(keras.utils.Sequence):
     """
@@ -141,3 +143,87 @@ class DataGenerator(keras.utils.Sequence):
         
         #print('Batch creation time: {}s\n'.format(time.time() - t0))
         return out
+
+
+class ShardGenerator(keras.utils.Sequence):
+    """
+    Feed a keras model with the sharded tensors of a dataset (see utils/tensor_shards.py).
+    The batches are read from the memory-mapped shards and never cross a shard, so the order of the shards
+    can be shuffled at each epoch. The next batches are loaded in a background thread while the model is
+    fitting the current one.
+    """
+    def __init__(self, X, Y=None, samples_per_batch=256, start_sample=0, end_sample=None, shuffle=False,
+                 pre_fit_fn=None, prefetch=2):
+        """
+        X (ShardedTensor): samples
+        Y (ShardedTensor): labels, None for the test
+        start_sample, end_sample (int): range of samples to read (useful to split train and validation)
+        shuffle (bool): whether to shuffle the order of the shards at the end of each epoch
+        pre_fit_fn (fn): function called before the batch of data is fed to the model
+                         (args: Xchunk, Ychunk, index for the train, Xchunk, index for the test)
+        prefetch (int): number of batches to load in advance
+        """
+        self.X = X
+        self.Y = Y
+        self.samples_per_batch = samples_per_batch
+        self.start_sample = start_sample
+        self.end_sample = len(X) if end_sample is None else end_sample
+        self.shuffle = shuffle
+        self.prefit_fn = pre_fit_fn
+        self.prefetch = prefetch
+
+        # batches of each shard: list of (start, end) sample ranges
+        self._shard_batches = []
+        for i in range(X.shard_count):
+            start = max(self.start_sample, X.offsets[i])
+            end = min(self.end_sample, X.offsets[i + 1])
+            if start < end:
+                self._shard_batches.append([(b, min(b + samples_per_batch, end))
+                                            for b in range(start, end, samples_per_batch)])
+        self._order_batches()
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = {}
+        print(str(self))
+
+    def _order_batches(self):
+        if self.shuffle:
+            random.shuffle(self._shard_batches)
+        self.batches = [b for shard in self._shard_batches for b in shard]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __str__(self):
+        return 'Sharded dataset - {}: samples {} to {}, {} batch(es) of {} samples from {} shard(s)'.format(
+            'train' if self.Y is not None else 'test', self.start_sample, self.end_sample, len(self.batches),
+            self.samples_per_batch, len(self._shard_batches))
+
+    def _load(self, index):
+        start, end = self.batches[index]
+        if self.Y is not None:
+            return self.X.get(start, end), self.Y.get(start, end)
+        return self.X.get(start, end)
+
+    def __getitem__(self, index):
+        """ Generate and return one batch of data """
+        future = self._pending.pop(index, None)
+        batch = future.result() if future is not None else self._load(index)
+        # load the next batches in background
+        for i in range(index + 1, min(index + 1 + self.prefetch, len(self.batches))):
+            if i not in self._pending:
+                self._pending[i] = self._executor.submit(self._load, i)
+
+        if self.Y is not None:
+            if callable(self.prefit_fn):
+                return self.prefit_fn(batch[0], batch[1], index)
+            return batch
+        if callable(self.prefit_fn):
+            return self.prefit_fn(batch, index)
+        return batch
+
+    def on_epoch_end(self):
+        # the batches loaded in advance refer to the old order
+        self._pending.clear()
+        self._order_batches()
+
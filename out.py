@@ -3,6 +3,7 @@ import os
 import time
 import data
 from tqdm import tqdm
+import recommenders.reranking as reranking
 
 def create_sub(predictions, submission_name, directory='submissions', timestamp_on_name=True):
     """
@@ -26,16 +27,12 @@ def create_sub(predictions, submission_name, directory='submissions', timestamp_
 
     full = data.full_df()
 
-    indices = [item[0] for item in predictions]
+    indices, items, offsets = reranking.from_predictions(predictions)
 
     targets = full.loc[indices]
     targets.drop(targets.columns[4:12], axis=1, inplace=True)
 
-    predictions_column = []
-    for p in predictions:
-        predictions_column.append(str(p[1]).replace("[", '').replace("]", "").replace(",", ""))
-
-    targets['item_recommendations'] = predictions_column
+    targets['item_recommendations'] = reranking.join_segments(items, offsets)
     targets.to_csv(path_time, index=False)
     _time = time.time() - start
     elapsed = time.strftime('%Mm %Ss', time.gmtime(_time))
@@ -0,0 +1,365 @@
+import os
+import json
+import math
+import time
+import fcntl
+import multiprocessing as mp
+from random import Random
+import numpy as np
+import scipy.sparse as sps
+import data
+import recommenders.reranking as reranking
+import utils.evaluation as evaluation
+import utils.native_dataset as native_dataset
+from utils.check_folder import check_folder
+from utils.feature_matrix import feature_matrix
+
+"""
+Parallel random search of the hyperparameters of the rankers.
+
+The train and validation matrices are saved once as .npy files (the CSR arrays, the labels and the
+groups) and opened by each worker as read-only memory maps, so the workers share the pages of the data
+instead of holding a copy each. The native buffer of the train (DMatrix or lightgbm Dataset) is saved
+once in the binary cache of utils/native_dataset.py before the workers are forked, and each worker loads
+it once: it is the only copy of the data a worker holds, the validation is predicted from the memory maps
+a chunk of rows at a time. The learner is trained in a single boosting loop, and every eval_every rounds
+the MRR on the validation is written in a results log shared by the workers (jsonl): a trial whose score
+is below the median of the other trials at the same step is stopped early.
+
+The configurations are sampled as in RandomValidator: a range in a tuple means all the values in between,
+a list means just its values.
+"""
+
+SHARED_DATASET_PATH = 'dataset/preprocessed/{}/{}/search/{}/'
+
+# params sampled from a range that the learners want as integers
+_INT_PARAMS = ['max_depth', 'n_estimators', 'max_delta_step', 'scale_pos_weight', 'num_leaves',
+               'min_child_samples', 'bagging_freq']
+
+LIGHTGBM_FIXED_PARAMS = {
+    'boosting_type': 'gbdt',
+    'max_depth': -1,
+    'n_estimators': 5000,
+    'subsample_for_bin': 200000,
+    'subsample': 1,
+    'subsample_freq': 0,
+    'colsample_bytree': 1,
+    'reg_alpha': 0.0,
+    'reg_lambda': 0.0,
+    'metric': 'None',
+}
+LIGHTGBM_HYPERPARAMETERS = {
+    'learning_rate': (0.01, 0.3),
+    'num_leaves': (6, 350),
+    'min_split_gain': (0.0, 0.1),
+    'min_child_weight': (0.0, 0.1),
+    'min_child_samples': (10, 45),
+    'bagging_freq': (0, 20),
+    'feature_fraction': (0.6, 1),
+}
+
+
+def share_dataset(path, X_train, y_train, group_train, X_vali, y_vali, group_vali):
+    """ Save the matrices (as float32 CSR), the labels and the groups of train and validation in path """
+    check_folder(path, point_allowed_path=True)
+    meta = {}
+    for name, X, y, group in [('train', X_train, y_train, group_train), ('vali', X_vali, y_vali, group_vali)]:
+        X = sps.csr_matrix(X, dtype=np.float32)
+        np.save(os.path.join(path, '{}_data.npy'.format(name)), X.data)
+        np.save(os.path.join(path, '{}_indices.npy'.format(name)), X.indices)
+        np.save(os.path.join(path, '{}_indptr.npy'.format(name)), X.indptr)
+        np.save(os.path.join(path, '{}_y.npy'.format(name)), np.asarray(y, dtype=np.float32))
+        np.save(os.path.join(path, '{}_group.npy'.format(name)), np.asarray(group, dtype=np.int32))
+        meta[name] = X.shape
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load_shared(path):
+    """ Return a dict with the path, and X, y and group of train and vali backed by read-only memory maps """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    res = {'path': path}
+    for name, shape in meta.items():
+        arrays = [np.load(os.path.join(path, '{}_{}.npy'.format(name, a)), mmap_mode='r')
+                  for a in ['data', 'indices', 'indptr']]
+        res['X_{}'.format(name)] = sps.csr_matrix(tuple(arrays), shape=tuple(shape), copy=False)
+        res['y_{}'.format(name)] = np.load(os.path.join(path, '{}_y.npy'.format(name)), mmap_mode='r')
+        res['group_{}'.format(name)] = np.load(os.path.join(path, '{}_group.npy'.format(name)), mmap_mode='r')
+    return res
+
+
+def share_xgboost_dataset(mode, cluster='no_cluster', kind='kind1'):
+    """ Share the dataset of XGBoostWrapper (if not shared yet) and return its path """
+    path = SHARED_DATASET_PATH.format(cluster, mode, 'xgboost_{}'.format(kind))
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        X_train, y_train, group_train, _, _ = data.dataset_xgboost_train(mode, cluster, kind)
+        X_vali, y_vali, group_vali, _ = data.dataset_xgboost_test(mode, cluster, kind)
+        share_dataset(path, X_train, y_train.values, group_train, X_vali, y_vali.values, group_vali)
+    return path
+
+
+def share_lightgbm_dataset(mode, cluster, dataset_name):
+    """ Share the dataset of the lightGBM recommender (if not shared yet) and return its path """
+    path = SHARED_DATASET_PATH.format(cluster, mode, 'lightgbm_{}'.format(dataset_name))
+    if not os.path.isfile(os.path.join(path, 'meta.json')):
+        import pandas as pd
+        bp = f'dataset/preprocessed/lightGBM/{cluster}/{mode}/{dataset_name}'
+        arrays = []
+        for name in ['train', 'vali']:
+            # -1 is the missing value of the features
+            X, _ = feature_matrix(pd.read_hdf(f'{bp}/x_{name}.hdf', key='df'))
+            arrays += [X, np.load(f'{bp}/y_{name}.npy'), np.load(f'{bp}/groups_{name}.npy')]
+        share_dataset(path, *arrays)
+    return path
+
+
+def group_mrr(labels, scores, group):
+    """ Return the MRR of the scores of groups of rows, the relevant row of each group has label 1 """
+    offsets = reranking.offsets_from_lengths(np.asarray(group))
+    ranked_labels, _ = reranking.rerank(np.asarray(labels), np.asarray(scores), offsets)
+    return evaluation.mrr(evaluation.reciprocal_ranks(ranked_labels, offsets, np.ones(len(group))))
+
+
+class ResultsLog(object):
+    """ Jsonl file of the scores of the trials, appended by all the workers """
+
+    def __init__(self, path):
+        self.path = path
+        check_folder(path)
+
+    def append(self, record):
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            lines = f.readlines()
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return [json.loads(l) for l in lines if l.strip()]
+
+    def step_scores(self, step, exclude_trial=None):
+        return [r['score'] for r in self.read()
+                if r.get('step') == step and r['trial'] != exclude_trial and 'final' not in r]
+
+
+def _params(params, allowed=None):
+    res = {k: (math.ceil(v) if k in _INT_PARAMS and isinstance(v, float) else v) for k, v in params.items()}
+    return res if allowed is None else {k: v for k, v in res.items() if k in allowed}
+
+
+def _train_sources(shared):
+    return [os.path.join(shared['path'], 'train_{}.npy'.format(a)) for a in ['data', 'indices', 'indptr', 'y', 'group']]
+
+
+def _train_columns(shared):
+    # the features of a shared dataset have no names, its folder identifies them
+    return list(range(shared['X_train'].shape[1]))
+
+
+def _load_train(shared):
+    return lambda: (shared['X_train'], shared['y_train'], shared['group_train'], None)
+
+
+def xgboost_train_buffer(shared, params=None):
+    """ Return the DMatrix of the train, loaded from the binary cache (saved from the memory maps if missing) """
+    path = native_dataset.cache_path(shared['path'], 'train', _train_columns(shared), 'dmatrix')
+    return native_dataset.xgboost_dmatrix(path, _load_train(shared), _train_sources(shared))
+
+
+def lightgbm_train_buffer(shared, params=None):
+    """ Same as xgboost_train_buffer with the lightgbm Dataset, binned with the binning params in params """
+    dataset_params = native_dataset.lightgbm_binning_params(params or {})
+    path = native_dataset.cache_path(shared['path'], 'train', _train_columns(shared), 'bin', dataset_params)
+    return native_dataset.lightgbm_dataset(path, _load_train(shared), params=dataset_params,
+                                           sources=_train_sources(shared))
+
+
+def _train_buffer(shared, build, params=None):
+    """ Return the native buffer of the train, keeping at most one in the worker (the one of the last params) """
+    key = (build.__name__, native_dataset.lightgbm_binning_params(params or {}))
+    if shared.get('train_buffer', (None, None))[0] != key:
+        shared.pop('train_buffer', None)
+        shared['train_buffer'] = (key, build(shared, params))
+    return shared['train_buffer'][1]
+
+
+def predict_chunks(predict, X, chunk_rows=100000):
+    """ Return the scores of the rows of a (memory-mapped) CSR matrix, computed chunk_rows rows at a time """
+    return np.concatenate([np.asarray(predict(X[start:start + chunk_rows])).ravel()
+                           for start in range(0, X.shape[0], chunk_rows)] + [np.empty(0)])
+
+
+def xgboost_trial(params, shared, report, eval_every):
+    """
+    Train an xgboost ranker, evaluating it every eval_every rounds. report(rounds, score) returns False to stop.
+    Return the best MRR and its number of rounds
+    """
+    import xgboost as xgb
+    dtrain = _train_buffer(shared, xgboost_train_buffer)
+    params = {'objective': 'rank:pairwise', **params}
+    ranker = xgb.XGBRanker(**_params(params, xgb.XGBRanker().get_params()))
+
+    # the boosting loop of xgb.train, on a single booster
+    booster = xgb.Booster(ranker.get_xgb_params(), [dtrain])
+    best = (-1, 0)
+    for i in range(ranker.n_estimators):
+        booster.update(dtrain, i)
+        rounds = i + 1
+        if rounds % eval_every != 0 and rounds != ranker.n_estimators:
+            continue
+        scores = predict_chunks(lambda X: booster.predict(xgb.DMatrix(X, missing=np.nan)), shared['X_vali'])
+        score = group_mrr(shared['y_vali'], scores, shared['group_vali'])
+        best = max(best, (score, rounds))
+        if not report(rounds, score):
+            break
+    return best
+
+
+def lightgbm_trial(params, shared, report, eval_every):
+    """ Same as xgboost_trial with a lightgbm lambdarank, evaluated by a callback of a single lgb.train """
+    import lightgbm as lgb
+    params = _params(params)
+    n_estimators = params.pop('n_estimators', 100)
+    params = {'objective': 'lambdarank', 'verbose': -1, **params}
+    train_set = _train_buffer(shared, lightgbm_train_buffer, params)
+
+    best = [(-1, 0)]
+
+    def evaluate(env):
+        rounds = env.iteration + 1
+        if rounds % eval_every != 0 and rounds != env.end_iteration:
+            return
+        score = group_mrr(shared['y_vali'], predict_chunks(env.model.predict, shared['X_vali']),
+                          shared['group_vali'])
+        best[0] = max(best[0], (score, rounds))
+        if not report(rounds, score):
+            raise lgb.callback.EarlyStopException(env.iteration, [])
+
+    lgb.train(params, train_set, num_boost_round=n_estimators, keep_training_booster=True, callbacks=[evaluate])
+    return best[0]
+
+
+TRIALS = {
+    'xgboost': xgboost_trial,
+    'lightgbm': lightgbm_trial,
+}
+TRAIN_BUFFERS = {
+    'xgboost': xgboost_train_buffer,
+    'lightgbm': lightgbm_train_buffer,
+}
+
+# state of the worker processes, set by _init_worker
+_worker = {}
+
+
+def _init_worker(shared_path, log_path, trial, eval_every, min_trials, prune_percentile):
+    _worker.update(shared=load_shared(shared_path), log=ResultsLog(log_path), trial=TRIALS[trial],
+                   eval_every=eval_every, min_trials=min_trials, prune_percentile=prune_percentile)
+
+
+def _run_trial(args):
+    """ Worker: evaluate a configuration, return its record """
+    trial_id, params = args
+    log = _worker['log']
+    start = time.time()
+
+    pruned = []
+
+    def report(step, score):
+        log.append({'trial': trial_id, 'step': step, 'score': score})
+        others = log.step_scores(step, exclude_trial=trial_id)
+        if len(others) >= _worker['min_trials'] and score < np.percentile(others, _worker['prune_percentile']):
+            pruned.append(step)
+            return False
+        return True
+
+    score, rounds = _worker['trial'](params, _worker['shared'], report, _worker['eval_every'])
+    record = {'trial': trial_id, 'final': True, 'score': score, 'rounds': rounds, 'pruned': len(pruned) > 0,
+              'seconds': time.time() - start, 'params': params}
+    log.append(record)
+    return record
+
+
+class ParallelValidator:
+
+    """
+    Random search run by n_workers processes on a shared dataset (see share_dataset).
+    trial: 'xgboost' or 'lightgbm'
+    eval_every (int): rounds between two evaluations of a trial
+    min_trials (int): number of other trials that must have reached a step before a trial can be stopped there
+    prune_percentile (float): a trial is stopped if its score is below this percentile of the other trials
+    """
+
+    def __init__(self, trial, shared_path, fixed_params_dict, hyperparameters_dict, n_workers=None,
+                 eval_every=50, min_trials=4, prune_percentile=50, granularity=100, seed=None):
+        self.trial = trial
+        self.shared_path = shared_path
+        self.fixed_params_dict = fixed_params_dict
+        self.hyperparameters_dict = hyperparameters_dict
+        self.n_workers = n_workers or mp.cpu_count()
+        self.eval_every = eval_every
+        self.min_trials = min_trials
+        self.prune_percentile = prune_percentile
+        self.granularity = granularity
+        self.random = Random(seed)
+        self.log_path = 'validation_result/{}_parallel_{}.jsonl'.format(time.strftime('%d_%b-%Hh-%Mm-%Ss'), trial)
+
+    def sample(self, obj):
+        if type(obj) == tuple:
+            step = (obj[1] - obj[0]) / self.granularity
+            return obj[0] + step * self.random.randint(0, self.granularity)
+        elif type(obj) == list:
+            return obj[self.random.randint(0, len(obj) - 1)]
+        return obj
+
+    def validate(self, iterations):
+        """ Evaluate iterations configurations, return their records sorted by descending score """
+        # the threads of the learner are split among the workers
+        threads = max(1, mp.cpu_count() // self.n_workers)
+        configurations = [(i, {**self.fixed_params_dict, 'n_jobs': threads,
+                               **{k: self.sample(v) for k, v in self.hyperparameters_dict.items()}})
+                          for i in range(iterations)]
+        print('results log: {}'.format(self.log_path), flush=True)
+        ResultsLog(self.log_path)
+        # save the binary cache of the train once, the workers only load it
+        TRAIN_BUFFERS[self.trial](load_shared(self.shared_path), self.fixed_params_dict)
+        records = []
+        initargs = (self.shared_path, self.log_path, self.trial, self.eval_every, self.min_trials,
+                    self.prune_percentile)
+        with mp.get_context('fork').Pool(self.n_workers, initializer=_init_worker, initargs=initargs) as pool:
+            for r in pool.imap_unordered(_run_trial, configurations):
+                records.append(r)
+                print('trial {}: MRR {:.5f} at {} rounds{} in {:.0f}s, params: {}'.format(
+                    r['trial'], r['score'], r['rounds'], ' (stopped)' if r['pruned'] else '', r['seconds'],
+                    r['params']), flush=True)
+        records.sort(key=lambda r: r['score'], reverse=True)
+        if len(records) > 0:
+            print('best: MRR {:.5f} with {}'.format(records[0]['score'], records[0]['params']), flush=True)
+        return records
+
+
+if __name__ == "__main__":
+    from utils.menu import mode_selection, cluster_selection, single_choice
+
+    mode = mode_selection()
+    cluster = cluster_selection()
+    trial = single_choice('which ranker?', ['xgboost', 'lightgbm'])
+    if trial == 'xgboost':
+        from recommenders.XGBoost import XGBoostWrapper
+        kind = input('insert the kind: ')
+        shared_path = share_xgboost_dataset(mode, cluster, kind)
+        fixed, hyperparameters = XGBoostWrapper(mode=mode, cluster=cluster, kind=kind, ask_to_load=False).get_params()
+        fixed = {k: v for k, v in fixed.items() if k not in ['mode', 'cluster', 'kind', 'ask_to_load']}
+    else:
+        shared_path = share_lightgbm_dataset(mode, cluster, input('insert the dataset name: '))
+        fixed, hyperparameters = LIGHTGBM_FIXED_PARAMS, LIGHTGBM_HYPERPARAMETERS
+    n_workers = int(input('number of workers: '))
+    v = ParallelValidator(trial, shared_path, fixed, hyperparameters, n_workers=n_workers)
+    v.validate(int(input('number of configurations: ')))
@@ -1,15 +1,23 @@
 from __future__ import print_function
 import data
 from utils.check_folder import check_folder
+import utils.storage as storage
 import utils.menu as menu
 import os
 import pickle
 from tqdm.auto import tqdm
 import pandas as pd
-from preprocess_utils import create_icm, create_urm
+from preprocess_utils import create_icm, create_urm, create_encodings
 import numpy as np
 from utils.reduce_memory_usage_df import reduce_mem_usage
-from preprocess_utils.custom_preprocessing.preprocess_unroll import unroll_custom_preprocess_function
+from preprocess_utils.custom_preprocessing.preprocess_unroll import unroll_custom_preprocess_function, \
+    unroll_custom_preprocess_chunk
+
+# rows of the original csv read at once by the streaming preprocessing
+CHUNK_ROWS = 1000000
+# columns of the original csv to read as strings (inferring them chunk by chunk would give different types)
+_STRING_COLUMNS = ['user_id', 'session_id', 'action_type', 'reference', 'platform', 'city', 'device',
+                   'current_filters', 'impressions', 'prices']
 
 # def remove_clickout_after_missing_clickout_test():
 #     test = data.test_df('full')
@@ -23,6 +31,19 @@ def reset_step_for_duplicated_sessions(df):
     """ Reset the step for some bugged session in which the step restart from 1 in some random interaction """
     res_df = df.copy()
     # find the sessions in which the step restarts at some point
+    first_steps = df.loc[df.step == 1, ['user_id', 'session_id']]
+    dup_sessions = first_steps[first_steps.duplicated()]
+    dup_sessions = pd.MultiIndex.from_arrays([dup_sessions.user_id.values, dup_sessions.session_id.values])
+    mask = pd.MultiIndex.from_arrays([df.user_id.values, df.session_id.values]).isin(dup_sessions)
+
+    # reset the steps for the duplicated-steps sessions, numbering the interactions in the df order
+    res_df.loc[mask, 'step'] = res_df[mask].groupby(['user_id', 'session_id']).cumcount().values + 1
+    return res_df
+
+def reset_step_for_duplicated_sessions_iterative(df):
+    """ Same as reset_step_for_duplicated_sessions, slower, kept as reference for the benchmark """
+    res_df = df.copy()
+    # find the sessions in which the step restarts at some point
     df_dup = df[["session_id", "user_id", "step"]]
     df_dup = df_dup[df_dup["step"] == 1]
     df_dup = df_dup.groupby(['user_id','session_id','step']).size() \
@@ -41,6 +62,34 @@ def reset_step_for_duplicated_sessions(df):
 
 def merge_duplicates(df):
     """
+    Deletes from df consecutive actions of same type performed on the same reference within the same session.
+    It keeps the first occurrence of those consecutive actions and for those it saves
+    how many consecutive actions are occurred in column 'frequence'.
+    For the non-consecutive actions, frequence is set to 1.
+    Clickouts and actions with a missing reference are never merged.
+
+    :param df: DataFrame to preprocess
+    :return: df: preprocessed DataFrame df with 'frequence' column
+    """
+    # an interaction is a duplicate if it repeats the previous one (NaN references are always different)
+    duplicated = df.action_type.values != 'clickout item'
+    for col in ['user_id', 'session_id', 'reference', 'action_type']:
+        duplicated &= (df[col] == df[col].shift()).values
+
+    # each run of duplicates starts from a non-duplicated interaction
+    run = np.cumsum(~duplicated) - 1
+    frequence = np.bincount(run)
+
+    res_df = df[~duplicated].copy()
+    # the iterative version creates the column with the first .at assignment, so it is float
+    dtype = df['frequence'].dtype if 'frequence' in df.columns else float
+    res_df['frequence'] = frequence.astype(dtype)
+    return res_df
+
+def merge_duplicates_iterative(df):
+    """
+    Same as merge_duplicates, slower, kept as reference for the benchmark.
+
     Deletes from df consecutive actions of same type performed on the same reference within the same session.
     It keeps the first occurrence of those consecutive actions and for those it saves
     how many consecutive actions are occurred in column 'frequence'.
@@ -152,6 +201,89 @@ def create_full_df(custom_preprocess_function):
 
         test_df.to_csv(f, header=False)
 
+    # write the columnar copy of the full df
+    storage.convert_csv(data.FULL_PATH)
+
+def no_custom_preprocess_chunk(df, is_test):
+    return df
+
+def read_session_chunks(path, chunk_rows=CHUNK_ROWS):
+    """
+    Read a csv in chunks of about chunk_rows rows. The consecutive rows of the same session are never split
+    between two chunks. The index of the rows is the same as reading the whole csv.
+    """
+    carry = None
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype={c: object for c in _STRING_COLUMNS}):
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        # the last session of the chunk may continue in the next one
+        new_session = (chunk.user_id != chunk.user_id.shift()) | (chunk.session_id != chunk.session_id.shift())
+        last_start = np.flatnonzero(new_session.values)[-1]
+        carry = chunk.iloc[last_start:]
+        if last_start > 0:
+            yield chunk.iloc[:last_start]
+    if carry is not None:
+        yield carry
+
+def _preprocess_chunk(df, chunk_preprocess_function, is_test, offset, compressed):
+    """
+    Apply the same steps of create_full_df to a chunk. The rows are indexed from offset.
+    Return the preprocessed chunk and the number of rows after the custom preprocessing.
+    """
+    df = chunk_preprocess_function(df, is_test).reset_index(drop=True)
+    rows = len(df)
+    df.index += offset
+
+    df = reset_step_for_duplicated_sessions(df)
+    if compressed:
+        df = merge_duplicates(df)
+    else:
+        df["frequence"] = 1
+
+    if is_test:
+        # deleting unnformative interactions
+        mask = (df["action_type"] != "clickout item") & (df["reference"].isnull())
+        df = df[~mask]
+    return df, rows
+
+def create_full_df_streaming(chunk_preprocess_function, chunk_rows=CHUNK_ROWS):
+    """
+    Same as create_full_df, but reading the original csv files in session-aligned chunks of about
+    chunk_rows rows and appending each preprocessed chunk to the full df, so that the memory used is
+    bounded by the chunk size instead of the dataset size.
+
+    The custom preprocess function is applied to each chunk: chunk_preprocess_function(df, is_test).
+    NOTE: the sessions must be contiguous in the original csv (as they are), since the step fix is
+    applied chunk by chunk.
+    """
+    compressed = menu.yesno_choice(title='Do you want the compressed version? (no for the original full)',
+                                   callback_yes=lambda: True, callback_no=lambda: False)
+    writer = storage.ChunkWriter(data.FULL_PATH)
+
+    # TRAIN
+    print('Preprocessing train...')
+    len_original_train = 0
+    len_train = 0
+    for chunk in tqdm(read_session_chunks(data.TRAIN_ORIGINAL_PATH, chunk_rows)):
+        chunk, rows = _preprocess_chunk(chunk, chunk_preprocess_function, False, len_original_train, compressed)
+        len_original_train += rows
+        len_train += len(chunk)
+        writer.write(chunk)
+
+    # save config file
+    data.save_config(data.TRAIN_LEN_KEY, len_train)
+
+    # TEST
+    # restore index summing the len of the original train (to be the same as without merging)
+    print('Preprocessing test...')
+    offset = len_original_train
+    for chunk in tqdm(read_session_chunks(data.TEST_ORIGINAL_PATH, chunk_rows)):
+        chunk, rows = _preprocess_chunk(chunk, chunk_preprocess_function, True, offset, compressed)
+        offset += rows
+        writer.write(chunk)
+
+    writer.close()
+
 def get_small_dataset(df, maximum_rows=1000000):
     """
     Return a dataframe from the original dataset containing a maximum number of rows. The actual total rows
@@ -215,8 +347,8 @@ def split(df, save_path, perc_train=80):
         df_test.at[e[1], 'reference'] = np.nan
 
     # save them all
-    df_train.to_csv(os.path.join(save_path, "train.csv"))
-    df_test.to_csv(os.path.join(save_path, "test.csv"))
+    storage.save_df(df_train, os.path.join(save_path, "train.csv"))
+    storage.save_df(df_test, os.path.join(save_path, "test.csv"))
     np.save(os.path.join(save_path, 'target_indices'), get_target_indices(df_test))
     np.save(os.path.join(save_path, 'train_indices'), df_train.index)
     np.save(os.path.join(save_path, 'test_indices'), df_test.index)
@@ -313,8 +445,8 @@ def preprocess():
         target_indices = get_target_indices(test)
 
         check_folder('dataset/preprocessed/no_cluster/full')
-        train.to_csv(os.path.join(path, 'full/train.csv'))
-        test.to_csv(os.path.join(path, 'full/test.csv'))
+        storage.save_df(train, os.path.join(path, 'full/train.csv'))
+        storage.save_df(test, os.path.join(path, 'full/test.csv'))
         np.save(os.path.join(path, 'full/train_indices'), train.index)
         np.save(os.path.join(path, 'full/test_indices'), test.index)
         np.save(os.path.join(path, 'full/target_indices'), target_indices)
@@ -369,8 +501,7 @@ def preprocess():
         print("Writing on the df")
         full_df["unified_session_id"] = pd.Series(new_col)
         print("Saving new df to file")
-        with open(data.FULL_PATH, 'w', encoding='utf-8') as f:
-            full_df.to_csv(f)
+        storage.save_df(full_df, data.FULL_PATH)
         data.refresh_full_df()
 
     print("Hello buddy... Copenaghen is waiting...")
@@ -384,14 +515,23 @@ def preprocess():
     
     # unroll
     funct = unroll_custom_preprocess_function
+    chunk_funct = unroll_custom_preprocess_chunk
+
+    def _create_full_df():
+        streaming = menu.yesno_choice(title='Do you want to read the original csv in chunks (bounded memory)?',
+                                      callback_yes=lambda: True, callback_no=lambda: False)
+        if streaming:
+            create_full_df_streaming(chunk_funct)
+        else:
+            create_full_df(funct)
 
     check_folder(data.FULL_PATH)
     if os.path.isfile(data.FULL_PATH):
         menu.yesno_choice('An old full dataframe has been found. Do you want to delete it and create again?', \
-            callback_yes=(lambda: create_full_df(funct)))
+            callback_yes=_create_full_df)
     else:
         print('The full dataframe (index master) is missing. Creating it...', end=' ', flush=True)
-        create_full_df(funct)
+        _create_full_df()
         print('Done!')
 
 
@@ -404,6 +544,10 @@ def preprocess():
     # preprocess item_metadata
     menu.yesno_choice(title='Do you want to preprocess the item metadata?', callback_yes=_preprocess_item_metadata)
 
+    # create the global integer encodings
+    menu.yesno_choice(title='Do you want to create the integer encodings (users, sessions, items...)?',
+                      callback_yes=create_encodings.create_encodings)
+
     # create ICM
     menu.yesno_choice(title='Do you want to create the ICM matrix files?', callback_yes=create_icm.create_ICM)
 
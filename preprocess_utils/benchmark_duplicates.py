@@ -0,0 +1,44 @@
+import time
+import data
+from preprocess import merge_duplicates, merge_duplicates_iterative, \
+    reset_step_for_duplicated_sessions, reset_step_for_duplicated_sessions_iterative
+
+"""
+Compare the vectorized and the iterative versions of reset_step_for_duplicated_sessions and merge_duplicates
+on the train df of a split: the outputs must be byte-identical once written as csv.
+The merged interactions of the split are expanded again using the frequence column, so that there are
+duplicates to merge.
+"""
+
+
+def _timed(fn, df):
+    start = time.time()
+    res = fn(df.copy())
+    return res, time.time() - start
+
+
+def benchmark(mode='small', cluster='no_cluster'):
+    df = data.train_df(mode, cluster)
+    if 'frequence' in df.columns:
+        df = df.loc[df.index.repeat(df.frequence.astype(int))].drop('frequence', axis=1)
+    # same dtypes as the original csv read by create_full_df
+    df = df.reset_index(drop=True).astype({'step': 'int64', 'timestamp': 'int64'})
+    print('{} interactions'.format(len(df)))
+
+    for name, fast, slow in [('reset_step_for_duplicated_sessions', reset_step_for_duplicated_sessions,
+                                reset_step_for_duplicated_sessions_iterative),
+                             ('merge_duplicates', merge_duplicates, merge_duplicates_iterative)]:
+        fast_df, fast_time = _timed(fast, df)
+        slow_df, slow_time = _timed(slow, df)
+        identical = fast_df.to_csv() == slow_df.to_csv()
+        print('{}: vectorized {:.2f}s, iterative {:.2f}s, speedup {:.1f}x, identical: {}'.format(
+            name, fast_time, slow_time, slow_time / max(fast_time, 1e-6), identical))
+        if not identical:
+            raise ValueError('{} output differs from the iterative version'.format(name))
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    mode = mode_selection()
+    cluster = cluster_selection()
+    benchmark(mode, cluster)
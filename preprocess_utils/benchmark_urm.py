@@ -0,0 +1,56 @@
+import time
+import numpy as np
+from preprocess_utils.create_urm import urm_creator
+
+"""
+Compare the vectorized and the iterative (session by session, with _compute_session_score) constructions of
+the urm of urm_creator on a split, for each type, time weight and score update rule: the urms must have the
+same entries (the values up to the rounding of the sums) and the row and col dictionaries must be equal.
+"""
+
+
+def _timed(creator, iterative):
+    start = time.time()
+    res = creator.build_urm(iterative=iterative)
+    return res, time.time() - start
+
+
+def _compare(fast, slow):
+    """ Return the description of the first difference between two (urm, row dict, col dict), None if equal """
+    fast_urm, slow_urm = fast[0].tocsr(), slow[0].tocsr()
+    fast_urm.sort_indices()
+    slow_urm.sort_indices()
+    if fast_urm.shape != slow_urm.shape:
+        return 'shape {} instead of {}'.format(fast_urm.shape, slow_urm.shape)
+    if not np.array_equal(fast_urm.indptr, slow_urm.indptr) or not np.array_equal(fast_urm.indices, slow_urm.indices):
+        return 'the entries differ'
+    if not np.allclose(fast_urm.data, slow_urm.data, rtol=1e-12, atol=0):
+        return 'the values differ'
+    if fast[1] != slow[1]:
+        return 'the row dictionaries differ'
+    if fast[2] != slow[2]:
+        return 'the col dictionaries differ'
+    return None
+
+
+def benchmark(mode='small', cluster='no_cluster'):
+    for type in ['user', 'session']:
+        for tw in ['lin', 'exp', None]:
+            for rule in ['sum', 'substitute', 'no_update']:
+                creator = urm_creator(type=type, mode=mode, cluster=cluster, name='benchmark')
+                creator.score_dict['tw'] = tw
+                creator.score_dict['score_update_rule'] = rule
+                fast, fast_time = _timed(creator, False)
+                slow, slow_time = _timed(creator, True)
+                difference = _compare(fast, slow)
+                print('{} {} {}: vectorized {:.2f}s, iterative {:.2f}s, speedup {:.1f}x, identical: {}'.format(
+                    type, tw, rule, fast_time, slow_time, slow_time / max(fast_time, 1e-6), difference is None))
+                if difference is not None:
+                    raise ValueError('{} {} {}: {}'.format(type, tw, rule, difference))
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    mode = mode_selection()
+    cluster = cluster_selection()
+    benchmark(mode, cluster)
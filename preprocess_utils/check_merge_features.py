@@ -0,0 +1,63 @@
+import numpy as np
+from preprocess_utils.merge_features import base_dfs, actual_merge_one_thread, actual_merge_multithread, \
+    _read_feature
+
+"""
+Compare the dataframes built by the aligned join of merge_features with the ones built by calling
+DataFrame.merge for each feature (the previous implementation): the columns, the order of the rows and the
+values must be the same, and so the dtypes, except for the float columns that the aligned join stores as float32.
+"""
+
+
+def merge_with_pandas(train_df, validation_test_df, features_array, mode, cluster, merge_kind='inner', onehot=True,
+                      create_not_existing_features=True):
+    """ Join the features one at a time with DataFrame.merge and sort the rows as they were """
+    for f in features_array:
+        feature = _read_feature(f, mode, cluster, onehot, create_not_existing_features)
+        train_df = train_df.merge(feature, how=merge_kind)
+        validation_test_df = validation_test_df.merge(feature, how=merge_kind)
+    train_df = train_df.sort_values(['index', 'dummy_step']).reset_index(drop=True)
+    validation_test_df = validation_test_df.sort_values(['index', 'dummy_step']).reset_index(drop=True)
+    return train_df, validation_test_df
+
+
+def compare(expected_df, df, name='df'):
+    """ Raise a ValueError if df differs from expected_df (see the module docstring) """
+    if list(expected_df.columns) != list(df.columns):
+        raise ValueError('{}: the columns differ: {} - {}'.format(name, list(expected_df.columns), list(df.columns)))
+    if len(expected_df) != len(df):
+        raise ValueError('{}: {} rows instead of {}'.format(name, len(df), len(expected_df)))
+    for col in expected_df.columns:
+        expected, values = expected_df[col], df[col]
+        if expected.dtype.kind == 'f' and values.dtype == np.float32:
+            expected = expected.astype(np.float32)
+        if expected.dtype != values.dtype:
+            raise ValueError('{}: column {} is {} instead of {}'.format(name, col, values.dtype, expected.dtype))
+        if not expected.reset_index(drop=True).equals(values.reset_index(drop=True)):
+            raise ValueError('{}: the values of column {} differ'.format(name, col))
+
+
+def check(mode, cluster, features_array, merge_kind='inner', onehot=True, multithread=False):
+    train_df, validation_test_df, _, _ = base_dfs(mode, cluster)
+    expected_train_df, expected_validation_df = merge_with_pandas(train_df, validation_test_df, features_array, mode,
+                                                                  cluster, merge_kind=merge_kind, onehot=onehot)
+
+    # as merge_features does
+    validation_test_df = validation_test_df.sort_values(['index', 'dummy_step'])
+    merge_fn = actual_merge_multithread if multithread else actual_merge_one_thread
+    train_df, validation_test_df = merge_fn(train_df, validation_test_df, features_array, mode, cluster, True,
+                                            merge_kind, onehot)
+    compare(expected_train_df, train_df, 'train')
+    compare(expected_validation_df, validation_test_df, 'validation')
+    print('merge_features output matches DataFrame.merge ({}, {} features)'.format(merge_kind, len(features_array)))
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection, single_choice
+    from preprocess_utils.dataset_xgboost import kind_features
+    mode = mode_selection()
+    cluster = cluster_selection()
+    kind = input('insert the kind: ')
+    merge_kind = single_choice('merge kind?', ['left', 'inner'])
+    check(mode, cluster, kind_features(kind), merge_kind=merge_kind)
+    check(mode, cluster, kind_features(kind), merge_kind=merge_kind, multithread=True)
@@ -9,6 +9,7 @@ import utils.df as df_utils
 import preprocess_utils.sessions_to_predict as sess2predict
 from utils.check_folder import check_folder
 import utils.datasetconfig as datasetconfig
+from utils.dataset import SequenceDatasetForBinaryClassification
 
 from clusterize.cluster_recurrent import ClusterRecurrent
 from clusterize.cluster_up_to_len6 import ClusterUpToLen6
@@ -43,6 +44,13 @@ def create_dataset_for_binary_classification(mode, cluster, pad_sessions_length,
     path = f'dataset/preprocessed/{cluster}/{mode}/dataset_binary_classification_p{pad_sessions_length}'
     check_folder(path)
 
+    # the categorical columns are saved as indices of their classes and expanded to one-hot at load time
+    devices_classes = ['mobile', 'desktop', 'tablet']
+    actions_classes = ['clickout item', 'interaction item rating', 'interaction item info',
+            'interaction item image', 'interaction item deals', 'search for item', 'search for destination',
+            'search for poi'] #, 'change of sort order', 'filter selection', 'show_impression', ]
+    categorical_cols = {'device': devices_classes, 'action_type': actions_classes}
+
     def create_ds_class(df, path, for_train, add_dummy_actions=add_dummy_actions, pad_sessions_length=pad_sessions_length, 
                         add_item_features=add_item_features, resample=resample, one_target_per_session=one_target_per_session,
                         new_row_index=99000000):
@@ -51,10 +59,6 @@ def create_dataset_for_binary_classification(mode, cluster, pad_sessions_length,
         """
 
         ds_type = 'train' if for_train else 'test'
-        devices_classes = ['mobile', 'desktop', 'tablet']
-        actions_classes = ['clickout item', 'interaction item rating', 'interaction item info',
-                'interaction item image', 'interaction item deals', 'search for item', 'search for destination',
-                'search for poi'] #, 'change of sort order', 'filter selection', 'show_impression', ]
         
         # merge the features
         print('Merging the features...')
@@ -79,15 +83,11 @@ def create_dataset_for_binary_classification(mode, cluster, pad_sessions_length,
         # print('Getting the last clickout of each session...')
         # print('Done!\n')
 
-        # add the one-hot of the device
+        # add the indices of the device and of the action-type
         # df = df.drop('device', axis=1)
-        print('Adding one-hot columns of device...', end=' ', flush=True)
-        df = sess2vec.one_hot_df_column(df, 'device', classes=devices_classes)
-        print('Done!\n')
-
-        # add the one-hot of the action-type
-        print('Adding one-hot columns of action_type...', end=' ', flush=True)
-        df = sess2vec.one_hot_df_column(df, 'action_type', classes=actions_classes)
+        print('Adding indices of device and action_type...', end=' ', flush=True)
+        for col, classes in categorical_cols.items():
+            df = sess2vec.categorical_codes(df, col, classes=classes)
         print('Done!\n')
 
         # remove the impressions column
@@ -99,10 +99,10 @@ def create_dataset_for_binary_classification(mode, cluster, pad_sessions_length,
             print('resample perc:', resample_perc)
             df = df_utils.resample_sessions(df, by=resample_perc, when=df_utils.ref_class_is_1)
 
-        # join the accomodations one-hot features
+        # add the rows of the references in the accomodations features matrix
         if add_item_features:
-            print('Adding accomodations features...')
-            df = sess2vec.merge_reference_features(df, pad_sessions_length)
+            print('Adding accomodations features rows...')
+            df = sess2vec.reference_features_rows(df, pad_sessions_length)
 
         X_LEN = df.shape[0]
 
@@ -157,10 +157,20 @@ def create_dataset_for_binary_classification(mode, cluster, pad_sessions_length,
     ## ======== CONFIG ======== ##
     # save the dataset config file that stores dataset length and the list of sparse columns
     #x_sparse_cols = devices_classes + actions_classes
+    item_features_name, item_features_cols = '', []
+    if add_item_features:
+        item_features_name = 'item_features.npz'
+        item_features_cols = sess2vec.save_item_features(os.path.join(path, item_features_name))
     datasetconfig.save_config(path, mode, cluster, TRAIN_LEN, TEST_LEN,
-                                rows_per_sample=pad_sessions_length)
+                                rows_per_sample=pad_sessions_length, X_categorical_cols=categorical_cols,
+                                item_features_name=item_features_name, item_features_cols=item_features_cols)
                             #X_sparse_cols=x_sparse_cols, Y_sparse_cols=ref_classes)
 
+    ## ======== SHARDS ======== ##
+    # save the preprocessed tensors in the binary format read by the generators
+    if pad_sessions_length > 0:
+        SequenceDatasetForBinaryClassification(path).save_shards(train=not only_test)
+
 
 
 if __name__ == "__main__":
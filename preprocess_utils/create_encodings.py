@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pandas as pd
+import data
+import utils.storage as storage
+from utils.check_folder import check_folder
+from preprocess_utils.impression_table import parse_pipe_separated
+
+"""
+Create the vocabularies of the global integer encodings from the full df, once at preprocessing time.
+The vocabularies are sorted, so the codes keep the order of the original values (eg: a groupby on the
+codes returns the groups in the same order of a groupby on the strings). Every split is a subset of the
+full df, so the codes are the same in all the modes and clusters.
+Use data.encode / data.decode (or data.encode_df / data.decode_df) to switch between values and codes.
+"""
+
+STRING_VOCABULARIES = ['user_id', 'session_id', 'city', 'platform']
+
+# impressions parsed at once
+_CHUNK_ROWS = 100000
+
+
+def _item_ids(full):
+    """ Return the sorted ids of the accomodations, the references and the impressions """
+    ids = [np.asarray(data.accomodations_ids(), dtype=np.int64)]
+    ids.append(pd.to_numeric(full.reference, errors='coerce').dropna().values.astype(np.int64))
+    impressions = full.impressions.dropna().values
+    for i in range(0, len(impressions), _CHUNK_ROWS):
+        ids.append(np.unique(parse_pipe_separated(impressions[i:i + _CHUNK_ROWS])).astype(np.int64))
+    return np.unique(np.concatenate(ids))
+
+
+def create_encodings():
+    print('creating the encodings...', flush=True)
+    full = storage.load_df(data.FULL_PATH, columns=STRING_VOCABULARIES + ['reference', 'impressions'])
+    check_folder(data.ENCODINGS_PATH, point_allowed_path=True)
+
+    for name in STRING_VOCABULARIES:
+        voc = np.unique(full[name].dropna().values.astype(str)).astype(object)
+        np.save(os.path.join(data.ENCODINGS_PATH, '{}.npy'.format(name)), voc, allow_pickle=True)
+        print('{}: {} values'.format(name, len(voc)))
+
+    items = _item_ids(full)
+    np.save(os.path.join(data.ENCODINGS_PATH, 'item_id.npy'), items)
+    print('item_id: {} values'.format(len(items)))
+
+    # drop the cached vocabularies
+    data.invalidate('vocabulary')
+    print('Done!')
+
+
+if __name__ == '__main__':
+    create_encodings()
@@ -50,8 +50,12 @@ class urm_creator:
         self.train_df = None
         self.test_df = None
 
-    def create_urm(self):
-
+    def build_urm(self, iterative=False):
+        """
+        Return the urm, the row dictionary and the col dictionary
+        iterative (bool): compute the scores session by session with _compute_session_score (the previous
+            implementation, kept to check the vectorized one, see benchmark_urm.py)
+        """
         # load the dataframes according to the mode and cluster
         train_df = data.train_df(mode=self.mode, cluster=self.cluster)
         test_df = data.test_df(mode=self.mode, cluster=self.cluster)
@@ -62,6 +66,12 @@ class urm_creator:
 
         # concatenate the train df and the test df mantaining only the columns of interest
         df = pd.concat([train_df, test_df])[['session_id', 'user_id', 'action_type', 'reference', 'impressions']]
+        # group on the global integer codes instead of the strings (the codes keep the order of the strings)
+        df = data.encode_df(df, columns=['user_id', 'session_id'])
+        # the values missing from the vocabularies are encoded as -1, and would be merged in a single urm row
+        for c in ['user_id', 'session_id']:
+            assert (df[c].values >= 0).all(), \
+                'some values of {} are not in the encodings: run preprocess_utils/create_encodings.py'.format(c)
 
         if self.type == 'user':
             session_groups = df.groupby(['user_id'])
@@ -69,7 +79,7 @@ class urm_creator:
             session_groups = df.groupby(['user_id', 'session_id'])
 
         # it coincides with the rows number
-        groups_keys = list(session_groups.groups.keys())
+        groups_keys = session_groups.size().index
 
         rows_count = len(groups_keys)
         cols_count = len(self.accomodations_id)
@@ -81,40 +91,37 @@ class urm_creator:
             if type == SESSION :
                 key: (user_id, session_id) -- value: row_urm
         """
-        row_dict = {}
-        for i in range(rows_count):
-            row_dict[groups_keys[i]] = i
+        users = data.decode(groups_keys.get_level_values(0), 'user_id')
+        if self.type == 'user':
+            row_dict = dict(zip(users, range(rows_count)))
+        else:
+            sessions = data.decode(groups_keys.get_level_values(1), 'session_id')
+            row_dict = dict(zip(zip(users, sessions), range(rows_count)))
 
         """
         create COL dictionary
             key: accomodation_id -- value: col_urm
         """
-        col_dict = {}
-        for i in range(cols_count):
-            col_dict[self.accomodations_id[i]] = i
+        col_dict = dict(zip(self.accomodations_id, range(cols_count)))
+        # urm column of each item code (-1 if the item is not an accomodation)
+        col_of_code = np.full(len(data.vocabulary('item_id')), -1, dtype=np.int32)
+        accomodations_codes = data.encode(self.accomodations_id, 'item_id')
+        assert (accomodations_codes >= 0).all(), \
+            'some accomodations are not in the encodings: run preprocess_utils/create_encodings.py'
+        col_of_code[accomodations_codes] = np.arange(cols_count)
 
         print('dictionaries created\n')
 
-        tqdm.pandas()
-        # compute the score
-        sessions_score = session_groups.progress_apply(self._compute_session_score).values
-
-        print("apply function done\n")
+        if iterative:
+            _urm = self._sessions_urm(session_groups, col_of_code, shape=(rows_count, cols_count))
+        else:
+            # compute the score of each interaction and combine the ones of the same accomodation
+            rows, cols, scores = self._interactions_scores(df, session_groups, col_of_code)
+            _urm = self._reduce_scores(rows, cols, scores, shape=(rows_count, cols_count))
+        return _urm, row_dict, col_dict
 
-        # create the urm using data indeces and indptr
-        _data = []
-        indptr = [0]
-        indices = []
-
-        values_inserted = 0
-        for i in tqdm(range(rows_count)):
-            score_dict = sessions_score[i]
-            for k in score_dict.keys():
-                indices.append(col_dict[k])
-                _data.append(score_dict[k])
-                values_inserted += 1
-            indptr.append(values_inserted)
-        _urm = sps.csr_matrix((_data, indices, indptr), shape=(rows_count, cols_count))
+    def create_urm(self):
+        _urm, row_dict, col_dict = self.build_urm()
 
         print("URM created\n")
 
@@ -130,6 +137,66 @@ class urm_creator:
         np.save(f'{self.save_path}/{self.name}_dict_col.npy', col_dict)
         print('done!')
 
+    def _time_weights(self, weight_function, positions, lengths):
+        """
+        Return the weight of each interaction given its position in the session and the length of the session
+        """
+        assert weight_function in ['exp', 'lin', None]
+
+        if weight_function == 'exp':
+            return ((positions + 1) / lengths) ** 3
+        if weight_function == 'lin':
+            return (positions + 1) / lengths
+        if weight_function == None:
+            return np.ones(len(positions))
+
+    def _interactions_scores(self, df, session_groups, col_of_code):
+        """
+        Return the urm row, the urm column and the score (weighted by the time) of each interaction with an
+        accomodation, in the order of the interactions
+        """
+        # urm row, position in the group and length of the group of each interaction
+        rows = session_groups.ngroup().values
+        positions = session_groups.cumcount().values
+        lengths = np.bincount(rows)[rows]
+        weights = self._time_weights(self.score_dict['tw'], positions, lengths)
+
+        # score of each action type by lookup (NaN for the actions without a numeric score)
+        actions = [a for a,v in self.score_dict.items()
+                    if a not in ['tw', 'score_update_rule'] and isinstance(v, (int, float))]
+        lookup = np.array([self.score_dict[a] for a in actions] + [np.nan], dtype=np.float64)
+        action_scores = lookup[pd.Categorical(df['action_type'].values, categories=actions).codes]
+
+        # keep the interactions with a numeric reference (-1 was a test row in which we have to predict the clickout)
+        references = pd.to_numeric(df['reference'].values, errors='coerce')
+        mask = ~np.isnan(references) & (references != -1) & (references == np.floor(references)) & ~np.isnan(action_scores)
+        items = references[mask].astype(np.int64)
+
+        codes = data.encode(items, 'item_id')
+        cols = np.where(codes >= 0, col_of_code[codes], -1)
+        if (cols == -1).any():
+            raise KeyError('references not in the accomodations: {}'.format(np.unique(items[cols == -1])[:10]))
+        return rows[mask], cols, (action_scores * weights)[mask]
+
+    def _reduce_scores(self, rows, cols, scores, shape):
+        """ Combine the scores of the same (row, accomodation) with the update rule and return the urm """
+        r = self.score_dict['score_update_rule']
+        assert r in ['sum', 'substitute', 'no_update']
+        if len(scores) == 0:
+            return sps.csr_matrix(shape, dtype=np.float64)
+
+        # the sort is stable, so the scores of the same (row, accomodation) stay in the order of the interactions
+        order = np.lexsort((cols, rows))
+        rows, cols, scores = rows[order], cols[order], scores[order]
+        starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+        if r == 'sum':
+            values = np.add.reduceat(scores, starts)
+        if r == 'substitute':
+            values = scores[np.r_[starts[1:], len(scores)] - 1]
+        if r == 'no_update':
+            values = scores[starts]
+        return sps.coo_matrix((values, (rows[starts], cols[starts])), shape=shape).tocsr()
+
     def _create_weight_array(self, weight_function, session_length):
         """
         :param weight_function:
@@ -195,6 +262,24 @@ class urm_creator:
 
         return scores
 
+    def _sessions_urm(self, session_groups, col_of_code, shape):
+        """ Return the urm built from the scores computed session by session by _compute_session_score """
+        tqdm.pandas()
+        # compute the score
+        sessions_score = session_groups.progress_apply(self._compute_session_score).values
+
+        print("apply function done\n")
+
+        # create the urm using data indeces and indptr
+        lengths = np.array([len(score_dict) for score_dict in sessions_score], dtype=np.int64)
+        items = np.fromiter((k for score_dict in sessions_score for k in score_dict.keys()), dtype=np.int64, count=lengths.sum())
+        _data = np.fromiter((v for score_dict in sessions_score for v in score_dict.values()), dtype=np.float64, count=lengths.sum())
+        codes = data.encode(items, 'item_id')
+        indices = np.where(codes >= 0, col_of_code[codes], -1)
+        if (indices == -1).any():
+            raise KeyError('references not in the accomodations: {}'.format(np.unique(items[indices == -1])[:10]))
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        return sps.csr_matrix((_data, indices, indptr), shape=shape)
 
 
 
@@ -24,6 +24,15 @@ def unroll_custom_preprocess_function(original_train, original_test):
     original_test = original_test.drop([794769, 794770]).reset_index(drop=True)
     return unroll(original_train), unroll(original_test)
 
+"""
+    same as unroll_custom_preprocess_function, for the streaming preprocessing: it is applied
+    to a chunk of the train or of the test at a time (the chunk keeps the original index)
+"""
+def unroll_custom_preprocess_chunk(df, is_test):
+    if is_test:
+        df = df.drop([794769, 794770], errors='ignore')
+    return unroll(df.reset_index(drop=True))
+
 def unroll(t):
     # unroll
     idx = []
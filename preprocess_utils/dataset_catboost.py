@@ -44,6 +44,7 @@ from extract_features.platform_session import PlatformSession
 
 from pathlib import Path
 from utils.check_folder import check_folder
+import utils.storage as storage
 
 
 def to_pool_dataset(dataset, save_dataset=True, path=''):
@@ -114,11 +115,11 @@ def create_dataset(mode, cluster):
     test_df = test_df.fillna(-1)
 
 
-    train_df.to_csv(str(data_dir) + '/train.csv', index=False)
+    storage.save_df(train_df, str(data_dir) + '/train.csv', index=False)
     #to_pool_dataset(train_df, path=str(data_dir) + '/catboost_train.txt')
 
     print('Train saved')
-    test_df.to_csv(str(data_dir) + '/test.csv', index=False)
+    storage.save_df(test_df, str(data_dir) + '/test.csv', index=False)
     #to_pool_dataset(test_df, path=str(data_dir) + '/catboost_test.txt')
 
 
@@ -6,6 +6,8 @@ import pandas as pd
 import pickle
 from utils.check_folder import check_folder
 from utils.menu import single_choice
+from utils.feature_matrix import feature_matrix, save_columns
+from extract_features.feature_store import save_features_array
 from preprocess_utils.merge_features import merge_features
 from os.path import join
 from extract_features.lazy_user import LazyUser
@@ -71,9 +73,6 @@ def create_dataset(mode, cluster, class_weights=False):
 
     train_df, test_df, train_idxs, _ = merge_features(mode, cluster, features_array, merge_kind='left')
 
-    train_df = train_df.replace(-1, np.nan)
-    test_df = test_df.replace(-1, np.nan)
-
     bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
     check_folder(bp)
 
@@ -84,17 +83,15 @@ def create_dataset(mode, cluster, class_weights=False):
         np.save(join(bp, 'class_weights'), weights)
         print('class weights saved')
 
+    # the -1 of the features are missing values (NaN)
+    drop_columns = ['index', 'user_id', 'session_id', 'item_id', 'label']
     if class_weights:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
-    print(','.join(X_train.columns.values))
-    X_train = X_train.to_sparse(fill_value=0)
-    X_train = X_train.astype(np.float64)
-    X_train = X_train.to_coo().tocsr()
+        drop_columns.append('weights')
+    X_train, columns = feature_matrix(train_df, drop_columns)
+    print(','.join(columns))
     save_npz(join(bp, 'X_train'), X_train)
+    save_columns(columns, join(bp, 'columns.json'))
+    save_features_array(features_array, join(bp, 'features.json'))
     print('X_train saved')
 
     user_session_item = train_df[['user_id', 'session_id', 'item_id']]
@@ -113,16 +110,7 @@ def create_dataset(mode, cluster, class_weights=False):
 
     print('train data completed')
 
-    if class_weights:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
-
-    X_test = X_test.to_sparse(fill_value=0)
-    X_test = X_test.astype(np.float64)
-    X_test = X_test.to_coo().tocsr()
+    X_test, _ = feature_matrix(test_df, drop_columns)
     save_npz(join(bp, 'X_test'), X_test)
     print('X_test saved')
 
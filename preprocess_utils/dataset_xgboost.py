@@ -5,6 +5,7 @@ from tqdm import tqdm
 import pandas as pd
 import pickle
 from utils.check_folder import check_folder
+import utils.storage as storage
 from extract_features.actions_involving_impression_session import ActionsInvolvingImpressionSession
 from extract_features.change_impression_order_position_in_session import ChangeImpressionOrderPositionInSession
 from extract_features.changes_of_sort_order_before_current import ChangeOfSortOrderBeforeCurrent
@@ -77,6 +78,8 @@ from extract_features.fraction_pos_price import FractionPosPrice
 from extract_features.past_future_session_features import PastFutureSessionFeatures
 from extract_features.normalized_platform_features_similarity import NormalizedPlatformFeaturesSimilarity
 from utils.menu import single_choice
+from utils.feature_matrix import feature_matrix, save_columns
+from extract_features.feature_store import save_features_array
 from preprocess_utils.merge_features import merge_features
 from os.path import join
 
@@ -110,9 +113,8 @@ def create_weights(df):
     return weights
 
 
-def create_dataset(mode, cluster, class_weights=False):
-    # training
-    kind = input('insert the kind: ')
+def kind_features(kind):
+    """ Return the features array used to create the dataset of the specified kind """
 
     if kind == 'label':
         features_array = [ImpressionLabel]
@@ -278,6 +280,14 @@ def create_dataset(mode, cluster, class_weights=False):
             SessionNumClickouts
         ]
 
+    return features_array
+
+
+def create_dataset(mode, cluster, class_weights=False):
+    # training
+    kind = input('insert the kind: ')
+    features_array = kind_features(kind)
+
     scores_array = [
         # 'rnn_classifier.csv.gz', 
         # 'rnn_no_bias_balanced.csv.gz',
@@ -312,9 +322,6 @@ def create_dataset(mode, cluster, class_weights=False):
                 test_df = test_df.merge(score, on=['user_id', 'session_id'], how='left')
                 print(f'train_shape: {train_df.shape}\n vali_shape: {test_df.shape}')
 
-    train_df = train_df.replace(-1, np.nan)
-    test_df = test_df.replace(-1, np.nan)
-
     bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
     check_folder(bp)
 
@@ -325,21 +332,19 @@ def create_dataset(mode, cluster, class_weights=False):
         np.save(join(bp, 'class_weights'), weights)
         print('class weights saved')
 
+    # the -1 of the features are missing values (NaN)
+    drop_columns = ['index', 'user_id', 'session_id', 'item_id', 'label']
     if class_weights:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
-    print(','.join(X_train.columns.values))
-    X_train = X_train.to_sparse(fill_value=0)
-    X_train = X_train.astype(np.float64)
-    X_train = X_train.to_coo().tocsr()
+        drop_columns.append('weights')
+    X_train, columns = feature_matrix(train_df, drop_columns)
+    print(','.join(columns))
     save_npz(join(bp, 'X_train'), X_train)
+    save_columns(columns, join(bp, 'columns.json'))
+    save_features_array(features_array, join(bp, 'features.json'))
     print('X_train saved')
 
     user_session_item = train_df[['user_id', 'session_id', 'item_id']]
-    user_session_item.to_csv(join(bp, 'user_session_item_train.csv'), index=False)
+    storage.save_df(user_session_item, join(bp, 'user_session_item_train.csv'), index=False)
 
     y_train = train_df[['label']]
     y_train.to_csv(join(bp, 'y_train.csv'))
@@ -354,21 +359,12 @@ def create_dataset(mode, cluster, class_weights=False):
 
     print('train data completed')
 
-    if class_weights:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
-
-    X_test = X_test.to_sparse(fill_value=0)
-    X_test = X_test.astype(np.float64)
-    X_test = X_test.to_coo().tocsr()
+    X_test, _ = feature_matrix(test_df, drop_columns)
     save_npz(join(bp, 'X_test'), X_test)
     print('X_test saved')
 
     user_session_item = test_df[['user_id', 'session_id', 'item_id']]
-    user_session_item.to_csv(join(bp, 'user_session_item_test.csv'), index=False)
+    storage.save_df(user_session_item, join(bp, 'user_session_item_test.csv'), index=False)
 
     y_test = test_df[['label']]
     y_test.to_csv(join(bp, 'y_test.csv'))
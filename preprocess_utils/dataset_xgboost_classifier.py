@@ -1,4 +1,5 @@
 import data
+import utils.storage as storage
 from extract_features.classifier.avg_interacted_price import AvgInteractedPrice
 from extract_features.classifier.first_impression_price_info import FirstImpressionPriceInfo
 from extract_features.classifier.location_reference_first_impression import LocationReferenceFirstImpression
@@ -79,8 +80,8 @@ def create_dataset(mode, cluster):
     train_df, test_df = merge_features_classifier(mode, cluster, features_array, LabelClassification)
     check_folder('dataset/preprocessed/{}/{}/xgboost_classifier/'.format(cluster, mode))
 
-    train_df.to_csv('dataset/preprocessed/{}/{}/xgboost_classifier/train.csv'.format(cluster, mode), index=False)
-    test_df.to_csv('dataset/preprocessed/{}/{}/xgboost_classifier/test.csv'.format(cluster, mode), index=False)
+    storage.save_df(train_df, 'dataset/preprocessed/{}/{}/xgboost_classifier/train.csv'.format(cluster, mode), index=False)
+    storage.save_df(test_df, 'dataset/preprocessed/{}/{}/xgboost_classifier/test.csv'.format(cluster, mode), index=False)
 
     print("Dataset created!")
 
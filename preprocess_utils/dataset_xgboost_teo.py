@@ -74,6 +74,8 @@ from extract_features.times_user_interacted_with_impression import TimesUserInte
 from extract_features.classifier.last_action_before_clickout import LastActionBeforeClickout
 from extract_features.fraction_pos_price import FractionPosPrice
 from utils.menu import single_choice
+from utils.feature_matrix import feature_matrix, save_columns
+from extract_features.feature_store import save_features_array
 from preprocess_utils.merge_features import merge_features
 from os.path import join
 from extract_features.past_future_session_features import PastFutureSessionFeatures
@@ -265,9 +267,6 @@ def create_dataset(mode, cluster, class_weights=False, weights_position=True, lo
 
     train_df, test_df, train_idxs, _ = merge_features(mode, cluster, features_array, merge_kind='left')
 
-    train_df = train_df.replace(-1, np.nan)
-    test_df = test_df.replace(-1, np.nan)
-
     bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
     check_folder(bp)
     train_df.to_csv(join(bp, 'train_df.csv'))
@@ -279,12 +278,10 @@ def create_dataset(mode, cluster, class_weights=False, weights_position=True, lo
         np.save(join(bp, 'class_weights'), weights)
         print('class weights saved')
 
+    # the -1 of the features are missing values (NaN)
+    drop_columns = ['index', 'user_id', 'session_id', 'item_id', 'label']
     if class_weights:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_train = train_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
+        drop_columns.append('weights')
 
     if weights_position:
         weights = create_weights_position(train_df, mode,cluster)
@@ -298,11 +295,11 @@ def create_dataset(mode, cluster, class_weights=False, weights_position=True, lo
         np.save(join(bp, 'log_weights'), lg_w)
         print('log_weights saved')
 
-    print(','.join(X_train.columns.values))
-    X_train = X_train.to_sparse(fill_value=0)
-    X_train = X_train.astype(np.float64)
-    X_train = X_train.to_coo().tocsr()
+    X_train, columns = feature_matrix(train_df, drop_columns)
+    print(','.join(columns))
     save_npz(join(bp, 'X_train'), X_train)
+    save_columns(columns, join(bp, 'columns.json'))
+    save_features_array(features_array, join(bp, 'features.json'))
     print('X_train saved')
 
     user_session_item = train_df[['user_id', 'session_id', 'item_id']]
@@ -321,16 +318,7 @@ def create_dataset(mode, cluster, class_weights=False, weights_position=True, lo
 
     print('train data completed')
 
-    if class_weights:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label', 'weights'], axis=1)
-    else:
-        X_test = test_df.drop(
-            ['index', 'user_id', 'session_id', 'item_id', 'label'], axis=1)
-
-    X_test = X_test.to_sparse(fill_value=0)
-    X_test = X_test.astype(np.float64)
-    X_test = X_test.to_coo().tocsr()
+    X_test, _ = feature_matrix(test_df, drop_columns)
     save_npz(join(bp, 'X_test'), X_test)
     print('X_test saved')
 
@@ -0,0 +1,157 @@
+import os
+import numpy as np
+import pandas as pd
+import data
+import utils.storage as storage
+from utils.check_folder import check_folder
+
+"""
+Impression table: the impressions and prices of all the clickouts of a split, parsed once and saved as
+memory-mapped arrays in a CSR-like layout:
+
+    row_index:  (rows,)     index of the clickout row in the train/test df (sorted)
+    offsets:    (rows+1,)   impressions of row i are in [offsets[i], offsets[i+1])
+    item_id:    (n,)        int32 item ids
+    position:   (n,)        int32 1-based position of the item in the impressions list
+    price:      (n,)        int32 prices
+
+so that features and datasets can get the expanded (row, position, item, price) arrays without
+splitting the pipe-separated strings again.
+"""
+
+TABLE_PATH = 'dataset/preprocessed/{}/{}/impressions/'
+ARRAYS = ['row_index', 'offsets', 'item_id', 'position', 'price']
+
+# number of clickout rows parsed at once
+_CHUNK_ROWS = 100000
+
+_tables = {}
+
+
+class ImpressionTable(object):
+    """ Read-only view over the memory-mapped impression arrays of a split """
+
+    def __init__(self, path):
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def rows(self, indices):
+        """ Return the positions in the table of the specified df indices """
+        indices = np.asarray(indices)
+        pos = np.searchsorted(self.row_index, indices)
+        pos[pos == len(self.row_index)] = 0
+        missing = self.row_index[pos] != indices
+        if missing.any():
+            raise KeyError('{} indices are not clickouts with impressions, eg: {}'.format(
+                missing.sum(), indices[missing][:5]))
+        return pos
+
+    def lengths(self, indices=None):
+        """ Return the number of impressions of the specified df indices (all the rows if None) """
+        if indices is None:
+            return np.diff(self.offsets)
+        pos = self.rows(indices)
+        return self.offsets[pos + 1] - self.offsets[pos]
+
+    def expand(self, indices=None):
+        """
+        Return the expanded impressions of the specified df indices (all the rows if None) in the given order,
+        as 4 aligned arrays: (row, position, item_id, price), where row is the df index of the clickout.
+        """
+        if indices is None:
+            lengths = np.diff(self.offsets)
+            row = np.repeat(np.asarray(self.row_index), lengths)
+            return row, np.asarray(self.position), np.asarray(self.item_id), np.asarray(self.price)
+
+        indices = np.asarray(indices)
+        pos = self.rows(indices)
+        starts = self.offsets[pos]
+        lengths = self.offsets[pos + 1] - starts
+        # flat positions of the selected impressions: start of each row + offset inside the row
+        row_starts = np.cumsum(lengths) - lengths
+        flat = np.repeat(starts - row_starts, lengths) + np.arange(lengths.sum())
+        return np.repeat(indices, lengths), self.position[flat], self.item_id[flat], self.price[flat]
+
+    def expand_df(self, df):
+        """
+        Same as last_clickout_indices.expand_impressions, but reading the item ids from the table.
+        df must contain only clickout rows of the split; the impressions column is not required.
+        """
+        _, _, item_id, _ = self.expand(df.index.values)
+        lengths = self.lengths(df.index.values)
+        res_df = df.reset_index()
+        # item_id takes the place of the impressions column (or goes at the end if missing)
+        columns = [c if c != 'impressions' else 'item_id' for c in res_df.columns]
+        if 'item_id' not in columns:
+            columns.append('item_id')
+
+        res_df = pd.DataFrame({col: np.repeat(res_df[col].values, lengths)
+                               for col in res_df.columns.drop('impressions', errors='ignore')})
+        res_df['item_id'] = item_id.astype('int')
+        return res_df[columns]
+
+
+def parse_pipe_separated(values):
+    """ Parse an array of pipe-separated integer strings into a flat int32 array """
+    return np.fromstring(' '.join(values).replace('|', ' '), dtype=np.int64, sep=' ').astype(np.int32)
+
+
+def build(mode, cluster='no_cluster'):
+    """ Parse the impressions of the clickouts of train and test and save the impression table """
+    path = TABLE_PATH.format(cluster, mode)
+    check_folder(path, point_allowed_path=True)
+    print('building impression table of {} {}...'.format(cluster, mode), flush=True)
+
+    cols = ['action_type', 'impressions', 'prices']
+    df = pd.concat([data.train_df(mode, cluster, columns=cols), data.test_df(mode, cluster, columns=cols)])
+    df = df[(df.action_type == 'clickout item') & df.impressions.notnull()].sort_index()
+
+    impressions = df.impressions.values
+    prices = df.prices.values
+    lengths = df.impressions.str.count(r'\|').values + 1
+    offsets = np.zeros(len(df) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    tot = int(offsets[-1])
+
+    item_id = np.lib.format.open_memmap(os.path.join(path, 'item_id.npy'), mode='w+', dtype=np.int32, shape=(tot,))
+    price = np.lib.format.open_memmap(os.path.join(path, 'price.npy'), mode='w+', dtype=np.int32, shape=(tot,))
+    for i in range(0, len(df), _CHUNK_ROWS):
+        start, end = offsets[i], offsets[min(i + _CHUNK_ROWS, len(df))]
+        item_id[start:end] = parse_pipe_separated(impressions[i:i + _CHUNK_ROWS])
+        price[start:end] = parse_pipe_separated(prices[i:i + _CHUNK_ROWS])
+    item_id.flush()
+    price.flush()
+    del item_id, price
+
+    # 1-based position of each impression inside its row
+    position = np.arange(tot, dtype=np.int64) - np.repeat(offsets[:-1], lengths) + 1
+    np.save(os.path.join(path, 'position.npy'), position.astype(np.int32))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'row_index.npy'), df.index.values.astype(np.int64))
+    print('Done! {} clickouts, {} impressions'.format(len(df), tot))
+
+
+def load(mode, cluster='no_cluster'):
+    """ Return the impression table of the split, building it if missing or older than the split """
+    path = TABLE_PATH.format(cluster, mode)
+    split_mtime = storage.split_mtime(mode, cluster)
+    if path in _tables and _tables[path][0] >= split_mtime:
+        return _tables[path][1]
+
+    files = [os.path.join(path, '{}.npy'.format(name)) for name in ARRAYS]
+    if not all(os.path.isfile(f) for f in files) or min(os.path.getmtime(f) for f in files) < split_mtime:
+        build(mode, cluster)
+    mtime = min(os.path.getmtime(f) for f in files)
+    _tables[path] = (mtime, ImpressionTable(path))
+    return _tables[path][1]
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    mode = mode_selection()
+    cluster = cluster_selection()
+    build(mode, cluster)
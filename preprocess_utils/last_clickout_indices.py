@@ -1,37 +1,67 @@
-from tqdm.auto import tqdm
+import os
 import pandas as pd
 import numpy as np
+import data
+import utils.storage as storage
+from utils.check_folder import check_folder
+
+LAST_CLICKOUTS_PATH = 'dataset/preprocessed/{}/{}/last_clickout_indices.npy'
+
+# cache of the split indices: path -> (mtime, indices)
+_last_clickouts = {}
 
 
 def find(df):
     """ 
     Return the last clickouts of each session in df.
+    If a session contains some clickouts with missing reference, the first of them is returned.
     """
-    temp_df = df.sort_values(['user_id','session_id','timestamp','step'])
-    if 'index' in temp_df.columns:
-        temp_df = temp_df.rename(columns={'index':'$_index'})
-
-    temp_df = temp_df.reset_index()
-    temp_df = temp_df[temp_df.action_type == 'clickout item'][['index','user_id','session_id','action_type','reference']]
-
-    indices = []
-    cur_ses = ''
-    cur_user = ''
-    for idx in tqdm(temp_df.index.values[::-1]):
-        #print(temp_df.at[idx, 'index'])
-        ruid = temp_df.at[idx, 'user_id']
-        rsid = temp_df.at[idx, 'session_id']
-        reference = temp_df.at[idx, 'reference']
-        if (ruid != cur_user or rsid != cur_ses):
-            # append the original index
-            indices.append(temp_df.at[idx, 'index'])
-            cur_user = ruid
-            cur_ses = rsid
-        else:
-            if pd.isnull(reference):
-                indices = indices[:-1]
-                indices.append(temp_df.at[idx, 'index'])
-    return indices[::-1]
+    temp_df = df[['user_id','session_id','timestamp','step','action_type','reference']] \
+                .sort_values(['user_id','session_id','timestamp','step'])
+    temp_df = temp_df[temp_df.action_type == 'clickout item']
+
+    user_ids = temp_df.user_id.values
+    session_ids = temp_df.session_id.values
+    # sessions are contiguous after sorting, label each of them with an incremental number
+    new_session = np.ones(len(temp_df), dtype=bool)
+    new_session[1:] = (user_ids[1:] != user_ids[:-1]) | (session_ids[1:] != session_ids[:-1])
+    session_number = np.cumsum(new_session) - 1
+
+    # by default take the last clickout of the session...
+    is_last = np.ones(len(temp_df), dtype=bool)
+    is_last[:-1] = new_session[1:]
+    indices = temp_df.index.values[is_last]
+
+    # ...but the first clickout with missing reference has the precedence
+    missing_ref_pos = np.flatnonzero(temp_df.reference.isnull().values)
+    sessions_with_missing, first_missing = np.unique(session_number[missing_ref_pos], return_index=True)
+    indices[sessions_with_missing] = temp_df.index.values[missing_ref_pos[first_missing]]
+
+    return list(indices)
+
+
+def find_split(mode, cluster='no_cluster'):
+    """
+    Return the last clickouts of the concatenation of train and test of the specified split.
+    Same as find(pd.concat([data.train_df(mode, cluster), data.test_df(mode, cluster)])), but the indices
+    are computed once and cached on disk.
+    """
+    path = LAST_CLICKOUTS_PATH.format(cluster, mode)
+    # check if the cached indices are older than the split
+    split_mtime = storage.split_mtime(mode, cluster)
+    if path in _last_clickouts and _last_clickouts[path][0] >= split_mtime:
+        return list(_last_clickouts[path][1])
+
+    if os.path.isfile(path) and os.path.getmtime(path) >= split_mtime:
+        indices = np.load(path)
+    else:
+        print('caching last clickout indices of {} {}...'.format(cluster, mode), flush=True)
+        df = pd.concat([data.train_df(mode, cluster), data.test_df(mode, cluster)])
+        indices = np.array(find(df))
+        check_folder(path)
+        np.save(path, indices)
+    _last_clickouts[path] = (os.path.getmtime(path), indices)
+    return list(indices)
 
 
 # def find(df):
@@ -92,6 +92,8 @@ from utils.menu import single_choice
 from preprocess_utils.merge_features import merge_features
 
 from os.path import join
+from utils.feature_matrix import save_columns
+from extract_features.feature_store import save_features_array
 
 def merge_features_lgb(mode, cluster, features_array):
 
@@ -209,6 +211,10 @@ def create_lightGBM_dataset(mode, cluster, features_array, dataset_name):
     check_folder(f"{_BASE_PATH}")
     with open(f"{_BASE_PATH}/Features.txt", "w+") as text_file:
         text_file.write(str([str(fn) for fn in features_array]))
+    # features and columns of the dataset, read by the ranking server (see serving/server.py)
+    save_features_array(features_array, f'{_BASE_PATH}/features.json', onehot=False)
+    save_columns([c for c in train_df.columns if c not in ['index', 'user_id', 'session_id', 'item_id', 'label']],
+                 f'{_BASE_PATH}/columns.json')
 
     Hera.send_message('SAVING TRAIN LIGHTGBM...')
     _save_dataset(_BASE_PATH, 'train', train_df)
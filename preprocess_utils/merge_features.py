@@ -1,17 +1,24 @@
+import os
+import shutil
+import multiprocessing as mp
 import data
 from tqdm import tqdm
 import pandas as pd
 import numpy as np
-from preprocess_utils.last_clickout_indices import find as find_last_clickout_indices
-from preprocess_utils.last_clickout_indices import expand_impressions
-from joblib import Parallel, delayed
+from preprocess_utils.last_clickout_indices import find_split
+import preprocess_utils.impression_table as impression_table
+from utils.check_folder import check_folder
 
-"""
-    given an array of features for ranking, it merges those in a single dataframe and returns
-    a train and test df. the test df contains just the target sessions, identified by the target indices 
-    in that mode and cluster, in the order in which the target indices are
-"""
-def merge_features(mode, cluster, features_array, onehot=True, merge_kind='inner', create_not_existing_features=True, multithread=False):
+# folder of the memory-mapped key columns shared with the merge workers
+SHARED_KEYS_PATH = 'dataset/preprocessed/{}/{}/merge_keys/'
+# string key columns, shared with the workers as integer codes
+_CODED_KEYS = ['user_id', 'session_id']
+
+def base_dfs(mode, cluster):
+    """
+    Return the train and the test dataframes with a row for each impression of the last clickouts
+    (columns: user_id, session_id, item_id, index, dummy_step), the train and the test indices
+    """
     # load the full_df
     train_df = data.train_df(mode, cluster)
     test_df = data.test_df(mode, cluster)
@@ -20,7 +27,7 @@ def merge_features(mode, cluster, features_array, onehot=True, merge_kind='inner
 
     # retrieve the indeces of the last clikcouts
     print('find_last_click_idxs')
-    last_click_idxs=find_last_clickout_indices(full_df)
+    last_click_idxs=find_split(mode, cluster)
     last_click_idxs = sorted(last_click_idxs)
 
     # filter on the found indeces obtaining only the rows of a last clickout
@@ -47,11 +54,24 @@ def merge_features(mode, cluster, features_array, onehot=True, merge_kind='inner
 
     # expand the impression as rows
     print('expand the impression')
-    train_df = expand_impressions(train_df)[['user_id', 'session_id', 'item_id', 'index']]
+    impressions = impression_table.load(mode, cluster)
+    train_df = impressions.expand_df(train_df[['user_id', 'session_id']])[['user_id', 'session_id', 'item_id', 'index']]
     train_df['dummy_step']=np.arange(len(train_df))
-    validation_test_df = expand_impressions(validation_test_df)[['user_id', 'session_id', 'item_id', 'index']]
+    validation_test_df = impressions.expand_df(validation_test_df[['user_id', 'session_id']])[['user_id', 'session_id', 'item_id', 'index']]
     validation_test_df['dummy_step'] = np.arange(len(validation_test_df))
+    return train_df, validation_test_df, train_idxs, vali_test_idxs
+
+
+"""
+    given an array of features for ranking, it merges those in a single dataframe and returns
+    a train and test df. the test df contains just the target sessions, identified by the target indices 
+    in that mode and cluster, in the order in which the target indices are
+"""
+def merge_features(mode, cluster, features_array, onehot=True, merge_kind='inner', create_not_existing_features=True, multithread=False):
+    train_df, validation_test_df, train_idxs, vali_test_idxs = base_dfs(mode, cluster)
 
+    # the aligned join keeps the order of the rows, so sort them once before joining
+    validation_test_df = validation_test_df.sort_values(['index', 'dummy_step'])
     if not multithread:
         train_df, validation_test_df = actual_merge_one_thread(train_df, validation_test_df, features_array, \
                                                                     mode, cluster, create_not_existing_features, merge_kind, onehot)
@@ -59,82 +79,237 @@ def merge_features(mode, cluster, features_array, onehot=True, merge_kind='inner
         train_df, validation_test_df = actual_merge_multithread(train_df, validation_test_df, features_array, \
                                                                     mode, cluster, create_not_existing_features, merge_kind, onehot)
 
-    print('sorting by index and step...')
-    # sort the dataframes
-    train_df.sort_values(['index', 'dummy_step'], inplace=True)
-    train_df.drop('dummy_step', axis=1, inplace=True
-                  )
-    validation_test_df.sort_values(['index', 'dummy_step'], inplace=True)
+    train_df.drop('dummy_step', axis=1, inplace=True)
     validation_test_df.drop('dummy_step', axis=1, inplace=True)
 
     print('after join')
     return train_df, validation_test_df, train_idxs, vali_test_idxs
 
-def actual_merge_multithread(train_df, validation_test_df, features_array, mode, cluster, create_not_existing_features, merge_kind, onehot):
-    print('join with the features')
-    print(f'train_shape: {train_df.shape}\n vali_test_shape: {validation_test_df.shape}')
+def _read_feature(f, mode, cluster, onehot, create_not_existing_features):
+    if type(f) == tuple:
+        return f[0](mode=mode, cluster=cluster).read_feature(one_hot=f[1], create_not_existing_features=create_not_existing_features)
+    else:
+        return f(mode=mode, cluster=cluster).read_feature(one_hot=onehot, create_not_existing_features=create_not_existing_features)
 
-    print(features_array)
 
-    r = Parallel(backend='multiprocessing', n_jobs=-1, max_nbytes=None)(delayed(_pickled_function_merge)
-                        (
-                            train_df, validation_test_df, f,
-                            mode, cluster, onehot, merge_kind,
-                            create_not_existing_features
-                        ) for f in features_array)
+class AlignedJoin(object):
+    """
+    Join the features to a base dataframe without calling DataFrame.merge for each of them.
 
-    to_concat_train = [i[0] for i in r]
-    to_concat_train.insert(0, train_df)
+    The keys of each feature (item-level, session-level or impression-level) are mapped once to the row offsets
+    of the base, then the float columns are written in float32 blocks allocated with their exact size, one for
+    each run of consecutive float columns of a feature. The other columns keep their dtype, unless missing rows
+    have to be filled with NaN (as DataFrame.merge does). The order of the base rows is kept, so no sort is
+    needed after the join.
+    """
 
-    to_concat_validation = [i[1] for i in r]
-    to_concat_validation.insert(0, validation_test_df)
+    def __init__(self, base_df, merge_kind='inner', keys=None):
+        """
+        base_df (pd.DataFrame): rows to join the features to
+        keys (dict): key column -> array. If specified base_df can be None, used by the merge workers
+        """
+        assert merge_kind in ['inner', 'left']
+        self.base_df = base_df
+        self.merge_kind = merge_kind
+        if keys is None:
+            keys = {c: base_df[c].values for c in base_df.columns}
+        self.keys = keys
+        self.n_rows = len(next(iter(keys.values())))
+        self.keep = np.ones(self.n_rows, dtype=bool)
+        # base index for each set of key columns
+        self._base_keys = {}
+        # joined columns in order: (columns, float32 block (columns, rows)) or (column, values)
+        self._segments = []
+        self.columns = []
 
-    train_df = pd.concat(to_concat_train, axis=1)
-    validation_test_df = pd.concat(to_concat_validation, axis=1)
+    def _keys_index(self, arrays):
+        if len(arrays) == 1:
+            return pd.Index(arrays[0])
+        return pd.MultiIndex.from_arrays(arrays)
 
-    print('train df shape: {}'.format(train_df.shape))
-    print('validation df shape: {}'.format(validation_test_df.shape))
+    def row_offsets(self, feature, on):
+        """ Return for each base row the position of the matching feature row (-1 if missing) """
+        key = tuple(on)
+        if key not in self._base_keys:
+            self._base_keys[key] = self._keys_index([np.asarray(self.keys[c]) for c in on])
+        feature_keys = self._keys_index([feature[c].values for c in on])
+        if not feature_keys.is_unique:
+            raise ValueError('the feature has duplicated keys on {}'.format(on))
+        return feature_keys.get_indexer(self._base_keys[key])
 
-    return train_df, validation_test_df
+    def add(self, feature):
+        """ Join the feature columns to the base. Return the mask of the base rows found in the feature """
+        on = [c for c in self.keys if c in feature.columns]
+        offsets = self.row_offsets(feature, on)
+        matched = offsets != -1
+        matched_offsets = offsets[matched]
+        if self.merge_kind == 'inner':
+            self.keep &= matched
+        # the rows not matched by an inner join are dropped, so they do not need to be filled
+        fill = not matched.all() and (self.merge_kind == 'left' or len(feature) == 0)
+        take_offsets = offsets if fill else np.where(matched, offsets, 0)
 
-def _pickled_function_merge(train_df, validation_test_df, f, mode, cluster, onehot, merge_kind, create_not_existing_features):
-        print(f)
-        if type(f) == tuple:
-            feature = f[0](mode=mode, cluster=cluster).read_feature(one_hot=f[1], create_not_existing_features=create_not_existing_features)
-        else:
-            feature = f(mode=mode, cluster=cluster).read_feature(one_hot=onehot, create_not_existing_features=create_not_existing_features)
-        print(f'len of feature:{len(feature)}')
-        train_df = train_df.merge(feature, how=merge_kind)
-        validation_test_df = validation_test_df.merge(feature, how=merge_kind)
-        print(f'train_shape: {train_df.shape}\n vali_shape: {validation_test_df.shape}')
-        if merge_kind == 'left':
-            delta_nan_train = train_df[train_df.columns[-len(feature.columns):]].isnull().sum().sum()
-            print('train: num columns of feature: {}. nans introduced: {}'.format(len(feature.columns), delta_nan_train))
-            delta_nan_validation = validation_test_df[validation_test_df.columns[-len(feature.columns):]].isnull().sum().sum()
-            print('validation: num columns of feature: {}. nans introduced: {}'.format(len(feature.columns), delta_nan_validation))
-            print('\n')
+        run = []
+        for col in feature.columns.drop(on):
+            values = feature[col].values
+            if _is_float(values):
+                run.append(col)
+                continue
+            self._add_float_block(feature, run, matched, matched_offsets)
+            run = []
+            if isinstance(values, np.ndarray):
+                values = pd.api.extensions.take(values, take_offsets, allow_fill=fill)
+            else:
+                values = values.take(take_offsets, allow_fill=fill)
+            self._segments.append((col, values))
+            self.columns.append(col)
+        self._add_float_block(feature, run, matched, matched_offsets)
+        return matched
+
+    def _add_float_block(self, feature, columns, matched, matched_offsets):
+        if len(columns) == 0:
+            return
+        block = np.empty((len(columns), self.n_rows), dtype=np.float32)
+        for row, col in zip(block, columns):
+            row[~matched] = np.nan
+            row[matched] = feature[col].values[matched_offsets]
+        self._segments.append((list(columns), block))
+        self.columns.extend(columns)
+
+    def block(self):
+        """ Return the joined columns as (columns, segments), see add_block """
+        return list(self.columns), self._segments
+
+    def add_block(self, columns, segments, matched):
+        """ Add the columns aligned by another AlignedJoin on the same keys (see block) """
+        if self.merge_kind == 'inner':
+            self.keep &= matched
+        self._segments.extend(segments)
+        self.columns.extend(columns)
+
+    def to_df(self):
+        """ Return the base dataframe with all the joined columns """
+        keep_all = self.keep.all()
+        kept = np.flatnonzero(self.keep)
+        n = len(kept)
+        base_df = self.base_df.reset_index(drop=True)
+        frames = [base_df if keep_all else base_df.iloc[kept].reset_index(drop=True)]
+        for columns, values in self._segments:
+            if isinstance(columns, list):
+                if not keep_all:
+                    # move the kept rows to the beginning of each column, without copying the block
+                    for row in values:
+                        row[:n] = row[kept]
+                    values = values[:, :n]
+                frames.append(pd.DataFrame(values.T, columns=columns, copy=False))
+            else:
+                if not keep_all:
+                    values = values.take(kept) if not isinstance(values, np.ndarray) else values[kept]
+                frames.append(pd.DataFrame({columns: values}))
+        return pd.concat(frames, axis=1, copy=False)
+
+
+def _is_float(values):
+    """ Return True if the array is stored in the float32 blocks """
+    return isinstance(values, np.ndarray) and values.dtype.kind == 'f'
 
-        return (train_df.drop(['user_id', 'session_id', 'item_id', 'index', 'dummy_step'], axis=1),
-                    validation_test_df.drop(['user_id', 'session_id', 'item_id', 'index', 'dummy_step'], axis=1))
 
 def actual_merge_one_thread(train_df, validation_test_df, features_array, mode, cluster,  create_not_existing_features, merge_kind, onehot):
     print('join with the features')
     print(f'train_shape: {train_df.shape}\n vali_test_shape: {validation_test_df.shape}')
+    train_join = AlignedJoin(train_df, merge_kind)
+    validation_join = AlignedJoin(validation_test_df, merge_kind)
     for f in features_array:
-        if type(f) == tuple:
-            feature = f[0](mode=mode, cluster=cluster).read_feature(one_hot=f[1], create_not_existing_features=create_not_existing_features)
-        else:
-            feature = f(mode=mode, cluster=cluster).read_feature(one_hot=onehot, create_not_existing_features=create_not_existing_features)
+        feature = _read_feature(f, mode, cluster, onehot, create_not_existing_features)
         print(f'len of feature:{len(feature)}')
-        train_df = train_df.merge(feature, how=merge_kind)
-        validation_test_df = validation_test_df.merge(feature, how=merge_kind)
-        print(f'train_shape: {train_df.shape}\n vali_shape: {validation_test_df.shape}')
+        matched_train = train_join.add(feature)
+        matched_validation = validation_join.add(feature)
+        print(f'train_shape: {(train_join.keep.sum(), len(train_df.columns) + len(train_join.columns))}\n '
+              f'vali_shape: {(validation_join.keep.sum(), len(validation_test_df.columns) + len(validation_join.columns))}')
 
         if merge_kind == 'left':
-            delta_nan_train = train_df[train_df.columns[-len(feature.columns):]].isnull().sum().sum()
-            print('train: num columns of feature: {}. nans introduced: {}'.format(len(feature.columns), delta_nan_train))
-            delta_nan_validation = validation_test_df[validation_test_df.columns[-len(feature.columns):]].isnull().sum().sum()
-            print('validation: num columns of feature: {}. nans introduced: {}'.format(len(feature.columns), delta_nan_validation))
+            num_columns = len(feature.columns) - len(set(feature.columns) & set(train_df.columns))
+            print('train: num columns of feature: {}. nans introduced: {}'.format(num_columns, (~matched_train).sum() * num_columns))
+            print('validation: num columns of feature: {}. nans introduced: {}'.format(num_columns, (~matched_validation).sum() * num_columns))
             print('\n')
 
-    return train_df, validation_test_df
\ No newline at end of file
+    return train_join.to_df(), validation_join.to_df()
+
+
+def _share_keys(path, bases):
+    """
+    Save the key columns of the base dataframes as memory-mapped arrays in path. The string keys are saved
+    as integer codes of a vocabulary common to all the bases.
+    Return the list of the key columns.
+    """
+    check_folder(path, point_allowed_path=True)
+    keys = [c for c in bases[0].columns if c != 'dummy_step']
+    for c in keys:
+        values = np.concatenate([b[c].values for b in bases])
+        if c in _CODED_KEYS:
+            values, vocabulary = pd.factorize(values)
+            np.save(os.path.join(path, '{}_vocabulary.npy'.format(c)), vocabulary.astype(object), allow_pickle=True)
+        start = 0
+        for i, b in enumerate(bases):
+            np.save(os.path.join(path, '{}_{}.npy'.format(c, i)), values[start:start + len(b)])
+            start += len(b)
+    return keys
+
+
+# vocabularies of the coded keys loaded by the worker
+_vocabularies = {}
+
+
+def _merge_block(args):
+    """
+    Worker: read a feature and align it to the memory-mapped keys of each base.
+    args: (path, keys, n_bases, f, mode, cluster, onehot, merge_kind, create_not_existing_features)
+    Return for each base (columns, segments, matched rows), so only the new feature columns are sent back to
+    the main process.
+    """
+    path, keys, n_bases, f, mode, cluster, onehot, merge_kind, create_not_existing_features = args
+    feature = _read_feature(f, mode, cluster, onehot, create_not_existing_features)
+    print(f'len of feature:{len(feature)}')
+    for c in _CODED_KEYS:
+        if c in feature.columns:
+            vocabulary_path = os.path.join(path, '{}_vocabulary.npy'.format(c))
+            if vocabulary_path not in _vocabularies:
+                _vocabularies[vocabulary_path] = pd.Index(np.load(vocabulary_path, allow_pickle=True))
+            feature[c] = _vocabularies[vocabulary_path].get_indexer(feature[c].values)
+            # keys missing from the bases cannot match any row
+            feature = feature[feature[c] != -1]
+
+    res = []
+    for i in range(n_bases):
+        base_keys = {c: np.load(os.path.join(path, '{}_{}.npy'.format(c, i)), mmap_mode='r') for c in keys}
+        join = AlignedJoin(None, merge_kind, keys=base_keys)
+        matched = join.add(feature)
+        res.append(join.block() + (matched,))
+    return res
+
+
+def actual_merge_multithread(train_df, validation_test_df, features_array, mode, cluster, create_not_existing_features, merge_kind, onehot):
+    print('join with the features')
+    print(f'train_shape: {train_df.shape}\n vali_test_shape: {validation_test_df.shape}')
+
+    print(features_array)
+    path = SHARED_KEYS_PATH.format(cluster, mode)
+    keys = _share_keys(path, [train_df, validation_test_df])
+    train_join = AlignedJoin(train_df, merge_kind)
+    validation_join = AlignedJoin(validation_test_df, merge_kind)
+    try:
+        # the workers are forked and get only the paths of the keys, the blocks are added as soon as they arrive
+        with mp.get_context('fork').Pool() as pool:
+            args = [(path, keys, 2, f, mode, cluster, onehot, merge_kind, create_not_existing_features) for f in features_array]
+            for train_block, validation_block in pool.imap(_merge_block, args):
+                train_join.add_block(*train_block)
+                validation_join.add_block(*validation_block)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    train_df = train_join.to_df()
+    validation_test_df = validation_join.to_df()
+    print('train df shape: {}'.format(train_df.shape))
+    print('validation df shape: {}'.format(validation_test_df.shape))
+
+    return train_df, validation_test_df
@@ -6,6 +6,7 @@ import data
 import pandas as pd
 import utils.sparsedf as sparsedf
 from preprocess_utils.last_clickout_indices import find as find_last_clickout
+import recommenders.reranking as reranking
 
 from extract_features.rnn.session_label import SessionLabel
 
@@ -55,6 +56,25 @@ def one_hot_df_column(df, column_label, classes, sparse=False):
             df[col] = pd.Series(res[:,i], dtype='int8', index=df.index)
     return df.drop(column_label, axis=1)
 
+def categorical_codes(df, column_label, classes):
+    """
+    Substitute a dataframe column with the int8 index of its value in classes (-1 if not in classes), to save
+    it in place of the one-hot columns (see expand_categorical_codes)
+    """
+    df[column_label] = pd.Categorical(df[column_label].values, categories=classes).codes.astype('int8')
+    return df
+
+def expand_categorical_codes(df, column_label, classes):
+    """ Substitute a column of indices (see categorical_codes) with the one-hot columns of the classes """
+    codes = df[column_label].values.astype(int)
+    one_hot = np.zeros((len(codes), len(classes)), dtype='int8')
+    mask = codes >= 0
+    one_hot[np.flatnonzero(mask), codes[mask]] = 1
+    df = df.drop(column_label, axis=1)
+    for i,col in enumerate(classes):
+        df[col] = one_hot[:,i]
+    return df
+
 def add_actions_custom_encoding(df):
     """
     Custom encoding for the interactions type:
@@ -86,12 +106,10 @@ def add_actions_custom_encoding(df):
         0:                         [0, 0, 0, 0, 0, 0]
     }
 
-    res_matrix = np.zeros( (df.shape[0], len(encoding_classes)), dtype='int8')
-    # iterate over the action_type column
-    i = 0
-    for a in tqdm(df['action_type']):
-        res_matrix[i, :] = mapping[a]
-        i += 1
+    # index of each action type in the mapping (-1, the last entry of the mapping, for the padding rows)
+    codes = pd.Categorical(df['action_type'].values, categories=list(mapping.keys())[:-1]).codes
+    lookup = np.array(list(mapping.values()), dtype='int8')
+    res_matrix = lookup[codes]
     # add the resulting columns
     for j,col_name in enumerate(encoding_classes):
         df[col_name] = res_matrix[:,j]
@@ -179,6 +197,38 @@ def merge_reference_features(df, pad_sessions_length):
     res_df.iloc[np.arange(-1,len(res_df),pad_sessions_length)[1:], col_start:col_end] = 0
     return res_df
 
+def reference_features_rows(df, pad_sessions_length, column_label='ref_features_row'):
+    """
+    Add the column with the row of the reference in the accomodations features matrix (see item_features_matrix),
+    -1 for the non-numeric references and for the last interaction of each session, to save it in place of the
+    accomodations one-hot columns (see expand_reference_features)
+    """
+    references = pd.to_numeric(df.reference, errors='coerce').fillna(-1).values.astype(int)
+    rows = data.accomodations_one_hot().index.get_indexer(references)
+    # remove the item features for the last clickout of each session: TO-DO clickout may be not the last item
+    rows[np.arange(-1,len(df),pad_sessions_length)[1:]] = -1
+    df[column_label] = rows.astype('int32')
+    return df
+
+def item_features_matrix():
+    """ Return the accomodations one-hot features as a CSR matrix and the names of its columns """
+    accomodations_df = data.accomodations_one_hot()
+    return sps.csr_matrix(accomodations_df.values, dtype='int8'), list(accomodations_df.columns)
+
+def save_item_features(path):
+    """ Save the accomodations features matrix (see item_features_matrix) and return the names of its columns """
+    matrix, columns = item_features_matrix()
+    sps.save_npz(path, matrix)
+    return columns
+
+def expand_reference_features(df, matrix, columns, column_label='ref_features_row'):
+    """ Substitute the rows of the references (see reference_features_rows) with the accomodations features """
+    rows = df[column_label].values
+    features = matrix[np.maximum(rows, 0)].toarray()
+    features[rows < 0] = 0
+    df = df.drop(column_label, axis=1)
+    return pd.concat([df, pd.DataFrame(features, columns=columns, index=df.index)], axis=1)
+
 
 def add_reference_labels(df, mode, classes_prefix='ref_'):
     """ Add the reference index in the impressions list as a new column for each clickout in the dataframe.
@@ -242,122 +292,107 @@ def add_impressions_as_new_actions(df, new_rows_starting_index=99000000, drop_co
     """
     Add dummy actions before each clickout to indicate each one of the available impressions.
     Prices are incorporated inside the new rows in a new column called 'impression_price'.
-    Since this is the most expensive task of the creation process, a multicore implementation would allow to split
-    the work between the cpu cores (but obviuosly not working!)
+    The new rows of all the clickouts are built at once, a column at a time, from the flat arrays of their
+    impressions and prices.
+    Return the new dataframe and the index following the last new row.
     """
-    df['impression_price'] = 0     #np.nan
-    clickout_rows = df[df.action_type == 'clickout item']
-    print('Total clickout interactions found:', clickout_rows.shape[0], flush=True)
-
-    # build a new empty dataframe containing the original one with additional rows used to append the new interactions
-    columns = list(df.columns)
-    # since we don't know exactly the tot rows to append, estimate it with an upper bound, later we discard the exceeding rows 
-    rows_upper_bound = clickout_rows.shape[0] * 25
-    # indices are expanded with a new series (starting from 'new_rows_starting_index')
-    new_indices = np.concatenate([df.index.values, np.arange(new_rows_starting_index, new_rows_starting_index + rows_upper_bound)])
-    res_df = pd.DataFrame(index=new_indices, columns=columns)
-    # copy the original dataframe at the begininng
-    res_df.iloc[0:df.shape[0]] = df.values
-    # cache the column indices to access quickly at insertion time
-    show_impr_col_index = columns.index('action_type')
-    steps_col_index = columns.index('step')
-    reference_col_index = columns.index('reference')
-    price_col_index = columns.index('impression_price')
-    
-    j = new_rows_starting_index         # keep tracks of the inserted rows
-    for _, row in tqdm(clickout_rows.iterrows()):
-        # for each clickout interaction, create a group of row to write at the end of the resulting dataframe
-        impressions = list(map(int, row.impressions.split('|')))
-        imprs_count = len(impressions)
-        prices = list(map(int, row.prices.split('|')))
-        # repeat the clickout row as many times as the impressions count and set the action_type to 'show_impression'
-        rows_to_set = np.tile(row.values, (imprs_count,1))
-        rows_to_set[:,show_impr_col_index] = 'show_impression'
-        # set the new series of reference, prices, intermediate time steps
-        rows_to_set[:,reference_col_index] = impressions
-        rows_to_set[:,price_col_index] = prices
-        rows_to_set[:,steps_col_index] = np.linspace(row.step-1+1/imprs_count, row.step, imprs_count+1)[0:-1]
-        # write the group of rows into the right location by index
-        indices = np.arange(j, j+imprs_count)
-        res_df.loc[indices] = rows_to_set
-
-        j += imprs_count
-
-    # drop the specified columns and discard the exceeding empty rows
-    res_df = res_df.drop(drop_cols, axis=1).loc[0:j-1]
+    df = df.assign(impression_price=0)
+    clickout_positions = np.flatnonzero(df.action_type.values == 'clickout item')
+    print('Total clickout interactions found:', len(clickout_positions), flush=True)
+
+    impressions, offsets = reranking.split_impressions(df.impressions.values[clickout_positions])
+    prices, _ = reranking.split_impressions(df.prices.values[clickout_positions])
+    counts = np.diff(offsets)
+    # each new row repeats its clickout row
+    rows = np.repeat(clickout_positions, counts)
+    imprs_count = np.repeat(counts, counts)
+    k = np.arange(len(rows)) - np.repeat(offsets[:-1], counts)
+
+    # intermediate time steps, as np.linspace(step-1+1/imprs_count, step, imprs_count+1)[0:-1]
+    step = df.step.values[rows]
+    first_step = step - 1 + 1 / imprs_count
+    steps = k * ((step - first_step) / imprs_count) + first_step
+
+    columns = [c for c in df.columns if c not in drop_cols]
+    new_rows = {c: df[c].values[rows] for c in columns}
+    new_rows['action_type'] = np.full(len(rows), 'show_impression', dtype=object)
+    new_rows['reference'] = impressions
+    new_rows['impression_price'] = prices
+    new_rows['step'] = steps
+    j = new_rows_starting_index + len(rows)
+    new_df = pd.DataFrame(new_rows, columns=columns, index=np.arange(new_rows_starting_index, j))
+
+    res_df = pd.concat([df[columns], new_df])
     return res_df.sort_values(['user_id','session_id','timestamp','step']), j
 
+def padded_positions(df, max_session_length, clickouts_indices=None):
+    """
+    Return the positions in df of the last max_session_length rows of each session up to its last clickout,
+    as a (sessions, max_session_length) int64 matrix aligned to the right, with -1 for the padding.
+    The sessions must be contiguous in df and are in the order of the last clickouts.
+    """
+    if clickouts_indices is None:
+        clickouts_indices = find_last_clickout(df)
+    ends = df.index.get_indexer(clickouts_indices)
+
+    # position of the first row of the session of each row
+    user_ids = df.user_id.values
+    session_ids = df.session_id.values
+    new_session = np.ones(len(df), dtype=bool)
+    new_session[1:] = (user_ids[1:] != user_ids[:-1]) | (session_ids[1:] != session_ids[:-1])
+    starts = np.maximum.accumulate(np.where(new_session, np.arange(len(df)), 0))
+
+    positions = ends[:, None] - np.arange(max_session_length - 1, -1, -1)[None, :]
+    positions[positions < starts[ends][:, None]] = -1
+    return positions
+
 def pad_sessions(df, max_session_length):
     """ Pad/truncate each session to have the specified length (pad by adding a number of initial rows) """
-    tqdm.pandas()
-    
-    clickouts_indices = find_last_clickout(df)
-    # this is equals to the number of sessions (sessions must have at least one clickout)
-    sess_count = len(clickouts_indices)
-    
-    # build the resulting np matrix
-    cols = ['index_column'] + list(df.columns)
-    res = np.zeros((sess_count * max_session_length, len(cols)), dtype='object')
-    res[:,0] = -1        # index col in first column
-    
-    # count how many rows we are taking for each session
-    c = max_session_length
-    j = sess_count-1            # point to last clickout index
-    cur_userid = df.at[clickouts_indices[j], 'user_id']
-    cur_sessid = df.at[clickouts_indices[j], 'session_id']
-    saving_rows = False
-    for idx,row in tqdm(df[::-1].iterrows()):
-        #print(idx)
-        user_id = df.at[idx, 'user_id']
-        sess_id = df.at[idx, 'session_id']
-        
-        same_session_as_last_iteration = (cur_userid == user_id and cur_sessid == sess_id)
-        
-        # check if we are in a new session
-        if not same_session_as_last_iteration:
-            # new session met, pass to the next clickout index
-            cur_userid = user_id
-            cur_sessid = sess_id
-            #print('new session began:', cur_userid, cur_sessid)
-            j -= 1
-            if j < 0:
-                break
-        
-        # start taking a new session when the last clickout is found
-        if idx == clickouts_indices[j]:
-            # restart saving rows from the current one
-            #print('idx is equal to clickout index', clickouts_indices[j])
-            saving_rows = True
-            c = max_session_length
-        
-        # iterating within the same session
-        if c <= max_session_length and c > 0 and saving_rows:
-            # store this interaction
-            row_idx = j * max_session_length + c - 1
-            #print('writing in', row_idx)
-            res[row_idx, 0] = idx
-            res[row_idx, 1:] = row.values
-            c -= 1
-        else:
-            saving_rows = False
-        
-    return pd.DataFrame(res[:,1:], columns=df.columns, index=res[:,0])
+    positions = padded_positions(df, max_session_length).ravel()
+    valid = positions >= 0
+    taken = np.where(valid, positions, 0)
+
+    # the padding rows are zeros with index -1
+    columns = {}
+    for c in df.columns:
+        values = df[c].values
+        padded = values[taken]
+        if padded.dtype.kind not in 'biuf':
+            padded = padded.astype(object)
+        padded[~valid] = 0
+        columns[c] = padded
+    index = np.where(valid, df.index.values[taken], -1)
+    return pd.DataFrame(columns, columns=df.columns, index=index)
 
 def sessions2tensor(df, drop_cols=[], return_index=False):
     """
     Build a tensor of shape (number_of_sessions, sessions_length, features_count).
     It can return also the indices of the tensor elements.
     """
-    if len(drop_cols) > 0:
-        sessions_values_indices_df = df.groupby('session_id').apply(lambda g: pd.Series({'tensor': g.drop(drop_cols, axis=1).values, 'indices': g.index.values}))
+    values = df.drop(drop_cols, axis=1).values if len(drop_cols) > 0 else df.values
+    # sessions in the order of groupby, rows in their original order
+    codes, _ = pd.factorize(df['session_id'].values, sort=True)
+    order = np.argsort(codes, kind='mergesort')
+    lengths = np.bincount(codes)
+    values = values[order]
+    indices = df.index.values[order]
+
+    if len(lengths) > 0 and (lengths == lengths[0]).all():
+        tensor = values.reshape(len(lengths), lengths[0], values.shape[1])
+        indices = indices.reshape(len(lengths), lengths[0])
     else:
-        sessions_values_indices_df = df.groupby('session_id').apply(lambda g: pd.Series({'tensor': g.values, 'indices': g.index.values}))
-    
-    #print(sessions_values_indices_df.shape)
+        # sessions of different lengths
+        splits = np.cumsum(lengths)[:-1]
+        tensor = np.empty(len(lengths), dtype=object)
+        tensor[:] = np.split(values, splits)
+        session_indices = np.empty(len(lengths), dtype=object)
+        session_indices[:] = np.split(indices, splits)
+        indices = session_indices
+
     if return_index:
-        return np.array(sessions_values_indices_df['tensor'].to_list()), np.array(sessions_values_indices_df['indices'].to_list())
+        return tensor, indices
     else:
-        return np.array(sessions_values_indices_df['tensor'].to_list())
+        return tensor
 
 
 
@@ -12,6 +12,10 @@ from tqdm import tqdm
 import scipy.sparse as sps
 tqdm.pandas()
 import utils.telegram_bot as HERA
+import utils.evaluation as evaluation
+import recommenders.reranking as reranking
+import utils.native_dataset as native_dataset
+from utils.feature_matrix import load_columns
 from cython_files.mrr import mrr as mrr_cython
 import time
 
@@ -72,76 +76,72 @@ class XGBoostWrapper(RecommenderBase):
                     self.xg.load_model('models/{}.model'.format(self.name))
                     return
 
-        if self.class_weights:
-            X_train, y_train, group, _, weights, _ = data.dataset_xgboost_train(
-                mode=self.mode, cluster=self.cluster, class_weights=self.class_weights, kind=self.kind)
-        else:
-            X_train, y_train, group, _, _ = data.dataset_xgboost_train(
-                mode=self.mode, cluster=self.cluster, class_weights=self.class_weights, kind=self.kind)
+        dtrain = self._train_dmatrix()
         print('data for train ready')
-
-        if self.class_weights:
-            self.xg.fit(X_train, y_train, group, sample_weight=weights)
-        elif self.weights_position:
-            bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
-            w = np.load(os.path.join(bp, 'weights_position.npy'))
-            print(w.size)
-            print(group.shape)
-            self.xg.fit(X_train, y_train, group, sample_weight=w)
-        elif self.log_weights:
-            bp = 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, kind)
-            w = np.load(os.path.join(bp, 'log_weights.npy'))
-            print(w.size)
-            print(group.shape)
-            self.xg.fit(X_train, y_train, group, sample_weight=w)
-        else:
-            self.xg.fit(X_train, y_train, group)
+        self._train(dtrain)
 
         print('fit done')
         self.xg.save_model('models/{}.model'.format(self.name))
         print('model saved')
 
+    def _dataset_path(self):
+        return 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(self.cluster, self.mode, self.kind)
+
+    def _feature_columns(self):
+        """ Names of the features of the dataset (saved by create_dataset), used as key of the DMatrix cache """
+        path = os.path.join(self._dataset_path(), 'columns.json')
+        return load_columns(path) if os.path.isfile(path) else [self.kind]
+
+    def _weights_name(self):
+        if self.class_weights:
+            return 'class_weights'
+        if self.weights_position:
+            return 'weights_position'
+        if self.log_weights:
+            return 'log_weights'
+        return None
+
+    def _train_dmatrix(self):
+        """ Return the DMatrix of the train, cached in the binary format of xgboost """
+        bp = self._dataset_path()
+        weights_name = self._weights_name()
+        name = 'train' if weights_name is None else 'train_{}'.format(weights_name)
+        sources = [os.path.join(bp, f) for f in ['X_train.npz', 'y_train.csv', 'group_train.npy']]
+        if weights_name is not None:
+            sources.append(os.path.join(bp, '{}.npy'.format(weights_name)))
+
+        def load():
+            if self.class_weights:
+                X_train, y_train, group, _, weights, _ = data.dataset_xgboost_train(
+                    mode=self.mode, cluster=self.cluster, class_weights=self.class_weights, kind=self.kind)
+            else:
+                X_train, y_train, group, _, _ = data.dataset_xgboost_train(
+                    mode=self.mode, cluster=self.cluster, class_weights=self.class_weights, kind=self.kind)
+                weights = np.load(sources[-1]) if weights_name is not None else None
+            return X_train, y_train, group, weights
+
+        path = native_dataset.cache_path(bp, name, self._feature_columns(), 'dmatrix')
+        return native_dataset.xgboost_dmatrix(path, load, sources)
+
+    def _train(self, dtrain):
+        """ Train the ranker on a DMatrix, as XGBRanker.fit does from the arrays """
+        self.xg._Booster = xgb.train(self.xg.get_xgb_params(), dtrain, self.xg.n_estimators)
+
     def recommend_batch(self):
         X_test, _, _, _ = data.dataset_xgboost_test(
             mode=self.mode, cluster=self.cluster, kind=self.kind)
         target_indices = data.target_indices(self.mode, self.cluster)
-        full_impressions = data.full_df()
         print('data for test ready')
-        scores = list(self.xg.predict(X_test))
-        final_predictions = []
-        count = 0
-        for index in tqdm(target_indices):
-            impressions = list(
-                map(int, full_impressions.loc[index]['impressions'].split('|')))
-            predictions = scores[count:count + len(impressions)]
-            couples = list(zip(predictions, impressions))
-            couples.sort(key=lambda x: x[0], reverse=True)
-            _, sorted_impr = zip(*couples)
-            final_predictions.append((index, list(sorted_impr)))
-            count = count+len(impressions)
-        return final_predictions
+        scores = self.xg.predict(X_test)
+        return self.rerank_batch(target_indices, scores)
 
     def get_scores_batch(self):
         X_test, _, _, _ = data.dataset_xgboost_test(
             mode=self.mode, cluster=self.cluster, kind=self.kind)
         target_indices = data.target_indices(self.mode, self.cluster)
-        full_impressions = data.full_df()
         print('data for scores test ready')
-        scores = list(self.xg.predict(X_test))
-        final_predictions_with_scores_test = []
-        count = 0
-        for index in tqdm(target_indices):
-            impressions = list(
-                map(int, full_impressions.loc[index]['impressions'].split('|')))
-            predictions = scores[count:count + len(impressions)]
-            couples = list(zip(predictions, impressions))
-            couples.sort(key=lambda x: x[0], reverse=True)
-            sorted_scores, sorted_impr = zip(*couples)
-            final_predictions_with_scores_test.append(
-                (index, list(sorted_impr), list(sorted_scores)))
-            count = count + len(impressions)
-
-        return final_predictions_with_scores_test
+        scores = self.xg.predict(X_test)
+        return self.rerank_batch(target_indices, scores, with_scores=True)
 
     def compute_MRR(self, predictions):
         """
@@ -157,41 +157,36 @@ class XGBoostWrapper(RecommenderBase):
         else:
             train_df = data.train_df('full')
 
-        target_indices, recs = zip(*predictions)
-        target_indices = list(target_indices)
-        correct_clickouts = train_df.loc[target_indices].reference.values
-        impression = train_df.loc[target_indices].impressions.values
-        len_rec = len(recs)
-        count = 0
+        target_indices = [p[0] for p in predictions]
+        targets = train_df.loc[target_indices]
+        references = evaluation.references_array(targets.reference.values)
 
-        RR = 0
         print("Calculating MRR (hoping for a 0.99)")
-        for i in tqdm(range(len_rec)):
-            if correct_clickouts[i] not in impression[i].split('|'):
-                print(f'Reference {correct_clickouts[i]} not in impression')
-                continue
-            if impression[i].split('|').index(correct_clickouts[i]) != 0 or not self.class_weights:
-                correct_clickout = int(correct_clickouts[i])
-                if correct_clickout in predictions[i][1]:
-                    rank_pos = recs[i].index(correct_clickout) + 1
-                    if rank_pos <= 25:
-                        RR += 1 / rank_pos
-                count += 1
-            else:
-                print('skipping because:')
-                print(impression[i])
-                print(correct_clickouts[i])
+        # position of the reference in the impressions (reciprocal rank 1 means first, 0 means missing)
+        impressions, offsets = reranking.split_impressions(targets.impressions.values)
+        position_rr = evaluation.reciprocal_ranks(impressions, offsets, references)
+        in_impressions = position_rr > 0
+        print(f'{(~in_impressions).sum()} references not in impression')
+        counted = in_impressions
+        if self.class_weights:
+            counted = in_impressions & (position_rr != 1)
+            print(f'skipping {(in_impressions & ~counted).sum()} clickouts on the first impression')
 
-        MRR = RR / count
+        rr = evaluation.predictions_reciprocal_ranks(predictions, targets.reference.values)
+        MRR = evaluation.mrr(rr[counted])
         print(f'MRR: {MRR}')
 
         return MRR
 
     def fit_cv(self, x, y, groups, train_indices, test_indices, **fit_params):
-        X_train = x[train_indices, :]
-        y_train = y.loc[train_indices]
-        _, group = np.unique(groups[train_indices], return_counts=True)
-        self.xg.fit(X_train, y_train, group)
+        def load():
+            _, group = np.unique(groups[train_indices], return_counts=True)
+            return x[train_indices, :], y.loc[train_indices], group, None
+
+        bp = self._dataset_path()
+        name = 'train_rows_{}'.format(native_dataset.rows_hash(train_indices))
+        path = native_dataset.cache_path(bp, name, self._feature_columns(), 'dmatrix')
+        self._train(native_dataset.xgboost_dmatrix(path, load, [os.path.join(bp, 'X_train.npz')]))
 
     def get_scores_cv(self, x, groups, test_indices):
         if x.shape[0] == len(test_indices):
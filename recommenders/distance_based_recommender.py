@@ -11,9 +11,10 @@ import time
 from recommenders.recommender_base import RecommenderBase
 import utils.log as log
 import numpy as np
+import pandas as pd
 import similaripy as sim
+import recommenders.reranking as reranking
 import data
-from tqdm import tqdm
 import scipy.sparse as sps
 import utils.check_folder as cf
 import sklearn.preprocessing as prep
@@ -138,34 +139,24 @@ class DistanceBasedRecommender(RecommenderBase):
         print('recommending batch')
         if not self._has_fit():
             return None
-        full_df = data.full_df()
 
         # compute the R^ by multiplying: R•S or S•R
         R_hat = self.get_r_hat()
 
-        predictions_batch = []
-        scores_batch = []
-        count = 0
-        predicted_count = 0
-        skipped_count = 0
-        for index in tqdm(self.target_indices):
-            impr = list(map(int, full_df.loc[index]['impressions'].split('|')))
-
-            # get ratings
-            l = [[i, R_hat[count, self.dict_col[i]]] for i in impr]
-            l.sort(key=lambda tup: tup[1], reverse=True)
-
-            count += 1
-            if l[0][1] == 0:
-                skipped_count +=1
-                continue
-            else:
-                predicted_count +=1
-            recs = [e[0] for e in l]
-            scores = [e[1] for e in l]
-
-            predictions_batch.append((index, recs))
-            scores_batch.append((index, recs, scores))
+        # get the ratings of all the impressions at once: row i of R^ is the i-th target
+        items, offsets = self.impressions_batch(self.target_indices)
+        rows = np.repeat(np.arange(len(self.target_indices)), np.diff(offsets))
+        cols = pd.Series(self.dict_col).loc[items].values
+        scores = np.asarray(R_hat[rows, cols]).ravel()
+        items, scores = reranking.rerank(items, scores, offsets)
+
+        # skip the targets whose best rating is 0
+        predicted = scores[offsets[:-1]] != 0
+        predicted_count = predicted.sum()
+        skipped_count = len(predicted) - predicted_count
+        scores_batch = reranking.to_predictions(self.target_indices, items, offsets, scores)
+        scores_batch = [s for s, p in zip(scores_batch, predicted) if p]
+        predictions_batch = [(index, recs) for index, recs, _ in scores_batch]
 
         self.scores_batch = scores_batch
         print(f'predicted percentage: {predicted_count / len(self.target_indices)}\n jumped percentage: {skipped_count/len(self.target_indices)}')
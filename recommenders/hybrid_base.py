@@ -6,7 +6,9 @@ from bayes_opt import BayesianOptimization
 import sklearn.preprocessing as sk
 import utils.check_matrix_format as cm
 import data
-from tqdm import tqdm
+import numpy as np
+import pandas as pd
+import recommenders.reranking as reranking
 
 
 class Hybrid(RecommenderBase):
@@ -87,12 +89,13 @@ class Hybrid(RecommenderBase):
         self._has_fit()
         print('computing predictions...')
         start = time.time()
-        predictions = []
-        for index, row in tqdm(self.df_handle.iterrows()):
-            impressions = list(map(int, row['impressions'].split('|')))
-            impressions_score_tuples = [[i, self.r_hat[index, self.dict_col[i]]] for i in impressions]
-            impressions_score_tuples.sort(key=lambda tup: tup[1], reverse=True)
-            predictions.append((row['session_id'], [e[0] for e in impressions_score_tuples]))
+        impressions, offsets = reranking.split_impressions(self.df_handle['impressions'].values)
+        # the index of the handle is the row of r_hat
+        rows = np.repeat(self.df_handle.index.values, np.diff(offsets))
+        cols = pd.Series(self.dict_col).loc[impressions].values
+        scores = np.asarray(self.r_hat[rows, cols]).ravel()
+        impressions, _ = reranking.rerank(impressions, scores, offsets)
+        predictions = reranking.to_predictions(self.df_handle['session_id'].values, impressions, offsets)
 
         print('predictions computed in {:.2f} s'.format(time.time() - start))
         return predictions
@@ -25,45 +25,77 @@ from skopt.space import Real, Integer, Categorical
 from utils.reduce_memory_usage_df import reduce_mem_usage
 from cython_files.mrr import mrr as mrr_cython
 from evaluate.SubEvaluator import SubEvaluator
+import utils.native_dataset as native_dataset
+from utils.feature_matrix import load_columns, save_columns
 
-_x_train = None
-_y_train = None
-_group_train = None
+# train and validation Datasets loaded in this process, by the path of the binary cache of the train (that
+# depends on the dataset, its features and the binning params)
+_datasets = {}
 
-_x_vali = None
-_y_vali = None
-_group_test = None
+# features of the validation by dataset folder, read only to predict
+_x_vali = {}
 
 
 
 class lightGBM(RecommenderBase):
 
+    def _read_x(self, name):
+        return pd.read_hdf(f'{self._BASE_PATH}/{name}.hdf', key='df').replace(to_replace=-1, value=np.nan)
+
+    def _feature_columns(self):
+        path = f'{self._BASE_PATH}/columns.json'
+        if not os.path.isfile(path):
+            save_columns(list(self._read_x('x_train').columns), path)
+        return load_columns(path)
+
     def _load_data(self):
-        global _x_train, _x_vali, _y_train, _y_vali, _group_train, _group_test, \
-                    _user_session_item_train, _user_session_item_test 
+        """
+        Load the train and the validation as lightgbm Datasets, cached in its binary format (with the bins
+        already computed) in the folder of the dataset
+        """
         _BASE_PATH = self._BASE_PATH
-        if _x_train is None:
+        columns = self._feature_columns()
+        params = native_dataset.lightgbm_binning_params(self.params_dict)
+        train_path = native_dataset.cache_path(_BASE_PATH, 'train', columns, 'bin', params)
+        if train_path not in _datasets:
             start = time()
             print('Loading data...\n')
-            _x_train = pd.read_hdf(f'{_BASE_PATH}/x_train.hdf', key='df').replace(to_replace=-1, value=np.nan)
-            _y_train = np.load(f'{_BASE_PATH}/y_train.npy')
-            _group_train = np.load(f'{_BASE_PATH}/groups_train.npy')
-            #_user_session_item_train = pd.read_csv(f'{_BASE_PATH}/user_session_item_train.csv')
-            _x_vali = pd.read_hdf(f'{_BASE_PATH}/x_vali.hdf', key='df').replace(to_replace=-1, value=np.nan)
-            _y_vali = np.load(f'{_BASE_PATH}/y_vali.npy')
-            _group_test = np.load(f'{_BASE_PATH}/groups_vali.npy')
+            train_set = native_dataset.lightgbm_dataset(
+                train_path,
+                lambda: (self._read_x('x_train'), np.load(f'{_BASE_PATH}/y_train.npy'),
+                         np.load(f'{_BASE_PATH}/groups_train.npy'), None),
+                params=params,
+                sources=[f'{_BASE_PATH}/{f}' for f in ['x_train.hdf', 'y_train.npy', 'groups_train.npy']])
+            vali_set = native_dataset.lightgbm_dataset(
+                native_dataset.cache_path(_BASE_PATH, 'vali', columns, 'bin', params),
+                lambda: (self._read_x('x_vali'), np.load(f'{_BASE_PATH}/y_vali.npy'),
+                         np.load(f'{_BASE_PATH}/groups_vali.npy'), None),
+                params=params, reference=train_set,
+                sources=[f'{_BASE_PATH}/{f}' for f in ['x_vali.hdf', 'y_vali.npy', 'groups_vali.npy']])
+            _datasets[train_path] = (train_set, vali_set)
             print(f'data loaded in: {time() - start}\n')
-            #_user_session_item_test = pd.read_csv(f'{_BASE_PATH}/user_session_item_vali.csv')
 
-        self.x_train = _x_train
-        self.y_train = _y_train
-        self.groups_train = _group_train
-        #self.user_session_item_train = _user_session_item_train
+        self.columns = columns
+        self.train_set, self.vali_set = _datasets[train_path]
+
+    def _vali_features(self):
+        if self._BASE_PATH not in _x_vali:
+            _x_vali[self._BASE_PATH] = self._read_x('x_vali')
+        return _x_vali[self._BASE_PATH]
+
+    def _train_params(self):
+        """ Params of lgb.train equivalent to the ones passed by LGBMRanker.fit """
+        params = self.model.get_params()
+        if params.get('silent') and 'verbose' not in params and 'verbosity' not in params:
+            params['verbose'] = -1
+        for p in ['silent', 'importance_type', 'n_estimators', 'class_weight']:
+            params.pop(p, None)
+        params['objective'] = params.get('objective') or 'lambdarank'
+        return params
 
-        self.x_vali = _x_vali
-        self.y_vali = _y_vali
-        self.groups_vali = _group_test
-        #self.user_session_item_test = _user_session_item_test
+    def _train(self, train_set, **train_params):
+        self.booster = lgb.train(self._train_params(), train_set, num_boost_round=self.model.n_estimators,
+                                 **train_params)
 
 
     def __init__(self, mode, cluster, dataset_name, params_dict):
@@ -71,20 +103,22 @@ class lightGBM(RecommenderBase):
         super(lightGBM, self).__init__(
             name=f'lightGBM_{dataset_name}', mode=mode, cluster=cluster)
         self._BASE_PATH = f'dataset/preprocessed/lightGBM/{self.cluster}/{self.mode}/{self.dataset_name}'
-        self._load_data()
         self.params_dict = params_dict
+        self._load_data()
         self.eval_res = {}
+        # holds the params, the model is trained by lgb.train on the cached Datasets
         self.model = lgb.LGBMRanker(**self.params_dict)
+        self.booster = None
 
     def fit(self):
         # initialize the model
-        self.model.fit(self.x_train, self.y_train, group=self.groups_train, verbose=False)
+        self._train(self.train_set)
 
     def validate(self, min_mrr_to_export=0.668, export_sub=True):
-        def _mrr(y_true, y_pred, weight, group):
-            l = memoryview(np.array(y_true, dtype=np.int32))
+        def _mrr(y_pred, dataset):
+            l = memoryview(np.array(dataset.get_label(), dtype=np.int32))
             p = memoryview(np.array(y_pred, dtype=np.float32))
-            g = memoryview(np.array(group, dtype=np.int32))
+            g = memoryview(np.array(dataset.get_group(), dtype=np.int32))
             return 'MRR', mrr_cython(l, p, g,len(g)), True
 
         def _hera_callback(param):
@@ -100,11 +134,10 @@ class lightGBM(RecommenderBase):
         eval_callback = lgb.record_evaluation(self.eval_res)
 
         # initialize the model
-        self.model.fit(self.x_train, self.y_train, group=self.groups_train, eval_set=[(self.x_vali, self.y_vali)],
-                  eval_group=[self.groups_vali], eval_metric=_mrr, eval_names=['validation_set'],
-                  early_stopping_rounds=200, verbose=1, callbacks=[eval_callback])
+        self._train(self.train_set, valid_sets=[self.vali_set], valid_names=['validation_set'], feval=_mrr,
+                    early_stopping_rounds=200, verbose_eval=1, callbacks=[eval_callback])
 
-        mrr = self.eval_res['validation_set']['MRR'][self.model.booster_.best_iteration - 1]
+        mrr = self.eval_res['validation_set']['MRR'][self.booster.best_iteration - 1]
 
         if mrr > min_mrr_to_export:
             # set the path where to save
@@ -119,10 +152,10 @@ class lightGBM(RecommenderBase):
 
             # save the features of the model
             with open(f"{base_path}/used_features.txt", "w+") as text_file:
-                text_file.write(str(self.x_train.columns))
+                text_file.write(str(self.columns))
 
             # save the model
-            self.model.booster_.save_model(f'{base_path}/{self.name}')
+            self.booster.save_model(f'{base_path}/{self.name}')
 
             # save the feature importance of the moodel
             self.plot_features_importance(path=f'{base_path}/feature_importance.png', save=True)
@@ -137,7 +170,7 @@ class lightGBM(RecommenderBase):
         return mrr
 
     def plot_features_importance(self, path, save=False):
-        plot = lgb.plot_importance(self.model.booster_)
+        plot = lgb.plot_importance(self.booster)
         plt.subplot(plot)
         plt.show()
         if save:
@@ -151,7 +184,7 @@ class lightGBM(RecommenderBase):
         full_impressions = data.full_df()
 
         print('retriving predictions')
-        scores = self.model.predict(self.x_vali)
+        scores = self.booster.predict(self._vali_features())
         final_predictions = []
         count = 0
         for index in tqdm(target_indices):
@@ -173,7 +206,7 @@ class lightGBM(RecommenderBase):
         full_impressions = data.full_df()
 
         print('retriving predictions')
-        scores = self.model.predict(self.x_vali)
+        scores = self.booster.predict(self._vali_features())
         final_predictions = []
         count = 0
         for index in tqdm(target_indices):
@@ -235,7 +268,7 @@ class lightGBM(RecommenderBase):
             }
             lgb=lightGBM(mode=mode, cluster=cluster, dataset_name=dataset_name, params_dict=params_dict)
             mrr = lgb.validate()
-            best_it = lgb.model._Booster.best_iteration
+            best_it = lgb.booster.best_iteration
             Hera.send_message(f'MRR: {mrr}\n'
                               f'params:\n'
                               f'num_iteration:{best_it}, learning_rate:{learning_rate}, num_leaves:{num_leaves}, '
@@ -244,10 +277,15 @@ class lightGBM(RecommenderBase):
         return space, get_mrr
 
     def fit_cv(self, x, y, groups, train_indices, test_indices, **fit_params):
-        X_train = x.reset_index(drop=True).loc[train_indices]
-        y_train = y[train_indices]
-        _, group = np.unique(groups[train_indices], return_counts=True)
-        self.model.fit(X_train, y_train, group=group)
+        def load():
+            _, group = np.unique(groups[train_indices], return_counts=True)
+            return x.reset_index(drop=True).loc[train_indices], y[train_indices], group, None
+
+        params = native_dataset.lightgbm_binning_params(self.params_dict)
+        name = 'train_rows_{}'.format(native_dataset.rows_hash(train_indices))
+        path = native_dataset.cache_path(self._BASE_PATH, name, self.columns, 'bin', params)
+        self._train(native_dataset.lightgbm_dataset(path, load, params=params,
+                                                    sources=[f'{self._BASE_PATH}/x_train.hdf']))
 
     def get_scores_cv(self, x, groups, test_indices):
         # check if x is the dataset for train or test
@@ -257,7 +295,7 @@ class lightGBM(RecommenderBase):
             user_session_item = self.user_session_item_train
         # filter by index
         X_test = x.reset_index(drop=True).loc[test_indices]
-        preds = list(self.model.predict(X_test))
+        preds = list(self.booster.predict(X_test))
         # add scores to dataset
         user_session_item = user_session_item.reset_index(drop=True).loc[test_indices]
         user_session_item['score_lightgbm'] = preds
@@ -2,8 +2,10 @@ from abc import abstractmethod
 from abc import ABC
 import data
 import numpy as np
-from tqdm import tqdm
 import out
+import recommenders.reranking as reranking
+import utils.evaluation as evaluation
+import preprocess_utils.impression_table as impression_table
 import utils.telegram_bot as HERA
 from utils.check_folder import check_folder
 import time
@@ -48,6 +50,42 @@ class RecommenderBase(ABC):
         """
         pass
 
+    def impressions_batch(self, target_indices):
+        """
+        Return the impressions of the target indices as a flat int array, and the offsets of each target
+        (the impressions of the i-th target are in [offsets[i], offsets[i+1]))
+        """
+        table = impression_table.load(self.mode, self.cluster)
+        _, _, items, _ = table.expand(target_indices)
+        return items.astype(np.int64), reranking.offsets_from_lengths(table.lengths(target_indices))
+
+    def rerank_batch(self, target_indices, scores, with_scores=False):
+        """
+        Rerank the impressions of the target indices by descending score.
+        scores: flat vector aligned with the impressions of the targets (in the target indices order), or
+            padded matrix (targets, max impressions)
+        with_scores (bool): if True return the triples (index, impressions, scores) like get_scores_batch,
+            otherwise the couples (index, impressions) like recommend_batch
+        """
+        items, offsets = self.impressions_batch(target_indices)
+        scores = np.asarray(scores)
+        if scores.ndim == 2:
+            scores = reranking.flatten_padded(scores, offsets)
+        items, scores = reranking.rerank(items, scores, offsets)
+        return reranking.to_predictions(target_indices, items, offsets, scores if with_scores else None)
+
+    def recommend_clickout(self, index, events=None):
+        """
+        Return the reranked impressions of a single target clickout, used when replaying the events one by one.
+        events: the events of the session up to the clickout, in the train.csv schema
+        The default implementation looks up the results of recommend_batch, computed at the first call, so the
+        replay measures only a lookup (the lookup baseline of serving/replay.py): override it in the models
+        able to score a clickout on its own. The rankers are replayed through the RankingService instead.
+        """
+        if getattr(self, '_clickout_recommendations', None) is None:
+            self._clickout_recommendations = {p[0]: p[1] for p in self.recommend_batch()}
+        return self._clickout_recommendations[index]
+
     def set_weight_per_position(self, list_weight):
         """
         Set list values for weight_per_position parameter of recommenders.
@@ -131,21 +169,11 @@ class RecommenderBase(ABC):
         else:
             train_df = data.train_df('full')
 
-        target_indices, recs = zip(*predictions)
-        target_indices = list(target_indices)
+        target_indices = [p[0] for p in predictions]
         correct_clickouts = train_df.loc[target_indices].reference.values
-        len_rec = len(recs)
-        
-        RR = 0
+
         print("Calculating MRR (hoping for a 0.99)")
-        for i in tqdm(range(len_rec)):
-            correct_clickout = int(correct_clickouts[i])
-            if correct_clickout in predictions[i][1]:
-                rank_pos = recs[i].index(correct_clickout) + 1
-                if rank_pos <= 25:
-                    RR += 1 / rank_pos
-        
-        MRR = RR / len_rec
+        MRR = evaluation.mrr(evaluation.predictions_reciprocal_ranks(predictions, correct_clickouts))
         print(f'MRR: {MRR}')
 
         return MRR
@@ -56,20 +56,8 @@ class RNNClassificationRecommender(RecurrentRecommender):
 
         assert len(predictions) == len(target_indices)
 
-        full_df = data.full_df()
-
-        result_predictions = []
-        for index in tqdm(target_indices):
-            # get the impressions of the clickout to predict
-            impr = list(map(int, full_df.loc[index]['impressions'].split('|')))
-            # build a list of (impression, score)
-            prediction_impressions_distances = [ (impr[j], predictions.at[index,j]) for j in range(len(impr)) ]
-            # order the list based on scores (greater is better)
-            prediction_impressions_distances.sort(key=lambda tup: tup[1], reverse=True)
-            # get only the impressions ids
-            ordered_impressions = list(map(lambda x: x[0], prediction_impressions_distances))
-            # append the couple (index, reranked impressions)
-            result_predictions.append( (index, ordered_impressions) )
+        # rerank the impressions of each clickout by the predicted scores (greater is better)
+        result_predictions = self.rerank_batch(target_indices, predictions.values)
 
         print('prediction created !!!')
 
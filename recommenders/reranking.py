@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+"""
+Batched reranking of the impressions, shared by the recommenders.
+
+The impressions of a batch of clickouts are kept flat, in a single array, together with the offsets of
+each clickout: the impressions of the i-th clickout are in [offsets[i], offsets[i+1]). The scores are
+either a flat vector aligned with the impressions or a padded matrix (clickouts, max impressions).
+"""
+
+
+def offsets_from_lengths(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    return offsets
+
+
+def split_impressions(impressions, sep='|'):
+    """
+    Return the flat int array of an array of impressions strings separated by sep, and the offsets.
+    Missing values (NaN) give empty segments.
+    """
+    impressions = np.asarray(impressions, dtype=object)
+    present = pd.notnull(impressions)
+    lengths = np.zeros(len(impressions), dtype=np.int64)
+    lengths[present] = [s.count(sep) + 1 for s in impressions[present]]
+    items = np.fromstring(' '.join(impressions[present]).replace(sep, ' '), dtype=np.int64, sep=' ')
+    return items, offsets_from_lengths(lengths)
+
+
+def flatten_padded(scores_matrix, offsets):
+    """ Return the flat scores from a padded matrix, keeping for each row only the real impressions """
+    lengths = np.diff(offsets)
+    scores_matrix = np.asarray(scores_matrix)
+    mask = np.arange(scores_matrix.shape[1]) < lengths[:, None]
+    return scores_matrix[mask]
+
+
+def segmented_argsort(scores, offsets):
+    """
+    Return the permutation that sorts each segment of the scores by descending score.
+    The sort is stable: impressions with the same score keep their original order.
+    """
+    group = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    return np.lexsort((-np.asarray(scores), group))
+
+
+def rerank(items, scores, offsets):
+    """ Return the items and the scores sorted by descending score inside each segment """
+    order = segmented_argsort(scores, offsets)
+    return np.asarray(items)[order], np.asarray(scores)[order]
+
+
+def to_predictions(keys, items, offsets, scores=None):
+    """
+    Return the reranked arrays in the format used by the recommenders:
+    [(key_0, [acc_1, acc2, ...]), ...] or, if scores is specified, [(key_0, [acc_1, ...], [sco_1, ...]), ...]
+    """
+    items = np.split(np.asarray(items), offsets[1:-1])
+    if scores is None:
+        return [(k, i.tolist()) for k, i in zip(keys, items)]
+    scores = np.split(np.asarray(scores), offsets[1:-1])
+    return [(k, i.tolist(), s.tolist()) for k, i, s in zip(keys, items, scores)]
+
+
+def from_predictions(predictions):
+    """ Inverse of to_predictions: return the keys, the flat items and the offsets """
+    keys = [p[0] for p in predictions]
+    lengths = np.array([len(p[1]) for p in predictions], dtype=np.int64)
+    items = np.fromiter((i for p in predictions for i in p[1]), dtype=np.int64, count=lengths.sum())
+    return keys, items, offsets_from_lengths(lengths)
+
+
+def join_segments(items, offsets, sep=' '):
+    """ Return for each segment the string of its items separated by sep """
+    tokens = np.asarray(items).astype(str).astype(object)
+    if len(tokens) == 0:
+        return [''] * (len(offsets) - 1)
+    # join everything once, marking the end of each segment with a newline
+    separators = np.full(len(tokens), sep, dtype=object)
+    separators[offsets[1:][np.diff(offsets) > 0] - 1] = '\n'
+    text = np.empty(len(tokens) * 2, dtype=object)
+    text[0::2] = tokens
+    text[1::2] = separators
+    rows = iter(''.join(text).split('\n'))
+    # empty segments have no items, so they have no newline either
+    return [next(rows) if l > 0 else '' for l in np.diff(offsets)]
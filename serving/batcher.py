@@ -0,0 +1,139 @@
+import time
+import queue
+import threading
+from collections import deque
+import numpy as np
+
+"""
+Micro-batching of the requests of the ranking server.
+
+The request threads submit their payloads to a queue and wait. A single worker thread takes the first
+waiting payload, keeps collecting until max_batch_size payloads or max_wait_ms have passed, and processes
+all of them with a single call, so that the model is always called on a batch of clickouts.
+"""
+
+
+class LatencyRecorder(object):
+    """ Keeps the last latencies and returns their percentiles """
+
+    def __init__(self, history=10000):
+        self._latencies = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self.count += 1
+
+    def percentiles(self, q=(50, 90, 99)):
+        """ Return a dict p<q> -> latency in ms of the recorded latencies, plus the mean and the max """
+        with self._lock:
+            lat = np.array(self._latencies, dtype=np.float64) * 1000
+        if len(lat) == 0:
+            return {}
+        res = {'p{}'.format(p): v for p, v in zip(q, np.percentile(lat, q))}
+        res['mean'] = lat.mean()
+        res['max'] = lat.max()
+        return res
+
+
+class _Pending(object):
+    __slots__ = ['payload', 'start', 'done', 'result', 'error']
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher(object):
+
+    def __init__(self, process_batch, max_batch_size=64, max_wait_ms=5, history=10000):
+        """
+        process_batch: function called with a list of payloads, returns the list of the results (same order)
+        max_batch_size (int): max number of payloads processed at once
+        max_wait_ms (float): max time waited for other payloads after the first one of a batch
+        history (int): number of latencies kept to compute the percentiles
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.latency = LatencyRecorder(history)
+        self.batch_latency = LatencyRecorder(history)
+        self.batch_sizes = deque(maxlen=history)
+        self.errors = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, payload):
+        """ Wait the processing of the payload and return its result (raise the error of its batch, if any) """
+        pending = _Pending(payload)
+        self._queue.put(pending)
+        pending.done.wait()
+        self.latency.add(time.perf_counter() - pending.start)
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        """ Return the next batch of pending payloads, or an empty list if nothing arrived in a while """
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect()
+            if len(batch) == 0:
+                continue
+            start = time.perf_counter()
+            try:
+                results = self.process_batch([p.payload for p in batch])
+                for p, r in zip(batch, results):
+                    p.result = r
+            except Exception as e:
+                self.errors += 1
+                for p in batch:
+                    p.error = e
+            self.batch_latency.add(time.perf_counter() - start)
+            self.batch_sizes.append(len(batch))
+            for p in batch:
+                p.done.set()
+
+    def stats(self):
+        sizes = np.array(self.batch_sizes)
+        return {
+            'requests': self.latency.count,
+            'batches': self.batch_latency.count,
+            'errors': self.errors,
+            'queued': self._queue.qsize(),
+            'mean_batch_size': sizes.mean() if len(sizes) > 0 else 0.0,
+            'latency_ms': self.latency.percentiles(),
+            'batch_latency_ms': self.batch_latency.percentiles(),
+        }
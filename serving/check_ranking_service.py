@@ -0,0 +1,58 @@
+import numpy as np
+import data
+from serving.rankers import load_ranker
+from serving.server import RankingService, StoreFeatures, dataset_features, dataset_path, parse_events
+
+"""
+Compare the reranking of the RankingService of a trained xgboost ranker with the one of
+XGBoostWrapper.recommend_batch on some target clickouts of a local split: the features are taken from the
+feature store (the online session features are compared with the batch ones by check_session_state.py), so the
+recommendations must be the same and the scores equal to the ones of the model on the rows of X_test.
+"""
+
+
+def check(mode='local', cluster='no_cluster', kind='kind1', model_path='models/final_stacking.model',
+          n_clickouts=100, seed=0):
+    """ Raise a ValueError if the service reranks differently from recommend_batch, return the clickouts compared """
+    from recommenders.XGBoost import XGBoostWrapper
+
+    model = XGBoostWrapper(mode=mode, cluster=cluster, kind=kind, ask_to_load=False)
+    model.xg.load_model(model_path)
+    offline = model.recommend_batch()
+    target_indices = data.target_indices(mode, cluster)
+    X_test = data.dataset_xgboost_test(mode=mode, cluster=cluster, kind=kind)[0]
+    # the rows of X_test of the i-th target are in [offsets[i], offsets[i+1])
+    _, offsets = model.impressions_batch(target_indices)
+
+    ranker = load_ranker('xgboost', model_path)
+    features_array, columns = dataset_features(dataset_path('xgboost', mode, cluster, kind))
+    service = RankingService(ranker, StoreFeatures(mode, cluster, features_array, columns, ranker.categories))
+
+    n_clickouts = min(n_clickouts, len(target_indices))
+    positions = np.sort(np.random.RandomState(seed).choice(len(target_indices), n_clickouts, replace=False))
+    full = data.full_df()
+    clickouts = [parse_events([full.loc[target_indices[i]].to_dict()]) for i in positions]
+    served = service.score_batch(clickouts)
+
+    errors = []
+    for i, res in zip(positions, served):
+        index, recommendations = offline[i][0], list(offline[i][1])
+        scores = model.xg.predict(X_test[offsets[i]:offsets[i + 1]])
+        if list(res['recommendations']) != recommendations:
+            errors.append('{}: service {} recommend_batch {}'.format(index, res['recommendations'], recommendations))
+        elif not np.array_equal(np.sort(res['scores']), np.sort(scores.astype(np.float64))):
+            errors.append('{}: service scores {} model scores {}'.format(index, res['scores'], scores))
+    print('{} different clickouts on {}'.format(len(errors), len(positions)), flush=True)
+    if len(errors) > 0:
+        raise ValueError('the ranking service differs from recommend_batch:\n' + '\n'.join(errors))
+    print('the ranking service matches recommend_batch', flush=True)
+    return len(positions)
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    mode = mode_selection()
+    cluster = cluster_selection()
+    kind = input('kind of the xgboost dataset: ')
+    model_path = input('path of the saved model: ')
+    check(mode, cluster, kind, model_path)
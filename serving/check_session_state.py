@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import data
+from preprocess_utils.last_clickout_indices import find_split
+from serving.session_state import replay_split
+
+"""
+Compare the features emitted by the session state engine for the last clickouts of a split with the ones
+of the batch extractors: the values must be the same (the floats up to the rounding of the running mean
+and std), except for the columns of TimingFromLastInteractionImpression and TimesUserInteractedWithImpression
+in the sessions that the batch loop counts interactions of other sessions in (see carried_over_sessions).
+"""
+
+# columns of the batch extractors that carry the interactions over to the next session of the df
+CARRIED_OVER_COLUMNS = ['step_from_last_interaction', 'timestamp_from_last_interaction', 'num_interactions_impr']
+
+
+def carried_over_sessions(df, last_clickouts):
+    """
+    Return the index (user_id, session_id) of the sessions of the last clickouts preceded in the df by
+    interactions with a numeric reference after the previous last clickout: the batch loop is reset only at
+    the last clickouts, so it counts them in the session
+    """
+    numeric = np.sort(df.index.values[df.reference.fillna('0').astype(str).str.isnumeric().values])
+    last_clickouts = np.sort(last_clickouts)
+    first = df.index.to_series().groupby([df.user_id.values, df.session_id.values]).min()
+    keys = pd.MultiIndex.from_arrays([df.loc[last_clickouts, 'user_id'].values,
+                                      df.loc[last_clickouts, 'session_id'].values])
+    starts = first.reindex(keys).values
+    previous = np.concatenate([[-1], last_clickouts[:-1]])
+    carried = np.searchsorted(numeric, starts, side='left') > np.searchsorted(numeric, previous, side='right')
+    return keys[carried]
+
+
+def _equal(a, b):
+    if b.dtype == object:
+        return a.astype(str).values == b.astype(str).values
+    if b.dtype.kind == 'f' or a.dtype.kind == 'f':
+        return np.isclose(a.astype(float).values, b.astype(float).values, rtol=1e-6, atol=1e-6)
+    return a.values == b.values
+
+
+def check(mode='small', cluster='no_cluster'):
+    """ Raise a ValueError if the features differ (see the module docstring), return the rows compared by column """
+    from extract_features.timing_from_last_interaction_impression import TimingFromLastInteractionImpression
+    from extract_features.times_user_interacted_with_impression import TimesUserInteractedWithImpression
+    from extract_features.last_action_involving_impression import LastActionInvolvingImpression
+    from extract_features.actions_involving_impression_session import ActionsInvolvingImpressionSession
+    from extract_features.frenzy_factor_consecutive_steps import FrenzyFactorSession
+    from extract_features.mean_price_clickout import MeanPriceClickout
+
+    df = pd.concat([data.train_df(mode, cluster), data.test_df(mode, cluster)])
+    carried = carried_over_sessions(df, find_split(mode, cluster))
+    print('{} sessions with interactions carried over by the batch loop'.format(len(carried)), flush=True)
+
+    online = replay_split(mode, cluster)
+    keys = ['user_id', 'session_id', 'item_id']
+    online = online.drop_duplicates(keys)
+    res = {}
+    errors = []
+    for f in [TimingFromLastInteractionImpression, TimesUserInteractedWithImpression, LastActionInvolvingImpression,
+              ActionsInvolvingImpressionSession, FrenzyFactorSession, MeanPriceClickout]:
+        batch = f(mode=mode, cluster=cluster).read_feature()
+        on = [k for k in keys if k in batch.columns]
+        batch = batch.drop_duplicates(on)
+        if 'item_id' in on:
+            batch['item_id'] = batch['item_id'].astype(int)
+        merged = online.merge(batch, on=on, how='inner', suffixes=('_online', ''))
+        if len(merged) != len(online):
+            errors.append('{}: {} rows of the engine missing from the feature'.format(f.__name__,
+                                                                                      len(online) - len(merged)))
+        is_carried = pd.MultiIndex.from_arrays([merged.user_id.values, merged.session_id.values]).isin(carried)
+        for c in [c for c in batch.columns if c not in on and c in online.columns]:
+            rows = ~is_carried if c in CARRIED_OVER_COLUMNS else np.ones(len(merged), dtype=bool)
+            equal = _equal(merged['{}_online'.format(c)][rows], merged[c][rows])
+            res[c] = int(rows.sum())
+            print('{}: {} different values on {} rows'.format(c, int((~equal).sum()), res[c]), flush=True)
+            if not equal.all():
+                errors.append('{}: {} different values'.format(c, int((~equal).sum())))
+    if len(errors) > 0:
+        raise ValueError('the features of the engine differ from the batch ones:\n' + '\n'.join(errors))
+    print('the features of the engine match the batch extractors', flush=True)
+    return pd.Series(res)
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    mode = mode_selection()
+    cluster = cluster_selection()
+    check(mode, cluster)
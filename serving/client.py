@@ -0,0 +1,110 @@
+import json
+import math
+import socket
+import http.client
+import numpy as np
+
+"""
+Client of the ranking server (see serving/server.py).
+The address is either 'host:port' for the HTTP server or the path of its Unix socket.
+"""
+
+
+def parse_address(address):
+    """ Return ('unix', path) if the address is the path of a Unix socket, else ('tcp', (host, port)) """
+    if '/' in address or address.endswith('.sock'):
+        return 'unix', address
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or 'localhost', int(port))
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super(_UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def _json_value(v):
+    """ NaN are not valid json: send them as null """
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and math.isnan(v):
+        return None
+    return v
+
+
+class _TCPHTTPConnection(http.client.HTTPConnection):
+
+    def connect(self):
+        super(_TCPHTTPConnection, self).connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class RankingClient(object):
+    """ Keep-alive connection to the ranking server. Not thread safe: use one client for each thread. """
+
+    def __init__(self, address, timeout=30):
+        self.kind, self.address = parse_address(address)
+        self.timeout = timeout
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            if self.kind == 'unix':
+                self._conn = _UnixHTTPConnection(self.address, timeout=self.timeout)
+            else:
+                self._conn = _TCPHTTPConnection(*self.address, timeout=self.timeout)
+        return self._conn
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            res = json.loads(response.read().decode('utf-8'))
+        except (http.client.HTTPException, ConnectionError):
+            # the server closed the keep-alive connection: retry once on a new one
+            self.close()
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            res = json.loads(response.read().decode('utf-8'))
+        if response.status != 200:
+            raise ValueError('{} {}: {}'.format(response.status, path, res.get('error')))
+        return res
+
+    def recommend(self, events):
+        """
+        Return the reranked impressions of the last clickout of a session.
+        events: list of dicts in the train.csv schema, the last one is the clickout to rerank
+        Return a dict with user_id, session_id, timestamp, step, recommendations and scores
+        """
+        events = [{k: _json_value(v) for k, v in e.items()} for e in events]
+        return self._request('POST', '/recommend', {'events': events})
+
+    def stats(self):
+        """ Return the counters and the latency percentiles (in ms) of the server """
+        return self._request('GET', '/stats')
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+if __name__ == '__main__':
+    address = input('server address (host:port or unix socket path): ')
+    client = RankingClient(address)
+    print(json.dumps(client.stats(), indent=2))
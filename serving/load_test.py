@@ -0,0 +1,85 @@
+import time
+import threading
+import numpy as np
+import data
+from serving.client import RankingClient
+from serving.server import EVENT_COLUMNS
+
+"""
+Load test of the ranking server: replays the target clickouts of a split as requests, each one with the
+events of its session up to the clickout, from several concurrent clients. Report the throughput, the
+latency percentiles seen by the clients and the stats of the server.
+"""
+
+
+def session_payloads(mode, cluster='no_cluster', max_requests=None):
+    """ Return for each target clickout of the split the list of the events of its session up to it """
+    test = data.test_df(mode, cluster)
+    targets = data.target_indices(mode, cluster)
+    if max_requests is not None:
+        targets = targets[:max_requests]
+
+    # the sessions are contiguous: the events of a target go from the start of its session to it
+    sessions = test.session_id.values
+    starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+    ends = test.index.get_indexer(targets)
+    if (ends < 0).any():
+        raise ValueError('target indices missing from the test df')
+    starts = starts[np.searchsorted(starts, ends, side='right') - 1]
+
+    columns = [c for c in EVENT_COLUMNS if c in test.columns]
+    events = test[columns].astype(object).where(test[columns].notnull(), None)
+    records = events.to_dict('records')
+    res = []
+    for s, e in zip(starts, ends):
+        payload = records[s:e + 1]
+        # the reference of the clickout to predict is unknown
+        payload[-1] = dict(payload[-1], reference=None)
+        res.append(payload)
+    return res
+
+
+def load_test(address, payloads, concurrency=8):
+    """ Send the payloads from concurrency threads, each one with its own client """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def worker(i):
+        client = RankingClient(address)
+        for payload in payloads[i::concurrency]:
+            start = time.perf_counter()
+            try:
+                client.recommend(payload)
+            except ValueError:
+                errors[i] += 1
+            latencies[i].append(time.perf_counter() - start)
+        client.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = np.concatenate([np.array(l) for l in latencies]) * 1000
+    print('{} requests in {:.2f}s from {} clients: {:.1f} requests/s, {} errors'.format(
+        len(lat), elapsed, concurrency, len(lat) / elapsed, sum(errors)))
+    print('client latency (ms): p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}'.format(
+        *np.percentile(lat, [50, 90, 99]), lat.max()))
+    stats = RankingClient(address).stats()
+    print('server: {} batches, mean batch size {:.1f}, latency p50 {:.2f} p99 {:.2f} ms, missing feature rows {}'.format(
+        stats['batches'], stats['mean_batch_size'], stats['latency_ms'].get('p50', 0),
+        stats['latency_ms'].get('p99', 0), stats['features']['missing_rows']))
+    return lat, stats
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection
+    address = input('server address (host:port or unix socket path): ')
+    mode = mode_selection()
+    cluster = cluster_selection()
+    max_requests = int(input('number of requests: '))
+    concurrency = int(input('concurrent clients: '))
+    load_test(address, session_payloads(mode, cluster, max_requests), concurrency)
@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse as sps
+
+"""
+Loaders of the trained rankers for the ranking server. Each loader returns a Ranker wrapping the native
+model saved by the recommenders:
+    xgboost: the model saved by XGBoostWrapper.fit (models/<name>.model)
+    lightgbm: the booster saved by lightGBM.validate (<base_path>/<name>)
+The libraries are imported only when their model is loaded.
+The xgboost rankers are trained on the CSR matrices of utils/feature_matrix, that do not store the zeros: xgboost
+reads them as missing, so the features are passed as a CSR matrix to predict too (a dense 0 would be a value).
+The catboost rankers are not served: they are trained with cat_features on dataframes of strings, while the
+server builds float32 matrices.
+"""
+
+
+class Ranker(object):
+
+    def __init__(self, kind, predict, feature_names=None, categories=None):
+        """
+        predict: function that returns the scores of a float32 feature matrix (impressions, features)
+        feature_names: names of the features in the order expected by the model, None if unknown
+        categories: categories of the categorical features, in the order of the features, as saved by lightgbm
+            for the pandas categoricals (their values are passed as the index of the category)
+        """
+        self.kind = kind
+        self._predict = predict
+        self.feature_names = feature_names
+        self.categories = categories or []
+
+    def predict(self, X):
+        return np.asarray(self._predict(X), dtype=np.float64).ravel()
+
+
+def _load_xgboost(path):
+    import xgboost as xgb
+    booster = xgb.Booster(model_file=path)
+    return Ranker('xgboost', lambda X: booster.predict(xgb.DMatrix(sps.csr_matrix(X), missing=np.nan)),
+                  booster.feature_names)
+
+
+def _load_lightgbm(path):
+    import lightgbm as lgb
+    booster = lgb.Booster(model_file=path)
+    return Ranker('lightgbm', booster.predict, booster.feature_name(), booster.pandas_categorical)
+
+
+LOADERS = {
+    'xgboost': _load_xgboost,
+    'lightgbm': _load_lightgbm,
+}
+
+
+def load_ranker(kind, path):
+    if kind not in LOADERS:
+        raise ValueError('Unknown ranker {}, available: {}'.format(kind, list(LOADERS)))
+    return LOADERS[kind](path)
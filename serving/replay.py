@@ -0,0 +1,154 @@
+import time
+from collections import OrderedDict
+import numpy as np
+import psutil
+import data
+import utils.evaluation as evaluation
+from serving.session_state import SessionStateEngine
+from serving.server import EVENT_COLUMNS, create_service, parse_events
+
+"""
+Replay benchmark of the online path: streams the test df of a split in timestamp order, one event at a
+time, through the session state engine (see serving/session_state.py) and a target, which is asked for
+the recommendations of each target clickout as soon as it arrives.
+
+The default target is the RankingService of the server (see serving/server.py): the features of each
+clickout are computed from the events seen so far by the same engine, then scored by the ranker.
+The lookup baseline reads the results of recommend_batch of a recommender, computed before the replay:
+its latency is the cost of the loop and of a dict lookup only.
+Report the events per second, the latency percentiles of the clickouts, the memory growth and, on the
+local and small splits, the MRR.
+"""
+
+
+def stream_events(mode, cluster='no_cluster'):
+    """ Return the index and the events of the test df, sorted by timestamp (stable, so the steps keep their order) """
+    test = data.test_df(mode, cluster)
+    columns = [c for c in EVENT_COLUMNS + ['frequence'] if c in test.columns]
+    test = test[columns].sort_values('timestamp', kind='mergesort')
+    events = test.astype(object).where(test.notnull(), None).to_dict('records')
+    return test.index.values, events
+
+
+def recommender_target(recommender):
+    """
+    Lookup baseline: ask the recommendations of a clickout to a RecommenderBase (see
+    RecommenderBase.recommend_clickout), that by default looks up the results of recommend_batch
+    """
+    return lambda index, events: recommender.recommend_clickout(index, events)
+
+
+def service_target(service):
+    """
+    Score a clickout with a RankingService of serving/server.py, without the wait of the micro-batching.
+    Pass the engine of its OnlineFeatures to replay, so the events are applied once.
+    """
+    return lambda index, events: service.score_batch([parse_events(events)])[0]['recommendations']
+
+
+def _rss():
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def replay(target, mode='local', cluster='no_cluster', max_events=None, memory_every=10000, max_sessions=100000,
+           engine=None, label='ranking service'):
+    """
+    target: function (index, events of the session so far) -> reranked impressions of the clickout
+    max_events (int): stop after this number of events
+    memory_every (int): number of events between two samples of the memory
+    max_sessions (int): number of sessions kept in memory, the least recently active are dropped first
+    engine: SessionStateEngine the events are applied to (the one of the target, if it has one)
+    label (str): name of the target in the report
+    Return the report (dict) and the predictions [(index, [acc_1, acc_2, ...]), ...]
+    """
+    indices, events = stream_events(mode, cluster)
+    if max_events is not None:
+        indices, events = indices[:max_events], events[:max_events]
+    targets = set(data.target_indices(mode, cluster))
+
+    engine = engine or SessionStateEngine(max_sessions=max_sessions)
+    sessions = OrderedDict()
+    latencies = []
+    predictions = []
+    memory = [(0, _rss())]
+
+    start = time.perf_counter()
+    for n, (index, event) in enumerate(zip(indices, events), 1):
+        t = time.perf_counter()
+        key = (event['user_id'], event['session_id'])
+        session_events = sessions.pop(key, [])
+        session_events.append(event)
+        sessions[key] = session_events
+        if len(sessions) > max_sessions:
+            sessions.popitem(last=False)
+
+        if index in targets:
+            # the reference of the clickout to predict is not known yet
+            event['reference'] = None
+            # the features of the clickout are computed from the events before it
+            predictions.append((index, list(target(index, session_events))))
+            latencies.append(time.perf_counter() - t)
+        engine.update(event)
+        if n % memory_every == 0:
+            memory.append((n, _rss()))
+    elapsed = time.perf_counter() - start
+    memory.append((len(events), _rss()))
+
+    lat = np.array(latencies) * 1000
+    report = {
+        'target': label,
+        'events': len(events),
+        'clickouts': len(predictions),
+        'seconds': elapsed,
+        'events_per_second': len(events) / elapsed if elapsed > 0 else 0.0,
+        'memory_mb': memory,
+        'memory_growth_mb': memory[-1][1] - memory[0][1],
+    }
+    if len(lat) > 0:
+        report.update({'p{}_ms'.format(p): v for p, v in zip([50, 95, 99], np.percentile(lat, [50, 95, 99]))})
+        report['max_ms'] = lat.max()
+    if mode != 'full' and len(predictions) > 0:
+        references = data.train_df('full').loc[[p[0] for p in predictions]].reference.values
+        report['mrr'] = evaluation.mrr(evaluation.predictions_reciprocal_ranks(predictions, references))
+    _print_report(report)
+    return report, predictions
+
+
+def _print_report(report):
+    print('[{}]'.format(report['target']))
+    print('{} events in {:.2f}s: {:.0f} events/s'.format(report['events'], report['seconds'],
+                                                      report['events_per_second']))
+    if 'p50_ms' in report:
+        print('{} clickouts, latency (ms): p50 {:.3f}  p95 {:.3f}  p99 {:.3f}  max {:.3f}'.format(
+            report['clickouts'], report['p50_ms'], report['p95_ms'], report['p99_ms'], report['max_ms']))
+    print('memory: {:.1f} MB -> {:.1f} MB (growth {:.1f} MB)'.format(
+        report['memory_mb'][0][1], report['memory_mb'][-1][1], report['memory_growth_mb']))
+    if 'mrr' in report:
+        print('MRR: {}'.format(report['mrr']))
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection, single_choice
+
+    mode = mode_selection()
+    target = single_choice('which target?', ['ranking service', 'lookup baseline'])
+    if target == 'ranking service':
+        cluster = cluster_selection()
+        engine = SessionStateEngine(max_sessions=100000)
+        ranker_kind = single_choice('which ranker?', ['xgboost', 'lightgbm'])
+        service = create_service(mode, cluster, ranker_kind, input('path of the saved model: '),
+                                 input('kind (xgboost) or name (lightgbm) of the dataset of the ranker: '),
+                                 engine=engine)
+        replay(service_target(service), mode, cluster, engine=engine)
+    else:
+        recommender = single_choice('which recommender?', ['last interactions', 'xgboost'])
+        if recommender == 'xgboost':
+            from recommenders.XGBoost import XGBoostWrapper
+            model = XGBoostWrapper(mode=mode, kind=input('pick the kind: '))
+        else:
+            from recommenders.only_test_based.last_interactions_based import LatestInteractionsRecommender
+            model = LatestInteractionsRecommender(mode=mode)
+        model.fit()
+        # the batch recommendations are computed before measuring
+        model.recommend_clickout(data.target_indices(mode)[0])
+        replay(recommender_target(model), mode, label='lookup baseline ({})'.format(recommender))
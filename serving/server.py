@@ -0,0 +1,311 @@
+import os
+import json
+from collections import OrderedDict
+from os.path import join
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import recommenders.reranking as reranking
+from extract_features.feature_store import FeatureStore, load_features_array
+from serving.batcher import MicroBatcher
+from serving.client import parse_address
+from serving.rankers import load_ranker
+from serving.session_state import OnlineFeatures
+from utils.feature_matrix import load_columns
+
+"""
+Long-running ranking server: loads a trained ranker and the features of a split once, then answers
+with the reranked impressions of the last clickout of the sessions it receives.
+
+POST /recommend  {"events": [{...}, ...]}  events of a session in the train.csv schema, the last one is
+                                           the clickout to rerank (its reference is ignored)
+GET  /stats                                counters and latency percentiles
+GET  /health
+
+The requests are micro-batched (see serving/batcher.py), so the features and the model are computed on
+all the clickouts of a batch at once.
+"""
+
+EVENT_COLUMNS = ['user_id', 'session_id', 'timestamp', 'step', 'action_type', 'reference', 'platform', 'city',
+                 'device', 'current_filters', 'impressions', 'prices']
+
+
+def parse_events(events):
+    """
+    Validate the events of a session and return the clickout to rerank: a dict with user_id, session_id,
+    timestamp, step, the impressions as int array (items) and the events
+    """
+    if not isinstance(events, list) or len(events) == 0:
+        raise ValueError('events must be a non-empty list')
+    last = events[-1]
+    if not isinstance(last, dict) or last.get('action_type') != 'clickout item':
+        raise ValueError('the last event must be a clickout item')
+    if not last.get('impressions'):
+        raise ValueError('the last clickout has no impressions')
+    try:
+        items = np.array(str(last['impressions']).split('|'), dtype=np.int64)
+    except ValueError:
+        raise ValueError('impressions must be pipe-separated item ids')
+    return {
+        'user_id': last.get('user_id'),
+        'session_id': last.get('session_id'),
+        'timestamp': last.get('timestamp'),
+        'step': last.get('step'),
+        'items': items,
+        'events': events,
+    }
+
+
+class StoreFeatures(object):
+    """
+    Impression features of the clickouts, taken from the feature store of a split. Each feature is looked up
+    by the keys it is defined on (eg: the features of the items only by item_id), so the features of the
+    items and of the users are found for the sessions missing from the store too. The values not found are
+    missing (NaN).
+    """
+
+    def __init__(self, mode, cluster, features_array, columns, categories=None):
+        """
+        features_array: features of the dataset used to train the ranker (see dataset_features)
+        columns: columns of the feature matrix of the dataset, in the order expected by the ranker
+        categories: categories of the categorical columns, in the order of columns (see rankers.Ranker)
+        """
+        store = FeatureStore(mode, cluster)
+        df = store.read(features_array)
+        missing = [c for c in columns if c not in df.columns]
+        if len(missing) > 0:
+            raise ValueError('Columns of the dataset missing from the feature store: {}'.format(missing))
+        self.columns = list(columns)
+        categorical = [c for c in self.columns if df[c].dtype == object]
+        categories = categories or []
+        if len(categories) != len(categorical):
+            raise ValueError('The ranker has {} categorical features, the store {}: {}'.format(
+                len(categories), len(categorical), categorical))
+        self.categories = {c: pd.Index(cats) for c, cats in zip(categorical, categories)}
+
+        key_columns = store.key_columns(features_array)
+        levels = OrderedDict()
+        for j, c in enumerate(self.columns):
+            levels.setdefault(tuple(key_columns[c]), []).append(j)
+        # one lookup table for each level of keys: (key columns, positions of its columns, index, matrix)
+        self.levels = []
+        for on, positions in levels.items():
+            index = pd.MultiIndex.from_arrays([df[k].values for k in on])
+            unique = ~index.duplicated()
+            matrix = np.empty((int(unique.sum()), len(positions)), dtype=np.float32)
+            for i, j in enumerate(positions):
+                matrix[:, i] = self.encode(self.columns[j], df[self.columns[j]].values[unique])
+            self.levels.append((on, positions, index[unique], matrix))
+        self.rows = 0
+        self.missing = {'/'.join(on): 0 for on, _, _, _ in self.levels}
+
+    def encode(self, column, values):
+        """ Return the values of a column as float32, with the missing values (-1) and the unknown categories NaN """
+        if column in self.categories:
+            codes = self.categories[column].get_indexer(values)
+            values = np.where(codes >= 0, codes, np.nan).astype(np.float32)
+        else:
+            values = np.array(values, dtype=np.float32)
+            # -1 is the missing value of the datasets of the rankers
+            values[values == -1] = np.nan
+        return values
+
+    def transform(self, clickouts, items, offsets):
+        """ Return the feature matrix of the impressions of the clickouts (flat items, see reranking) """
+        lengths = np.diff(offsets)
+        keys = {'user_id': np.repeat([c['user_id'] for c in clickouts], lengths),
+                'session_id': np.repeat([c['session_id'] for c in clickouts], lengths),
+                'item_id': items}
+        X = np.full((len(items), len(self.columns)), np.nan, dtype=np.float32)
+        for on, positions, index, matrix in self.levels:
+            pos = index.get_indexer(pd.MultiIndex.from_arrays([keys[k] for k in on]))
+            found = pos >= 0
+            X[np.ix_(found, positions)] = matrix[pos[found]]
+            self.missing['/'.join(on)] += int((~found).sum())
+        self.rows += len(items)
+        return X
+
+    def stats(self):
+        return {'rows': self.rows, 'missing_rows': dict(self.missing)}
+
+
+def dataset_path(ranker_kind, mode, cluster, name):
+    """ Return the folder of the dataset a ranker was trained on (the kind of xgboost, the dataset name of lightgbm) """
+    if ranker_kind == 'xgboost':
+        return 'dataset/preprocessed/{}/{}/xgboost/{}/'.format(cluster, mode, name)
+    return 'dataset/preprocessed/lightGBM/{}/{}/{}'.format(cluster, mode, name)
+
+
+def dataset_features(path):
+    """ Return the features array and the columns of a dataset, as saved by its creator """
+    if not os.path.isfile(join(path, 'features.json')) or not os.path.isfile(join(path, 'columns.json')):
+        raise ValueError('features.json or columns.json missing in {}: create the dataset again'.format(path))
+    return load_features_array(join(path, 'features.json')), load_columns(join(path, 'columns.json'))
+
+
+class RankingService(object):
+
+    def __init__(self, ranker, features, max_batch_size=64, max_wait_ms=5):
+        """
+        ranker: serving.rankers.Ranker
+        features: object with transform(clickouts, items, offsets) returning the feature matrix of the
+            impressions, and stats()
+        """
+        self.ranker = ranker
+        self.features = features
+        self.batcher = MicroBatcher(self.score_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def score_batch(self, clickouts):
+        """ Rerank the impressions of a batch of parsed clickouts (see parse_events) with one model call """
+        offsets = reranking.offsets_from_lengths([len(c['items']) for c in clickouts])
+        items = np.concatenate([c['items'] for c in clickouts])
+        scores = self.ranker.predict(self.features.transform(clickouts, items, offsets))
+        items, scores = reranking.rerank(items, scores, offsets)
+        res = []
+        for i, c in enumerate(clickouts):
+            s, e = offsets[i], offsets[i + 1]
+            res.append({'user_id': c['user_id'], 'session_id': c['session_id'], 'timestamp': c['timestamp'],
+                        'step': c['step'], 'recommendations': items[s:e].tolist(), 'scores': scores[s:e].tolist()})
+        return res
+
+    def submit(self, clickout):
+        """ Wait the batch of a parsed clickout and return its reranked impressions """
+        return self.batcher.submit(clickout)
+
+    def recommend(self, events):
+        return self.submit(parse_events(events))
+
+    def stats(self):
+        res = self.batcher.stats()
+        res['features'] = self.features.stats()
+        return res
+
+    def start(self):
+        self.batcher.start()
+        return self
+
+    def stop(self):
+        self.batcher.stop()
+
+
+def create_service(mode, cluster, ranker_kind, model_path, dataset_name, engine=None, **kwargs):
+    """
+    Return the RankingService of a trained ranker with the features of the dataset it was trained on: the
+    session features are computed online from the events of the requests (see serving/session_state.py), the
+    others are taken from the feature store of the split
+    dataset_name: kind of the xgboost dataset or name of the lightgbm one
+    engine: SessionStateEngine of the online features, a new one if None
+    kwargs: max_batch_size and max_wait_ms of the service
+    """
+    ranker = load_ranker(ranker_kind, model_path)
+    features_array, columns = dataset_features(dataset_path(ranker_kind, mode, cluster, dataset_name))
+    if ranker.feature_names is not None and len(ranker.feature_names) != len(columns):
+        raise ValueError('The ranker has {} features, the dataset {} {}'.format(
+            len(ranker.feature_names), dataset_name, len(columns)))
+    store = StoreFeatures(mode, cluster, features_array, columns, ranker.categories)
+    return RankingService(ranker, OnlineFeatures(store, engine), **kwargs)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately: avoid the delayed ack of small responses
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, res):
+        body = json.dumps(res, default=float).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.service.stats())
+        elif self.path == '/health':
+            self._reply(200, {'status': 'ok', 'ranker': self.server.service.ranker.kind})
+        else:
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if self.path != '/recommend':
+            self._reply(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            clickout = parse_events(payload['events'] if isinstance(payload, dict) else payload)
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        try:
+            res = self.server.service.submit(clickout)
+        except Exception as e:
+            self._reply(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+            return
+        self._reply(200, res)
+
+    def address_string(self):
+        # the client address of a unix socket is not a (host, port) tuple
+        return str(self.client_address[0]) if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(_Handler, self).log_message(format, *args)
+
+
+class _UnixHandler(_Handler):
+    # no TCP options on a unix socket
+    disable_nagle_algorithm = False
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, address, verbose=False):
+    """ Return the server (not started) of the service at the address: 'host:port' or a unix socket path """
+    kind, addr = parse_address(address)
+    if kind == 'unix':
+        if os.path.exists(addr):
+            os.remove(addr)
+        server = _ThreadingUnixHTTPServer(addr, _UnixHandler)
+    else:
+        server = _ThreadingHTTPServer(addr, _Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def serve(service, address, verbose=False):
+    server = create_server(service, address, verbose=verbose)
+    service.start()
+    print('serving {} on {}'.format(service.ranker.kind, address), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        if parse_address(address)[0] == 'unix' and os.path.exists(address):
+            os.remove(address)
+
+
+if __name__ == '__main__':
+    from utils.menu import mode_selection, cluster_selection, single_choice
+
+    mode = mode_selection()
+    cluster = cluster_selection()
+    ranker_kind = single_choice('which ranker?', ['xgboost', 'lightgbm'])
+    model_path = input('path of the saved model: ')
+    dataset_name = input('kind (xgboost) or name (lightgbm) of the dataset of the ranker: ')
+    address = input('address (host:port or unix socket path): ')
+
+    serve(create_service(mode, cluster, ranker_kind, model_path, dataset_name), address)
@@ -0,0 +1,249 @@
+import math
+from collections import OrderedDict
+import pandas as pd
+import data
+from preprocess_utils.last_clickout_indices import find_split
+
+"""
+Incremental session state for the online computation of the session features.
+
+The batch extractors of extract_features read the whole split at once. Here each session keeps a few
+accumulators, updated in O(1) for each new event, from which the features of a clickout are emitted
+as soon as it arrives:
+    TimingFromLastInteractionImpression: step_from_last_interaction, timestamp_from_last_interaction
+    TimesUserInteractedWithImpression: num_interactions_impr
+    LastActionInvolvingImpression: last_action_involving_impression
+    ActionsInvolvingImpressionSession: actions_involving_impression_session_<action>
+    FrenzyFactorSession: mean_time_per_step, frenzy_factor
+    MeanPriceClickout: mean_price_clickout
+
+The state is kept by session. The batch loop of TimingFromLastInteractionImpression and
+TimesUserInteractedWithImpression is reset only at the last clickouts, so the interactions after the last
+clickout of a session, or of a session without clickouts, are also counted in the next session of the df:
+those rows are the only differences between the two (see serving/check_session_state.py).
+The state is not kept by user: none of the features above is computed on the previous sessions of the user.
+"""
+
+# actions counted by ActionsInvolvingImpressionSession, in the order of its columns
+ITEM_ACTIONS = ['clickout item', 'interaction item deals', 'interaction item image', 'interaction item info',
+                'interaction item rating', 'search for item']
+_ACTION_CODE = {a: i for i, a in enumerate(ITEM_ACTIONS)}
+
+ACTIONS_COLUMNS = ['actions_involving_impression_session_{}'.format(a.replace(' ', '_')) for a in ITEM_ACTIONS] \
+                  + ['actions_involving_impression_session_no_action']
+LAST_ACTION_COLUMN = 'last_action_involving_impression'
+ITEM_COLUMNS = ['step_from_last_interaction', 'timestamp_from_last_interaction', 'num_interactions_impr',
+                LAST_ACTION_COLUMN] + ACTIONS_COLUMNS
+SESSION_COLUMNS = ['mean_time_per_step', 'frenzy_factor', 'mean_price_clickout']
+
+# positions in the state of an item: interactions, last step, last timestamp, last action, then the
+# counts of ITEM_ACTIONS weighted by the frequence of the events
+_COUNT, _STEP, _TIMESTAMP, _ACTION, _FIRST_ACTION_COUNT = range(5)
+
+
+def _is_numeric(reference):
+    return isinstance(reference, str) and reference.isnumeric()
+
+
+class SessionState(object):
+    __slots__ = ['items', 'last_step', 'last_timestamp', 'n_deltas', 'mean_delta', 'm2_delta']
+
+    def __init__(self):
+        # item_id -> list of the accumulators of the item (see the positions above)
+        self.items = {}
+        self.last_step = None
+        self.last_timestamp = None
+        # running mean and squared deviations of the time between consecutive events (Welford)
+        self.n_deltas = 0
+        self.mean_delta = 0.0
+        self.m2_delta = 0.0
+
+    def delta_stats(self, timestamp=None):
+        """ Return mean and std of the time between consecutive events, including the one to timestamp """
+        n, mean, m2 = self.n_deltas, self.mean_delta, self.m2_delta
+        if timestamp is not None and self.last_timestamp is not None:
+            n, mean, m2 = _welford(n, mean, m2, timestamp - self.last_timestamp)
+        if n == 0:
+            return -1, -1
+        return mean, math.sqrt(m2 / n)
+
+    def update(self, event):
+        timestamp = event['timestamp']
+        if self.last_timestamp is not None:
+            self.n_deltas, self.mean_delta, self.m2_delta = _welford(
+                self.n_deltas, self.mean_delta, self.m2_delta, timestamp - self.last_timestamp)
+        self.last_timestamp = timestamp
+        self.last_step = event['step']
+
+        reference = event.get('reference')
+        if not _is_numeric(reference):
+            return
+        item = int(reference)
+        state = self.items.get(item)
+        if state is None:
+            state = [0, 0, 0, None] + [0] * len(ITEM_ACTIONS)
+            self.items[item] = state
+        state[_COUNT] += 1
+        state[_STEP] = event['step']
+        state[_TIMESTAMP] = timestamp
+        state[_ACTION] = event['action_type']
+        code = _ACTION_CODE.get(event['action_type'])
+        if code is not None:
+            frequence = event.get('frequence')
+            state[_FIRST_ACTION_COUNT + code] += 1 if frequence is None or pd.isnull(frequence) else frequence
+
+
+def _welford(n, mean, m2, x):
+    n += 1
+    d = x - mean
+    mean += d / n
+    m2 += d * (x - mean)
+    return n, mean, m2
+
+
+class SessionStateEngine(object):
+    """ Keeps the state of the active sessions and emits the features of their clickouts """
+
+    def __init__(self, max_sessions=None):
+        """ max_sessions (int): number of sessions kept, the least recently updated are dropped first """
+        self.sessions = OrderedDict()
+        self.max_sessions = max_sessions
+
+    def _session(self, event):
+        key = (event['user_id'], event['session_id'])
+        state = self.sessions.get(key)
+        if state is None:
+            state = SessionState()
+            self.sessions[key] = state
+            if self.max_sessions is not None and len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(key)
+        return state
+
+    def update(self, event):
+        self._session(event).update(event)
+
+    def clickout_features(self, event, state=None):
+        """
+        Return the features of the impressions of a clickout from the events of its session seen so far
+        (the clickout itself is not applied): a dict column -> list, with the item_id column too
+        """
+        state = self._session(event) if state is None else state
+        items = list(map(int, event['impressions'].split('|')))
+        res = {c: [] for c in ['item_id'] + ITEM_COLUMNS}
+        for item in items:
+            s = state.items.get(item)
+            res['item_id'].append(item)
+            if s is None:
+                res['step_from_last_interaction'].append(-1)
+                res['timestamp_from_last_interaction'].append(-1)
+                res['num_interactions_impr'].append(0)
+                res[LAST_ACTION_COLUMN].append('no_action')
+                for c in ACTIONS_COLUMNS[:-1]:
+                    res[c].append(0)
+                res[ACTIONS_COLUMNS[-1]].append(1)
+            else:
+                res['step_from_last_interaction'].append(event['step'] - s[_STEP])
+                res['timestamp_from_last_interaction'].append(event['timestamp'] - s[_TIMESTAMP])
+                res['num_interactions_impr'].append(s[_COUNT])
+                res[LAST_ACTION_COLUMN].append(s[_ACTION])
+                for i, c in enumerate(ACTIONS_COLUMNS[:-1]):
+                    res[c].append(s[_FIRST_ACTION_COUNT + i])
+                res[ACTIONS_COLUMNS[-1]].append(0)
+
+        mean_time, frenzy = state.delta_stats(event['timestamp'])
+        prices = list(map(int, event['prices'].split('|'))) if isinstance(event.get('prices'), str) else []
+        res['mean_time_per_step'] = [mean_time] * len(items)
+        res['frenzy_factor'] = [frenzy] * len(items)
+        res['mean_price_clickout'] = [sum(prices) / len(prices) if len(prices) > 0 else -1] * len(items)
+        return res
+
+    def process(self, event):
+        """ Apply an event, return the features of the clickout before applying it if it is a clickout """
+        state = self._session(event)
+        features = None
+        if event['action_type'] == 'clickout item' and isinstance(event.get('impressions'), str):
+            features = self.clickout_features(event, state)
+        state.update(event)
+        return features
+
+    def replay(self, events):
+        """
+        Apply the events of a session not seen yet (by step) and return the features of the last one,
+        that must be a clickout. Used when each request carries all the events of the session so far.
+        """
+        state = self._session(events[-1])
+        last_step = state.last_step if state.last_step is not None else -1
+        for e in events[:-1]:
+            if e['step'] > last_step:
+                state.update(e)
+        return self.clickout_features(events[-1], state)
+
+    def end_session(self, user_id, session_id):
+        self.sessions.pop((user_id, session_id), None)
+
+
+def one_hot_last_action(features, values=None):
+    """ Replace the last action column with its one hot columns, named as pd.get_dummies would """
+    values = values or ITEM_ACTIONS + ['no_action']
+    actions = features.pop(LAST_ACTION_COLUMN)
+    for v in values:
+        features['{}_{}'.format(LAST_ACTION_COLUMN, v)] = [int(a == v) for a in actions]
+    return features
+
+
+class OnlineFeatures(object):
+    """
+    Feature provider of the ranking server (see serving/server.py) that computes the session features
+    from the events of the requests, and takes the other features from a base provider (eg: StoreFeatures),
+    that also encodes the values of the columns with encode(column, values)
+    """
+
+    def __init__(self, base, engine=None):
+        self.base = base
+        self.columns = base.columns
+        self.engine = engine or SessionStateEngine(max_sessions=100000)
+        self._online_columns = None
+
+    def transform(self, clickouts, items, offsets):
+        X = self.base.transform(clickouts, items, offsets)
+        for i, c in enumerate(clickouts):
+            features = self.engine.replay(c['events'])
+            if LAST_ACTION_COLUMN not in self.columns:
+                # the datasets of xgboost have the one hot of the last action, the ones of lightgbm its category
+                features = one_hot_last_action(features)
+            if self._online_columns is None:
+                self._online_columns = [(j, name) for j, name in enumerate(self.columns) if name in features]
+            for j, name in self._online_columns:
+                X[offsets[i]:offsets[i + 1], j] = self.base.encode(name, features[name])
+        return X
+
+    def stats(self):
+        res = self.base.stats()
+        res['online_sessions'] = len(self.engine.sessions)
+        return res
+
+
+def replay_split(mode, cluster='no_cluster', last_clickouts_only=True):
+    """
+    Stream the events of train and test of a split through the engine, in order, and return the features
+    of the clickouts as a dataframe with user_id, session_id, item_id and the feature columns
+    """
+    df = pd.concat([data.train_df(mode, cluster), data.test_df(mode, cluster)])
+    emit = set(find_split(mode, cluster)) if last_clickouts_only else None
+    engine = SessionStateEngine()
+    columns = [c for c in ['user_id', 'session_id', 'timestamp', 'step', 'action_type', 'reference',
+                           'impressions', 'prices', 'frequence'] if c in df.columns]
+    blocks = []
+    for idx, event in zip(df.index, df[columns].to_dict('records')):
+        if emit is not None and idx not in emit:
+            engine.update(event)
+            continue
+        features = engine.process(event)
+        if features is not None:
+            block = pd.DataFrame(features)
+            block.insert(0, 'session_id', event['session_id'])
+            block.insert(0, 'user_id', event['user_id'])
+            blocks.append(block)
+    return pd.concat(blocks, ignore_index=True)
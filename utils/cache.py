@@ -0,0 +1,126 @@
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import scipy.sparse as sps
+
+"""
+Keyed in-process cache with a memory budget, used by the accessors of data.py.
+The size of each entry is computed when it is inserted; when the total exceeds the budget the least
+recently used entries are evicted (the last inserted one is always kept).
+"""
+
+
+def sizeof(obj):
+    """ Return the (approximate) number of bytes used by an object """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        res = obj.memory_usage(index=True, deep=True)
+        return int(res.sum()) if isinstance(obj, pd.DataFrame) else int(res)
+    if isinstance(obj, pd.Index):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return obj.nbytes + sum(sys.getsizeof(v) for v in obj.ravel())
+        return obj.nbytes
+    if sps.issparse(obj):
+        if obj.format not in ['csr', 'csc', 'coo']:
+            obj = obj.tocsr()
+        return sum(getattr(obj, a).nbytes for a in ['data', 'indices', 'indptr', 'row', 'col'] if hasattr(obj, a))
+    if isinstance(obj, (tuple, list)):
+        return sys.getsizeof(obj) + sum(sizeof(v) for v in obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sys.getsizeof(k) + sizeof(v) for k, v in obj.items())
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+
+    def __init__(self, budget):
+        """ budget (int): maximum number of bytes of the entries, None for no limit """
+        self.budget = budget
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load):
+        """ Return the value of the key, calling load() to compute it if not cached """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = load()
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.total += size
+            self._evict(keep=key)
+
+    def _remove(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self.total -= self._sizes.pop(key)
+
+    def _evict(self, keep=None):
+        if self.budget is None:
+            return
+        while self.total > self.budget and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            self._remove(key)
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def invalidate(self, match=None):
+        """
+        Remove the entries whose key satisfies match: a function key -> bool, or the first element of
+        the tuple keys. Remove all the entries if None. Return the number of entries removed
+        """
+        with self._lock:
+            if match is None:
+                keys = list(self._entries)
+            elif callable(match):
+                keys = [k for k in self._entries if match(k)]
+            else:
+                keys = [k for k in self._entries if isinstance(k, tuple) and len(k) > 0 and k[0] == match]
+            for k in keys:
+                self._remove(k)
+            return len(keys)
+
+    def stats(self):
+        """ Return a dict with the counters of the cache and the size in bytes of each entry """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests > 0 else 0.0,
+                'evictions': self.evictions,
+                'sizes': OrderedDict((k, self._sizes[k]) for k in self._entries),
+            }
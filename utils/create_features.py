@@ -73,7 +73,6 @@ from extract_features.normalized_platform_features_similarity import NormalizedP
 import gc
 import utils.menu as menu
 from functools import partial
-from joblib import Parallel, delayed
 import traceback
 
 def create_and_save_feature(mode, cluster, feature_class):
@@ -81,49 +80,49 @@ def create_and_save_feature(mode, cluster, feature_class):
     feature = feature_class(mode=mode, cluster=cluster)
     feature.save_feature(overwrite_if_exists=True)
 
-if __name__ == '__main__':
-    features_array = [
-       #ActionsInvolvingImpressionSession,
-       #ImpressionPositionSession,
-       #ImpressionPriceInfoSession,
-       #ImpressionRatingNumeric,
-       #ImpressionLabel,
-       #MeanPriceClickout,
-       #AvgPriceInteractions,
-       #SessionDevice,
-       #NumImpressionsInClickout,
-       #SessionLengthOld,
-       #TimesImpressionAppearedInClickoutsSession,
-       #TimesUserInteractedWithImpression,
-       #TimingFromLastInteractionImpression,
-       #TopPopPerImpression,
-       #TopPopInteractionClickoutPerImpression,
-       #ChangeImpressionOrderPositionInSession,
-       #FrenzyFactorSession,
-       #DayOfWeekAndMomentInDay,
-       # LastClickoutFiltersSatisfaction,
-       # TimePerImpression,
-       # PersonalizedTopPop,
-       # PriceQuality,
-       # PlatformFeaturesSimilarity,
-       # LastActionBeforeClickout,
-        # ImpressionStarsNumeric,
-         StepsBeforeLastClickout,
-        LocationReferencePercentageOfClickouts,
-        LocationReferencePercentageOfInteractions,
-        NumTimesItemImpressed,
-        PercClickPerImpressions,
-        PlatformReferencePercentageOfClickouts,
-        PlatformReferencePercentageOfInteractions,
-        PlatformSession,
-        User2ItemOld,
-        LazyUser,
-        NormalizedPlatformFeaturesSimilarity,
-      # PastFutureSessionFeatures,
-        ]
+features_array = [
+   #ActionsInvolvingImpressionSession,
+   #ImpressionPositionSession,
+   #ImpressionPriceInfoSession,
+   #ImpressionRatingNumeric,
+   #ImpressionLabel,
+   #MeanPriceClickout,
+   #AvgPriceInteractions,
+   #SessionDevice,
+   #NumImpressionsInClickout,
+   #SessionLengthOld,
+   #TimesImpressionAppearedInClickoutsSession,
+   #TimesUserInteractedWithImpression,
+   #TimingFromLastInteractionImpression,
+   #TopPopPerImpression,
+   #TopPopInteractionClickoutPerImpression,
+   #ChangeImpressionOrderPositionInSession,
+   #FrenzyFactorSession,
+   #DayOfWeekAndMomentInDay,
+   # LastClickoutFiltersSatisfaction,
+   # TimePerImpression,
+   # PersonalizedTopPop,
+   # PriceQuality,
+   # PlatformFeaturesSimilarity,
+   # LastActionBeforeClickout,
+    # ImpressionStarsNumeric,
+     StepsBeforeLastClickout,
+    LocationReferencePercentageOfClickouts,
+    LocationReferencePercentageOfInteractions,
+    NumTimesItemImpressed,
+    PercClickPerImpressions,
+    PlatformReferencePercentageOfClickouts,
+    PlatformReferencePercentageOfInteractions,
+    PlatformSession,
+    User2ItemOld,
+    LazyUser,
+    NormalizedPlatformFeaturesSimilarity,
+  # PastFutureSessionFeatures,
+    ]
 
-    import multiprocessing as mp
+if __name__ == '__main__':
     from utils.menu import yesno_choice
+    import utils.feature_scheduler as feature_scheduler
 
     jobs = int(input('how many jobs?'))
     mp = yesno_choice('do you want mp or not?')
@@ -132,10 +131,7 @@ if __name__ == '__main__':
     cluster = menu.cluster_selection()
 
     if mp == 'y':
-        Parallel(backend='multiprocessing', n_jobs=jobs, max_nbytes=None)(delayed(create_and_save_feature)
-            (
-                mode, cluster, f
-            ) for f in features_array)
+        feature_scheduler.run(features_array, mode, cluster, n_workers=jobs)
     else:
         for f in features_array:
             try:
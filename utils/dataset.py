@@ -2,9 +2,11 @@ import os
 import math
 import pandas as pd
 import numpy as np
+import scipy.sparse as sps
 from abc import abstractmethod
 import utils.datasetconfig as datasetconfig
-from generator import DataGenerator
+from generator import DataGenerator, ShardGenerator
+import utils.tensor_shards as shards
 import preprocess_utils.session2vec as sess2vec
 #from sklearn.preprocessing import MinMaxScaler
 from sklearn.externals import joblib
@@ -74,6 +76,10 @@ class Dataset(DatasetBase):
         # sparsity info
         self.X_sparse_columns = data['X_sparse_columns']
         self.Y_sparse_columns = data['Y_sparse_columns']
+        # categorical columns and accomodations features, expanded at load time
+        self.X_categorical_columns = data.get('X_categorical_columns', {})
+        self.item_features_name = data.get('item_features_name', '')
+        self.item_features_columns = data.get('item_features_columns', [])
     
         # paths
         self.train_path = os.path.join(self.dataset_path, self.train_name)
@@ -84,6 +90,17 @@ class Dataset(DatasetBase):
         # cache
         self._xtestindices = None
         self._xtrainindices = None
+        self._item_features = None
+
+    def _expand_columns(self, X_df):
+        """ Expand the categorical columns and the rows of the accomodations features saved by the builders """
+        for col, classes in self.X_categorical_columns.items():
+            X_df = sess2vec.expand_categorical_codes(X_df, col, classes)
+        if self.item_features_name != '':
+            if self._item_features is None:
+                self._item_features = sps.load_npz(os.path.join(self.dataset_path, self.item_features_name)).tocsr()
+            X_df = sess2vec.expand_reference_features(X_df, self._item_features, self.item_features_columns)
+        return X_df
     
     # load data
 
@@ -280,6 +297,7 @@ class SequenceDatasetForClassification(Dataset):
         partial (bool): True if X_df is a chunk of the entire file
         return_indices (bool): True to return the indices of the rows (useful at prediction time)
         """
+        X_df = self._expand_columns(X_df)
         X_df = X_df.fillna(fillNaN)
 
         cols_to_drop_in_X = ['user_id','session_id','timestamp','reference','step','platform','city','current_filters']
@@ -406,6 +424,16 @@ class SequenceDatasetForClassification(Dataset):
         #batches_in_train = math.ceil(number_of_train_sessions / sessions_per_batch)
         #batches_in_val = tot_batches - batches_in_train
 
+        if self.has_shards(['X_train','Y_train']):
+            X, Y = shards.ShardedTensor(self.dataset_path, 'X_train'), shards.ShardedTensor(self.dataset_path, 'Y_train')
+            print('Train generator:')
+            train_gen = ShardGenerator(X, Y, samples_per_batch=sessions_per_batch, end_sample=number_of_train_sessions,
+                                        shuffle=True, pre_fit_fn=self.prefit_xy)
+            print('Validation generator:')
+            val_gen = ShardGenerator(X, Y, samples_per_batch=sessions_per_batch, start_sample=number_of_train_sessions,
+                                        pre_fit_fn=self.prefit_xy)
+            return train_gen, val_gen
+
         print('Train generator:')
         train_gen = DataGenerator(self, pre_fit_fn=self.prefit_xy, rows_to_read=train_rows)
         #train_gen.name = 'train_gen'
@@ -418,8 +446,37 @@ class SequenceDatasetForClassification(Dataset):
 
     def get_test_generator(self, sessions_per_batch=256):
         # return the generator for the test
+        if self.has_shards(['X_test']):
+            return ShardGenerator(shards.ShardedTensor(self.dataset_path, 'X_test'), samples_per_batch=sessions_per_batch,
+                                    pre_fit_fn=self.prefit_x)
         return DataGenerator(self, for_train=False, pre_fit_fn=self.prefit_x)
 
+    def has_shards(self, names=['X_train','Y_train','X_test']):
+        """ Return True if the tensors have been saved as shards (see save_shards) after the csv """
+        sources = {'X_train': self.X_train_path, 'Y_train': self.Y_train_path, 'X_test': self.X_test_path}
+        return all(shards.shards_exist(self.dataset_path, n, sources=[sources[n]]) for n in names)
+
+    def save_shards(self, train=True, test=True, samples_per_shard=shards.SAMPLES_PER_SHARD):
+        """
+        Save the preprocessed tensors as float32 shards, read by the generators instead of the csv. The csv are
+        read and preprocessed one shard at a time (the preprocessing of a row does not depend on the others)
+        """
+        if train:
+            shards.write_chunks(self.dataset_path, 'X_train', self._x_chunks(self.X_train_path, samples_per_shard),
+                                samples_per_shard=samples_per_shard)
+            # one row of Y for each sample
+            Y_chunks = ((self._preprocess_y_df(Y_df), None)
+                        for Y_df in pd.read_csv(self.Y_train_path, index_col=0, chunksize=samples_per_shard))
+            shards.write_chunks(self.dataset_path, 'Y_train', Y_chunks, samples_per_shard=samples_per_shard)
+        if test:
+            shards.write_chunks(self.dataset_path, 'X_test', self._x_chunks(self.X_test_path, samples_per_shard),
+                                samples_per_shard=samples_per_shard)
+
+    def _x_chunks(self, path, samples_per_shard):
+        """ Yield the preprocessed samples of an X csv and the indices of their target rows, a shard at a time """
+        for X_df in pd.read_csv(path, index_col=0, chunksize=samples_per_shard * self.rows_per_sample):
+            yield self._preprocess_x_df(X_df, partial=True, return_indices=True)
+
     def get_class_weights(self, num_classes=25):
         return super().get_class_weights(num_classes)
     
@@ -450,6 +507,7 @@ class DatasetScoresClassification(Dataset):
     def _preprocess_x_df(self, X_df, fillNaN=0):
         """ Preprocess the loaded data (X) """
         #X_df.reset_index(inplace=True)
+        X_df = self._expand_columns(X_df)
         X_df = X_df.fillna(fillNaN)
 
         cols_to_drop_in_X = ['user_id','session_id','timestamp','reference','step','platform','city','current_filters']
@@ -2,8 +2,12 @@ import os
 import json
 
 def save_config(dataset_path, mode, cluster, train_len, test_len, train_name='', Xtrain_name='X_train.csv', 
-                Ytrain_name='Y_train.csv', Xtest_name='X_test.csv', rows_per_sample=1, X_sparse_cols=[], Y_sparse_cols=[]):
-    """ Save the config file for the specified dataset """
+                Ytrain_name='Y_train.csv', Xtest_name='X_test.csv', rows_per_sample=1, X_sparse_cols=[], Y_sparse_cols=[],
+                X_categorical_cols={}, item_features_name='', item_features_cols=[]):
+    """ Save the config file for the specified dataset
+    X_categorical_cols (dict): columns of X saved as indices of their classes, {column: classes}
+    item_features_name (str): file of the accomodations features matrix, whose rows are referenced in X
+    """
     path = os.path.join(dataset_path, 'dataset_config.json')
     data = {
         'mode': mode,
@@ -17,6 +21,9 @@ def save_config(dataset_path, mode, cluster, train_len, test_len, train_name='',
         'rows_per_sample': rows_per_sample,
         'X_sparse_columns': X_sparse_cols,
         'Y_sparse_columns': Y_sparse_cols,
+        'X_categorical_columns': X_categorical_cols,
+        'item_features_name': item_features_name,
+        'item_features_columns': item_features_cols,
     }
     with open(path, 'w') as f:
         json.dump(data, f, indent=2)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import recommenders.reranking as reranking
+
+"""
+MRR evaluation engine.
+
+The recommendations and the ground truth are converted once into aligned integer arrays: the flat
+recommended items with the offsets of each clickout (see recommenders.reranking) and one reference for
+each clickout. The reciprocal ranks of all the clickouts are then computed at once, and the MRR can be
+broken down by segment in a single groupby.
+"""
+
+
+def references_array(references):
+    """ Return the references as int64 array, -1 for the missing or non-numeric ones """
+    references = pd.to_numeric(pd.Series(np.asarray(references, dtype=object)), errors='coerce')
+    return references.fillna(-1).values.astype(np.int64)
+
+
+def reciprocal_ranks(items, offsets, references, max_rank=None, single_hit=False):
+    """
+    Return the reciprocal rank of the reference of each clickout in its recommendations, 0 if missing.
+    items, offsets: flat recommendations, the ones of the i-th clickout are in [offsets[i], offsets[i+1])
+    references: array with one reference for each clickout
+    max_rank (int): the references ranked after max_rank get 0
+    single_hit (bool): if True, the clickouts whose reference is recommended more than once get 0
+        (as in the official scoring script)
+    """
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    group = np.repeat(np.arange(n), lengths)
+    hit = np.asarray(items) == np.asarray(references)[group]
+    hit_group = group[hit]
+    hit_rank = (np.flatnonzero(hit) - offsets[hit_group]) + 1
+
+    rr = np.zeros(n, dtype=np.float64)
+    # the hits are in order, so the first one of each clickout is its best rank
+    first_group, first = np.unique(hit_group, return_index=True)
+    rr[first_group] = 1 / hit_rank[first]
+    if max_rank is not None:
+        rr[first_group[hit_rank[first] > max_rank]] = 0
+    if single_hit:
+        rr[np.bincount(hit_group, minlength=n) > 1] = 0
+    return rr
+
+
+def predictions_reciprocal_ranks(predictions, references, max_rank=25):
+    """
+    Return the reciprocal ranks of the recommendations in the format [(index, [acc_1, acc_2, ...]), ...]
+    references: references of the clickouts, in the same order of the predictions
+    """
+    _, items, offsets = reranking.from_predictions(predictions)
+    return reciprocal_ranks(items, offsets, references_array(references), max_rank=max_rank)
+
+
+def submission_reciprocal_ranks(df):
+    """
+    Return the reciprocal ranks of a submission joined with the ground truth, as in the official scoring
+    script: df must have the reference and the item_recommendations (space-separated) columns
+    """
+    items, offsets = reranking.split_impressions(df['item_recommendations'].values, sep=' ')
+    return reciprocal_ranks(items, offsets, references_array(df['reference'].values), single_hit=True)
+
+
+def mrr(rr, segments=None):
+    """
+    Return the MRR of the reciprocal ranks or, if segments is specified, a dataframe with the MRR and the
+    size of each segment.
+    segments: array of segment labels (one for each clickout), or dict name -> boolean mask (the masks
+        can overlap)
+    """
+    rr = np.asarray(rr, dtype=np.float64)
+    if segments is None:
+        return rr.mean() if len(rr) > 0 else 0.0
+    if isinstance(segments, dict):
+        return pd.DataFrame([{'segment': name, 'mrr': rr[np.asarray(mask)].mean() if np.any(mask) else 0.0,
+                              'size': int(np.sum(mask))} for name, mask in segments.items()]).set_index('segment')
+    res = pd.Series(rr).groupby(np.asarray(segments)).agg(['mean', 'size'])
+    return res.rename(columns={'mean': 'mrr'}).rename_axis('segment')
@@ -0,0 +1,50 @@
+import json
+import numpy as np
+import scipy.sparse as sps
+
+"""
+Conversion of the feature dataframes built by merge_features into the float32 matrices of the rankers.
+The columns are converted a block at a time, so only a dense float32 block of block_columns columns
+exists at once besides the dataframe: the whole frame is never copied (or cast to float64).
+"""
+
+_BLOCK_COLUMNS = 32
+
+
+def feature_matrix(df, drop_columns=(), missing_values=(-1,), sparse=True, block_columns=_BLOCK_COLUMNS):
+    """
+    Return the float32 matrix of the feature columns of df and the list of their names.
+    drop_columns: columns of df that are not features (ids, label, ...)
+    missing_values: values of the features that mean missing, stored as NaN
+    sparse (bool): if True return a CSR matrix without the zeros (the NaN are stored, as with
+        DataFrame.to_sparse(fill_value=0)), otherwise a dense array
+    """
+    drop_columns = set(drop_columns)
+    columns = [c for c in df.columns if c not in drop_columns]
+    dense = None if sparse else np.empty((len(df), len(columns)), dtype=np.float32)
+    blocks = []
+    for start in range(0, len(columns), block_columns):
+        names = columns[start:start + block_columns]
+        block = np.empty((len(df), len(names)), dtype=np.float32) if sparse else dense[:, start:start + len(names)]
+        for j, c in enumerate(names):
+            block[:, j] = df[c].values
+        for v in missing_values:
+            block[block == v] = np.nan
+        if sparse:
+            blocks.append(sps.csr_matrix(block))
+    if not sparse:
+        return dense, columns
+    if len(blocks) == 0:
+        return sps.csr_matrix((len(df), 0), dtype=np.float32), columns
+    return sps.hstack(blocks, format='csr', dtype=np.float32), columns
+
+
+def save_columns(columns, path):
+    """ Save the names of the columns of a feature matrix """
+    with open(path, 'w') as f:
+        json.dump([str(c) for c in columns], f, indent=2)
+
+
+def load_columns(path):
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,153 @@
+import time
+import threading
+import traceback
+import multiprocessing as mp
+from queue import Empty
+import psutil
+import pandas as pd
+import data
+from extract_features.feature_store import dependency_order, feature_id
+
+"""
+Parallel feature extraction scheduler.
+
+The train and test dataframes of the split are loaded once in the main process, then each feature is
+extracted in a forked worker process: the workers find the dataframes already cached in the data module
+and share their memory pages with the main process (copy-on-write), instead of reloading them.
+Features are started only after their dependencies are completed.
+"""
+
+# seconds between two checks of the running workers
+_POLL_INTERVAL = 0.5
+
+
+def _uss(pid):
+    """
+    Current USS in MB of a process (0 if already terminated): the memory private to the process, without the
+    pages of the dataframes still shared with the main process, that the RSS would count in every worker
+    """
+    try:
+        return psutil.Process(pid).memory_full_info().uss / 2 ** 20
+    except psutil.NoSuchProcess:
+        return 0
+
+
+def _extract(feature, queue):
+    """ Worker: create and save a feature, then send (id, seconds, peak USS in MB, error) to the queue """
+    start = time.time()
+    error = None
+    # the USS has no peak counter like ru_maxrss, so it is sampled by a thread while the feature is extracted
+    peak = [_uss(None)]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(_POLL_INTERVAL):
+            peak[0] = max(peak[0], _uss(None))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        feature.save_feature(overwrite_if_exists=True)
+    except Exception:
+        error = traceback.format_exc()
+    stop.set()
+    sampler.join()
+    peak_uss = max(peak[0], _uss(None))
+    queue.put((feature_id(feature), time.time() - start, peak_uss, error))
+
+
+def run(features, mode, cluster='no_cluster', n_workers=4, memory_budget=None, only_stale=False):
+    """
+    Extract and save the specified features in parallel.
+    features: list of FeatureBase subclasses
+    n_workers (int): maximum number of features extracted at the same time
+    memory_budget (float): maximum MB to be used by the running workers. A new worker is started only if the
+        current workers USS plus the highest peak USS seen so far fits the budget. The USS counts only the
+        private pages of a worker, not the ones shared with the main process. None means no limit
+    only_stale (bool): if True, extract only the features that are missing or stale
+    Return a dataframe with the wall time and the peak USS of each feature.
+    """
+    requested = [f(mode=mode, cluster=cluster) for f in features]
+    requested_ids = set(feature_id(f) for f in requested)
+    # add the missing dependencies
+    tasks = [f for f in dependency_order(requested)
+             if (feature_id(f) in requested_ids and not only_stale) or f.is_stale()]
+    task_ids = set(feature_id(f) for f in tasks)
+    print('{} features to extract with {} workers'.format(len(tasks), n_workers), flush=True)
+
+    # load the split once, the workers will share it
+    data.train_df(mode, cluster)
+    data.test_df(mode, cluster)
+
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    pending = list(tasks)
+    running = {}
+    done = set()
+    failed = set()
+    report = []
+    estimate = 0
+
+    def deps_ready(f):
+        return all(feature_id(d) in done or feature_id(d) not in task_ids for d in f.dependencies)
+
+    while len(pending) > 0 or len(running) > 0:
+        # collect the completed features
+        while True:
+            try:
+                fid, seconds, peak_uss, error = queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                break
+            running.pop(fid).join()
+            (failed if error is not None else done).add(fid)
+            estimate = max(estimate, peak_uss)
+            report.append({'feature': fid, 'seconds': seconds, 'peak_uss_mb': peak_uss,
+                           'status': 'ok' if error is None else 'failed'})
+            print('{} {} in {:.1f}s, peak USS {:.0f} MB'.format(fid, report[-1]['status'], seconds, peak_uss))
+            if error is not None:
+                print(error)
+
+        # workers killed before reporting (eg: out of memory)
+        for fid, p in list(running.items()):
+            if not p.is_alive() and p.exitcode != 0:
+                running.pop(fid)
+                failed.add(fid)
+                report.append({'feature': fid, 'seconds': 0, 'peak_uss_mb': 0, 'status': 'killed'})
+                print('{} killed with exit code {}'.format(fid, p.exitcode))
+
+        # skip the features whose dependencies failed
+        for f in [f for f in pending if any(feature_id(d) in failed for d in f.dependencies)]:
+            pending.remove(f)
+            failed.add(feature_id(f))
+            report.append({'feature': feature_id(f), 'seconds': 0, 'peak_uss_mb': 0, 'status': 'skipped'})
+
+        # start the ready features while the workers and the memory budget allow it
+        for f in [f for f in pending if deps_ready(f)]:
+            if len(running) >= n_workers:
+                break
+            if memory_budget is not None and len(running) > 0:
+                used = sum(_uss(p.pid) for p in running.values())
+                if used + estimate > memory_budget:
+                    break
+            p = ctx.Process(target=_extract, args=(f, queue))
+            p.start()
+            running[feature_id(f)] = p
+            pending.remove(f)
+
+    report = pd.DataFrame(report, columns=['feature', 'status', 'seconds', 'peak_uss_mb'])
+    print(report.to_string(index=False))
+    return report
+
+
+if __name__ == '__main__':
+    import utils.menu as menu
+    from utils.create_features import features_array
+
+    mode = menu.mode_selection()
+    cluster = menu.cluster_selection()
+    n_workers = int(input('how many workers? '))
+    budget = input('memory budget in MB (empty for no limit)? ')
+    only_stale = menu.yesno_choice('Do you want to extract only the missing or stale features?') == 'y'
+
+    run(features_array, mode, cluster, n_workers=n_workers,
+        memory_budget=float(budget) if budget != '' else None, only_stale=only_stale)
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+import utils.evaluation as evaluation
 
 
 def read_into_df(file):
@@ -59,6 +60,11 @@ def score_submissions(subm_csv, gt_csv, objective_function, subm_csv_is_file=Tru
     # append key to submission file
     df_subm_with_key = df_key.join(df_subm, how='inner')
     df_subm_with_key.reference = df_subm_with_key.reference.astype(int)
+
+    if objective_function is get_reciprocal_ranks:
+        # score all the rows at once
+        return evaluation.submission_reciprocal_ranks(df_subm_with_key).mean()
+
     df_subm_with_key = convert_string_to_list(
         df_subm_with_key, 'item_recommendations', 'item_recommendations'
     )
@@ -0,0 +1,88 @@
+import os
+import json
+import hashlib
+import numpy as np
+from utils.check_folder import check_folder
+
+"""
+Cache of the datasets of the rankers in the native binary formats of the libraries: the DMatrix buffer of
+xgboost (with the groups and the weights) and the binary Dataset of lightgbm (with the query groups and the
+bins already computed). Loading them skips the parsing of the npz/hdf and the binning, that otherwise are
+repeated for each configuration sampled by RandomValidator and bayesian_optimizer.
+
+The buffers are kept in a 'native' folder next to the dataset, named after the dataset and the hash of
+the feature set (and of the binning params for lightgbm), and are rebuilt when a source file is newer.
+"""
+
+# params of lightgbm that change the bins of a Dataset, so they are part of its key
+LIGHTGBM_BINNING_PARAMS = ['max_bin', 'min_data_in_bin', 'subsample_for_bin', 'bin_construct_sample_cnt',
+                           'use_missing', 'zero_as_missing', 'categorical_feature']
+
+
+def feature_set_hash(columns, params=None):
+    """ Return a short hash of the names of the features (and of some params) """
+    key = json.dumps([[str(c) for c in columns], sorted((params or {}).items())], default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def rows_hash(indices):
+    """ Return a short hash of a set of rows, to cache the datasets of the folds """
+    return hashlib.sha1(np.asarray(indices, dtype=np.int64).tobytes()).hexdigest()[:12]
+
+
+def cache_path(folder, name, columns, extension, params=None):
+    return os.path.join(folder, 'native', '{}_{}.{}'.format(name, feature_set_hash(columns, params), extension))
+
+
+def lightgbm_binning_params(params):
+    """ Return the params of the Dataset: the ones of the binning found in params """
+    res = {k: params[k] for k in LIGHTGBM_BINNING_PARAMS if params.get(k) is not None}
+    # the Dataset is reused by models with different min_data_in_leaf
+    res['feature_pre_filter'] = False
+    return res
+
+
+def _is_fresh(path, sources):
+    if not os.path.isfile(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return all(os.path.getmtime(s) <= mtime for s in sources if os.path.isfile(s))
+
+
+def xgboost_dmatrix(path, load, sources=()):
+    """
+    Return the DMatrix saved in path, or build it and save it if missing or older than the sources.
+    load: function returning X, y, group (sizes of the groups, or None) and weights (or None)
+    """
+    import xgboost as xgb
+    if _is_fresh(path, sources):
+        print('loading the DMatrix from {}'.format(path), flush=True)
+        return xgb.DMatrix(path)
+    X, y, group, weights = load()
+    dmatrix = xgb.DMatrix(X, label=y, weight=weights, missing=np.nan)
+    if group is not None:
+        dmatrix.set_group(group)
+    check_folder(path)
+    dmatrix.save_binary(path)
+    print('DMatrix saved in {}'.format(path), flush=True)
+    return dmatrix
+
+
+def lightgbm_dataset(path, load, params=None, reference=None, sources=()):
+    """
+    Return the lightgbm Dataset saved in path, or build it and save it if missing or older than the sources.
+    load: function returning X, y, group (sizes of the groups, or None) and weights (or None)
+    params: params of the Dataset (see lightgbm_binning_params)
+    reference: Dataset whose bins are used (eg: the train for the validation)
+    """
+    import lightgbm as lgb
+    if _is_fresh(path, sources):
+        print('loading the Dataset from {}'.format(path), flush=True)
+        return lgb.Dataset(path, params=params, reference=reference).construct()
+    X, y, group, weights = load()
+    dataset = lgb.Dataset(X, label=y, group=group, weight=weights, params=params, reference=reference,
+                          free_raw_data=True).construct()
+    check_folder(path)
+    dataset.save_binary(path)
+    print('Dataset saved in {}'.format(path), flush=True)
+    return dataset
@@ -0,0 +1,293 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import numpy as np
+from utils.check_folder import check_folder
+
+"""
+Columnar storage layer for the preprocessed dataframes.
+
+Each dataframe is addressed by its historical csv path (eg: dataset/preprocessed/full.csv). When saved, a
+columnar copy with compact dtypes is written next to it (full.parquet or full.feather), and it is read back
+with column projection. If the columnar copy is missing, the csv is used as a fallback. The columnar
+formats need pyarrow (see requirements.txt): without it only the csv are written and read.
+"""
+
+# 'parquet', 'feather' or 'csv' (csv disables the columnar copy)
+FORMAT = 'parquet'
+# whether to keep writing the csv next to the columnar copy (some scripts still read the csv directly)
+WRITE_CSV = True
+
+# low-cardinality string columns stored as categorical
+CATEGORICAL_COLUMNS = ['action_type', 'platform', 'city', 'device']
+# high-cardinality string columns stored dictionary-encoded (integer codes + vocabulary)
+CODED_COLUMNS = ['user_id', 'session_id']
+# numeric columns that fit in a smaller type
+NUMERIC_DTYPES = {
+    'step': 'int16',
+    'timestamp': 'int32',
+    'frequence': 'int16',
+}
+
+# name of the column holding the dataframe index inside the columnar files
+INDEX_COL = '__index__'
+
+_EXTENSIONS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+# whether pyarrow (needed by parquet and feather) can be imported, checked at the first use
+_pyarrow = None
+
+
+def _pyarrow_available():
+    """ Return True if pyarrow is installed, otherwise warn once that only the csv are used """
+    global _pyarrow
+    if _pyarrow is None:
+        try:
+            import pyarrow
+            _pyarrow = True
+        except ImportError:
+            _pyarrow = False
+            print('WARNING: pyarrow is not installed, the dataframes are saved and loaded as csv only', flush=True)
+    return _pyarrow
+
+
+def columnar_path(csv_path, fmt=None):
+    """ Return the path of the columnar copy of the specified csv """
+    fmt = fmt or FORMAT
+    return os.path.splitext(csv_path)[0] + _EXTENSIONS[fmt]
+
+
+def exists(csv_path, fmt=None):
+    """ Return True if the dataframe exists either in columnar or csv format """
+    fmt = fmt or FORMAT
+    if fmt != 'csv' and os.path.isfile(columnar_path(csv_path, fmt)):
+        return True
+    return os.path.isfile(csv_path)
+
+
+def split_mtime(mode, cluster='no_cluster'):
+    """ Return the last modification time of the train and test files of a split (0 if missing) """
+    mtimes = [0]
+    for name in ['train.csv', 'test.csv']:
+        csv_path = 'dataset/preprocessed/{}/{}/{}'.format(cluster, mode, name)
+        for p in [csv_path, columnar_path(csv_path)]:
+            if os.path.isfile(p):
+                mtimes.append(os.path.getmtime(p))
+    return max(mtimes)
+
+
+def split_hash(mode, cluster='no_cluster'):
+    """
+    Return a content hash of the train and test files of a split. The hash of each file is cached in
+    split_hash.json and recomputed only when the file size or modification time change.
+    """
+    cache_path = 'dataset/preprocessed/{}/{}/split_hash.json'.format(cluster, mode)
+    cache = {}
+    if os.path.isfile(cache_path):
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+
+    hashes = []
+    for name in ['train.csv', 'test.csv']:
+        csv_path = 'dataset/preprocessed/{}/{}/{}'.format(cluster, mode, name)
+        path = csv_path if os.path.isfile(csv_path) else columnar_path(csv_path)
+        if not os.path.isfile(path):
+            continue
+        stat = [os.path.getsize(path), os.path.getmtime(path)]
+        if path not in cache or cache[path]['stat'] != stat:
+            md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 24), b''):
+                    md5.update(block)
+            cache[path] = {'stat': stat, 'hash': md5.hexdigest()}
+        hashes.append(cache[path]['hash'])
+
+    if len(hashes) > 0:
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+    return hashlib.md5(''.join(hashes).encode()).hexdigest()
+
+
+def compact_dtypes(df):
+    """ Return the dataframe with the storage dtypes applied to the known columns """
+    types = {}
+    for col in CATEGORICAL_COLUMNS + CODED_COLUMNS:
+        if col in df.columns and df[col].dtype == object:
+            types[col] = 'category'
+    for col, t in NUMERIC_DTYPES.items():
+        if col in df.columns and df[col].dtype.kind in 'iu':
+            # downcast only if no overflow happens
+            info = np.iinfo(t)
+            if df[col].min() >= info.min and df[col].max() <= info.max:
+                types[col] = t
+    return df.astype(types) if len(types) > 0 else df
+
+
+def restore_dtypes(df, keep_categorical):
+    """ Decode the categorical and dictionary-encoded columns back to strings, unless keep_categorical is True """
+    if keep_categorical:
+        return df
+    # NOTE: categorical columns make groupby return the cartesian product of the categories (observed=False),
+    # so the categorical and the coded columns are decoded by default
+    types = {col: object for col in CATEGORICAL_COLUMNS + CODED_COLUMNS
+             if col in df.columns and df[col].dtype.name == 'category'}
+    return df.astype(types) if len(types) > 0 else df
+
+
+def save_df(df, csv_path, index=True, fmt=None, write_csv=None):
+    """
+    Save a dataframe in the columnar format (and in csv if write_csv is True).
+    csv_path (str): historical csv path of the dataframe
+    index (bool): whether to save or not the index
+    write_csv (bool): whether to write also the csv, if None WRITE_CSV is used
+    """
+    fmt = fmt or FORMAT
+    if fmt != 'csv' and not _pyarrow_available():
+        fmt = 'csv'
+    write_csv = WRITE_CSV if write_csv is None else write_csv
+    check_folder(csv_path)
+    if write_csv or fmt == 'csv':
+        df.to_csv(csv_path, index=index)
+    if fmt == 'csv':
+        return
+
+    out = compact_dtypes(df)
+    if index:
+        out = out.rename_axis(INDEX_COL).reset_index()
+    else:
+        out = out.reset_index(drop=True)
+    # columnar formats require string column names
+    out.columns = out.columns.astype(str)
+
+    path = columnar_path(csv_path, fmt)
+    if fmt == 'parquet':
+        out.to_parquet(path, index=False)
+    else:
+        out.to_feather(path)
+
+
+def load_df(csv_path, columns=None, index_col=0, fmt=None, keep_categorical=False, **csv_kwargs):
+    """
+    Load a dataframe saved with save_df, falling back to the csv if the columnar copy is missing.
+    csv_path (str): historical csv path of the dataframe
+    columns (list): columns to load (None to load all of them)
+    index_col (int): same as in pd.read_csv, 0 if the index was saved, None otherwise
+    keep_categorical (bool): whether to keep the columns stored as categorical (action_type, platform, city,
+        device, user_id and session_id) as categorical, otherwise they are decoded back to strings
+    csv_kwargs: additional arguments passed to pd.read_csv in case of fallback
+    """
+    fmt = fmt or FORMAT
+    path = columnar_path(csv_path, fmt) if fmt != 'csv' else None
+    if path is None or not os.path.isfile(path) or not _pyarrow_available():
+        if columns is not None:
+            wanted = set(columns)
+            # keep also the first column if it is the index
+            csv_kwargs['usecols'] = lambda c: c in wanted or (index_col is not None and c.startswith('Unnamed: 0'))
+        return pd.read_csv(csv_path, index_col=index_col, **csv_kwargs)
+
+    proj = None
+    if columns is not None:
+        proj = list(columns)
+        if index_col is not None:
+            proj = [INDEX_COL] + proj
+    if fmt == 'parquet':
+        df = pd.read_parquet(path, columns=proj)
+    else:
+        df = pd.read_feather(path, columns=proj)
+
+    if index_col is not None and INDEX_COL in df.columns:
+        df = df.set_index(INDEX_COL).rename_axis(None)
+    return restore_dtypes(df, keep_categorical)
+
+
+class ChunkWriter(object):
+    """
+    Write a dataframe chunk by chunk, without keeping it all in memory. The chunks must have the same columns.
+    The parquet copy is appended one row group per chunk: its schema is fixed by the first chunk, and the next
+    chunks are cast to it (a value that does not fit raises an error). Feather does not support appending, so
+    in that case the columnar copy is created from the csv when the writer is closed. Without pyarrow only the
+    csv is written.
+    """
+
+    def __init__(self, csv_path, index=True, fmt=None, write_csv=None):
+        self.csv_path = csv_path
+        self.index = index
+        self.fmt = fmt or FORMAT
+        self.write_csv = WRITE_CSV if write_csv is None else write_csv
+        if self.fmt != 'csv' and not _pyarrow_available():
+            self.fmt = 'csv'
+        if self.fmt == 'feather':
+            # the feather copy is converted from the csv
+            self.write_csv = True
+        self._header = True
+        self._parquet_writer = None
+        self._schema = None
+        check_folder(csv_path)
+        path = columnar_path(csv_path, self.fmt) if self.fmt != 'csv' else None
+        if path is not None and os.path.isfile(path):
+            os.remove(path)
+
+    def write(self, df):
+        if self.write_csv or self.fmt == 'csv':
+            df.to_csv(self.csv_path, index=self.index, header=self._header, mode='w' if self._header else 'a')
+        if self.fmt == 'parquet':
+            self._write_parquet(df)
+        self._header = False
+
+    def _write_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._schema is None:
+            out = compact_dtypes(df)
+        else:
+            # the dtypes of the first chunk are in the schema: the numeric columns are cast by pyarrow below,
+            # which checks that the values fit, instead of being downcast again on the range of this chunk
+            out = df.astype({c: 'category' for c in CATEGORICAL_COLUMNS + CODED_COLUMNS
+                             if c in df.columns and df[c].dtype == object})
+        if self.index:
+            out = out.rename_axis(INDEX_COL).reset_index()
+        else:
+            out = out.reset_index(drop=True)
+        out.columns = out.columns.astype(str)
+        table = pa.Table.from_pandas(out, preserve_index=False)
+        if self._schema is None:
+            # widen the dictionary indices, the next chunks can have more categories
+            fields = [pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type))
+                      if pa.types.is_dictionary(f.type) else f for f in table.schema]
+            self._schema = pa.schema(fields, metadata=table.schema.metadata)
+            self._parquet_writer = pq.ParquetWriter(columnar_path(self.csv_path, 'parquet'), self._schema)
+        self._parquet_writer.write_table(table.cast(self._schema))
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self.fmt == 'feather':
+            convert_csv(self.csv_path, index_col=0 if self.index else None, fmt='feather')
+
+
+def convert_csv(csv_path, index_col=0, fmt=None):
+    """ Create the columnar copy of an existing csv """
+    fmt = fmt or FORMAT
+    print('converting {}...'.format(csv_path), flush=True)
+    df = pd.read_csv(csv_path, index_col=index_col)
+    save_df(df, csv_path, index=index_col is not None, fmt=fmt, write_csv=False)
+    print('Done!')
+
+
+if __name__ == '__main__':
+    import utils.menu as menu
+    import data
+
+    mode = menu.mode_selection()
+    cluster = menu.cluster_selection()
+
+    if menu.yesno_choice('Do you want to convert also the full dataframe?') == 'y':
+        convert_csv(data.FULL_PATH)
+    for name in ['train.csv', 'test.csv']:
+        convert_csv('dataset/preprocessed/{}/{}/{}'.format(cluster, mode, name))
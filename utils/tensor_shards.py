@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+from utils.check_folder import check_folder
+
+"""
+Binary format of the tensors of the RNN datasets: the samples of a tensor of shape (samples, ...) are saved
+in float32 .npy shards of samples_per_shard samples each (the last one can be shorter), described by a json
+manifest. The shards are opened as memory maps, so any range of samples is read without scanning the
+previous ones.
+"""
+
+SAMPLES_PER_SHARD = 8192
+
+
+def manifest_path(path, name):
+    return os.path.join(path, '{}_manifest.json'.format(name))
+
+
+def write_shards(path, name, tensor, samples_per_shard=SAMPLES_PER_SHARD, dtype=np.float32, index=None):
+    """
+    Save a tensor (samples, ...) in shards named <name>_<shard number>.npy and its manifest
+    index: optional array with one value for each sample (eg: the indices of the target rows), saved as well
+    """
+    chunks = ((tensor[start:start + samples_per_shard],
+               None if index is None else index[start:start + samples_per_shard])
+              for start in range(0, len(tensor), samples_per_shard))
+    write_chunks(path, name, chunks, samples_per_shard=samples_per_shard, dtype=dtype)
+
+
+def write_chunks(path, name, chunks, samples_per_shard=SAMPLES_PER_SHARD, dtype=np.float32):
+    """
+    Save a tensor given as consecutive chunks of samples, one shard for each chunk, so that only a chunk is in
+    memory at once (see write_shards)
+    chunks: iterable of couples (samples, index of the samples or None)
+    """
+    check_folder(path, point_allowed_path=True)
+    files, lengths, indices = [], [], []
+    sample_shape = []
+    for i, (samples, index) in enumerate(chunks):
+        shard = np.ascontiguousarray(samples, dtype=dtype)
+        filename = '{}_{:05d}.npy'.format(name, i)
+        np.save(os.path.join(path, filename), shard)
+        files.append(filename)
+        lengths.append(len(shard))
+        sample_shape = list(shard.shape[1:])
+        if index is not None:
+            indices.append(np.asarray(index))
+    manifest = {
+        'name': name,
+        'samples': int(sum(lengths)),
+        'sample_shape': sample_shape,
+        'dtype': np.dtype(dtype).name,
+        'samples_per_shard': samples_per_shard,
+        'shards': files,
+        'lengths': lengths,
+        'index': None,
+    }
+    if len(indices) > 0:
+        manifest['index'] = '{}_index.npy'.format(name)
+        np.save(os.path.join(path, manifest['index']), np.concatenate(indices))
+    with open(manifest_path(path, name), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print('{}: {} samples saved in {} shards'.format(name, manifest['samples'], len(files)), flush=True)
+
+
+def shards_exist(path, name, sources=()):
+    """ Return True if the shards exist and are not older than the source files (eg: the csv) """
+    manifest = manifest_path(path, name)
+    if not os.path.isfile(manifest):
+        return False
+    mtime = os.path.getmtime(manifest)
+    return all(os.path.getmtime(s) <= mtime for s in sources if os.path.isfile(s))
+
+
+class ShardedTensor(object):
+    """ Read-only view of a sharded tensor, with the shards opened as memory maps when first accessed """
+
+    def __init__(self, path, name):
+        with open(manifest_path(path, name), 'r') as f:
+            self.manifest = json.load(f)
+        self.path = path
+        self.shape = tuple([self.manifest['samples']] + self.manifest['sample_shape'])
+        self.dtype = np.dtype(self.manifest['dtype'])
+        # the samples of the i-th shard are in [offsets[i], offsets[i+1])
+        self.offsets = np.concatenate([[0], np.cumsum(self.manifest['lengths'])]).astype(np.int64)
+        self._shards = [None] * len(self.manifest['shards'])
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def shard_count(self):
+        return len(self._shards)
+
+    def shard(self, i):
+        if self._shards[i] is None:
+            self._shards[i] = np.load(os.path.join(self.path, self.manifest['shards'][i]), mmap_mode='r')
+        return self._shards[i]
+
+    def index(self):
+        """ Return the array saved with the tensor (one value for each sample), None if missing """
+        if self.manifest['index'] is None:
+            return None
+        return np.load(os.path.join(self.path, self.manifest['index']))
+
+    def get(self, start, end):
+        """ Return the samples in [start, end) as an in-memory array """
+        end = min(end, len(self))
+        first = np.searchsorted(self.offsets, start, side='right') - 1
+        parts = []
+        i = first
+        while start < end:
+            shard_end = min(end, self.offsets[i + 1])
+            parts.append(self.shard(i)[start - self.offsets[i]:shard_end - self.offsets[i]])
+            start = shard_end
+            i += 1
+        if len(parts) == 1:
+            return np.array(parts[0])
+        return np.concatenate(parts) if len(parts) > 0 else np.empty((0,) + self.shape[1:], dtype=self.dtype)